@@ -0,0 +1,44 @@
+"""
+Compare apply_record_metadata, record by record, with apply_batch_metadata over
+chunks of the size the bulk ingest paths post. Run from the repository root:
+
+    python -m benchmarks.record_metadata [record_count] [chunk_size]
+"""
+import sys
+from timeit import timeit
+
+from services.web.project.data_utils import (
+    apply_batch_metadata,
+    apply_record_metadata,
+    chunked,
+    demographics_record
+)
+from services.web.project.processor import BULK_CHUNK_SIZE
+
+REPEAT = 9  # runs of each, interleaved; the best of each is reported
+
+
+def main(record_count=10000, chunk_size=BULK_CHUNK_SIZE):
+    records = [demographics_record("benchmark") for _ in range(record_count)]
+
+    def per_record():
+        for record in records:
+            apply_record_metadata(record, "benchmark")
+
+    def per_chunk():
+        for chunk in chunked(records, chunk_size):
+            apply_batch_metadata(chunk, "benchmark")
+
+    per_record_times, per_chunk_times = [], []
+    for _ in range(REPEAT):
+        per_record_times.append(timeit(per_record, number=1))
+        per_chunk_times.append(timeit(per_chunk, number=1))
+    per_record_time, per_chunk_time = min(per_record_times), min(per_chunk_times)
+    print(f"{record_count} records, chunks of {chunk_size}")
+    print(f"apply_record_metadata: {per_record_time:.4f}s")
+    print(f"apply_batch_metadata:  {per_chunk_time:.4f}s")
+    print(f"speedup: {per_record_time / per_chunk_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,72 @@
+"""
+Compare loading coarse-match candidates as Demographic ORM instances with
+loading them as RecordViews from a query of MATCH_COLUMNS, in memory held and
+in time to build, per candidate. Run from the repository root:
+
+    python -m benchmarks.record_view [record_count]
+"""
+import sys
+from time import perf_counter
+import tracemalloc
+
+from sqlalchemy import insert, select
+
+from services.web.project.app import app
+from services.web.project.data_utils import demographics_record
+from services.web.project.model import db, Demographic
+from services.web.project.record_view import MATCH_COLUMNS, RecordView
+
+REPEAT = 5
+
+
+def measure(load) -> (float, int):
+    """
+    :param load: a callable loading every candidate
+    :return seconds, size: the best time of REPEAT loads, and the bytes held by
+    one load's candidates
+    """
+    seconds = min(_time(load) for _ in range(REPEAT))
+    db.session.expunge_all()
+    tracemalloc.start()
+    candidates = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del candidates
+
+    return seconds, size
+
+
+def _time(load) -> float:
+    db.session.expunge_all()
+    start = perf_counter()
+    load()
+
+    return perf_counter() - start
+
+
+def main(record_count=10000):
+    with app.app_context():
+        db.create_all()
+        records = [demographics_record("benchmark") for _ in range(record_count)]
+        db.session.execute(insert(Demographic), records)
+        db.session.commit()
+        results = {
+            "Demographic": measure(
+                lambda: db.session.execute(select(Demographic)).scalars().all()
+            ),
+            "RecordView": measure(
+                lambda: [RecordView(*row) for row in db.session.execute(select(*MATCH_COLUMNS))]
+            ),
+        }
+    print(f"{record_count} candidates")
+    for name, (seconds, size) in results.items():
+        print(
+            f"{name + ':':13}{seconds / record_count * 1e6:8.2f}us "
+            f"{size / record_count:8.0f} bytes per candidate"
+        )
+    (orm_seconds, orm_size), (view_seconds, view_size) = results.values()
+    print(f"time: {orm_seconds / view_seconds:.2f}x, memory: {orm_size / view_size:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,9 @@
+from project.block_index import BLOCK_INDEX
+
+
+def post_worker_init(worker):
+    """
+    Each gunicorn worker warms its own block index once it has forked, so the
+    CLI commands and the master process never load one
+    """
+    BLOCK_INDEX.start()
@@ -1,8 +1,15 @@
 import click
 from flask.cli import FlaskGroup
 from project import app, COUPLER, Auditor
+from project.block_index import BLOCK_INDEX
+from project.blocking import rebuild_blocks
+from project.engine import lsh_indexed
+from project.features import rebuild_features
+from project.jobs import JOB_POLL, JobWorker
+from project.loader import CHUNK_SIZE, FILE_FORMATS, load_file, WORKERS
 from project.logger import version
-from project.model import db
+from project.model import db, sync_etl_id_seq
+from project.processor import NEIGHBORHOOD_WINDOW, rematch_network
 
 cli = FlaskGroup(app)
 
@@ -12,6 +19,14 @@ def create_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    sync_etl_id_seq()
+
+
+@cli.command("sync_etl_ids")
+def empi_sync_etl_ids():
+    with app.app_context():
+        sync_etl_id_seq()
+    click.echo('etl_id_seq starts after every recorded ETL ID')
 
 
 @cli.command('post')
@@ -71,6 +86,80 @@ def empi_post(
     click.echo(f'{response}')
 
 
+@cli.command('load')
+@click.argument('path')
+@click.option('--user', default="CLI",
+              help='named system user')
+@click.option('--file_format', default=None,
+              type=click.Choice(FILE_FORMATS),
+              help='the file format; by default read from the extension')
+@click.option('--chunk_size', default=CHUNK_SIZE,
+              help='demographic records posted per chunk')
+@click.option('--workers', default=WORKERS,
+              help='worker processes posting chunks')
+@click.option('--initial_load', is_flag=True, default=False,
+              help='leave the records inactive for build_network')
+@click.option('--checkpoint', default=None,
+              help='checkpoint file to resume from; default PATH.checkpoint')
+def empi_load(
+    path,
+    checkpoint,
+    chunk_size,
+    file_format,
+    initial_load,
+    user,
+    workers
+):
+    metrics = load_file(
+        path,
+        user,
+        version,
+        file_format=file_format,
+        chunk_size=chunk_size,
+        workers=workers,
+        initial_load=initial_load,
+        checkpoint_path=checkpoint
+    )
+    click.echo(f'{metrics}')
+
+
+@cli.command('worker')
+@click.option('--worker_id', default=None,
+              help='unique worker name; default hostname:pid')
+@click.option('--poll_interval', default=JOB_POLL,
+              help='seconds to wait for a job when the queue is empty')
+@click.option('--burst', is_flag=True, default=False,
+              help='stop once the queue is empty')
+def empi_worker(burst, poll_interval, worker_id):
+    BLOCK_INDEX.start()  # each job worker warms its own block index
+    JobWorker(worker_id=worker_id, poll_interval=poll_interval).run(burst=burst)
+
+
+@cli.command('index_blocks')
+def empi_index_blocks():
+    with app.app_context():
+        block_count = rebuild_blocks(lsh=lsh_indexed())
+    click.echo(f'{block_count} blocking keys indexed')
+
+
+@cli.command('apply_features')
+def empi_apply_features():
+    with app.app_context():
+        record_count = rebuild_features()
+    click.echo(f'{record_count} records given features')
+
+
+@cli.command('rematch')
+@click.option('--user', default="CLI",
+              help='named system user')
+@click.option('--window', default=NEIGHBORHOOD_WINDOW,
+              help='records compared at once in each sorted pass')
+def empi_rematch(user, window):
+    with Auditor(user, version, "rematch_network") as job_auditor:
+        metrics = rematch_network({"window": window}, job_auditor)
+    click.echo(f'{metrics}')
+
+
 @cli.command('get')
 @click.argument('endpoint')
 @click.option('--transaction_key', default=None,
@@ -1,12 +1,29 @@
-from flask import jsonify, request, send_from_directory
-import threading
+from flask import jsonify, request, Response, send_from_directory
+import gzip
+import io
+import json
+import time
 from werkzeug.exceptions import BadRequest
 
 from .app import app
 from .auditor import Auditor
 from .coupler import COUPLER
+from .data_utils import iter_ndjson
+from .jobs import enqueue_job
 from .logger import DEBUG_ROUTE, timeit, version
-from .validators import DemographicsGetValidator
+from .pool import POST_POOL
+from .processor import batch_progress, demographic_stream
+from .validators import (
+    BatchProgressValidator,
+    DemographicsGetValidator,
+    DemographicsStreamValidator
+)
+
+PROGRESS_INTERVAL = 1  # seconds between reads of a batch's progress
+PROGRESS_KEEPALIVE = 15  # seconds an event stream may stay quiet
+PROGRESS_WAIT = 60  # the longest a long-poll is held open, in seconds
+PROGRESS_STREAM = 600  # the longest an event stream is held open, in seconds
+PROGRESS_FINAL = ("COMPUTED", "FAILED")  # the batch statuses which end a wait
 
 
 @app.route("/")
@@ -39,22 +56,42 @@ def post(payload: dict, endpoint: str) -> dict:
     :param payload: the user-initiated data payload to POST with
     :param endpoint: a string denoting the endpoint invoked
     :return response: a json containing your request locator and a status message
-    The auditor provides context management and threading for a POST request
+    The auditor provides context management for a POST request, which is queued
+     for a worker process when JOB_QUEUE is set, and otherwise given a thread of
+     the POST_POOL; when the pool is full the response is busy, with no batch,
+     and when the job cannot be queued it is busy, with the FAILED batch
     """
     user = payload['user']
+    if app.config["JOB_QUEUE"]:
+        queued = False
+        with Auditor(user, version, endpoint) as job_auditor:
+            enqueue_job(job_auditor, endpoint, payload)
+            queued = True
+        if not queued:
+            print(f"POST to {endpoint} refused: the job could not be queued", file=DEBUG_ROUTE)
+            return {"batch_key": job_auditor.batch_id, "status": 503}
+        return {"batch_key": job_auditor.batch_id, "status": 200}
+    if not POST_POOL.admit():
+        print(f"POST to {endpoint} refused: the worker pool is full", file=DEBUG_ROUTE)
+        return {"batch_key": None, "status": 503}
     processor = COUPLER[endpoint]['processor']
-    with Auditor(user, version, endpoint) as job_auditor:
-        thread = threading.Thread(
-            target=processor,
-            args=(payload, job_auditor)
-        )
-        thread.start()
+    submitted = False
+    try:
+        with Auditor(user, version, endpoint) as job_auditor:
+            job_auditor.queue()
+            POST_POOL.submit(job_auditor.run, processor, payload)
+            submitted = True
+    finally:
+        if not submitted:
+            POST_POOL.release()
     try:
         batch_key = job_auditor.batch_id
         response = 200
     except AttributeError:
         batch_key = None
         response = 405
+    if not submitted:
+        response = 405
     response = {
         "batch_key": batch_key,
         "status": response
@@ -93,6 +130,8 @@ def process_payload():
     else:
         print(f"Invalid request payload: {msg}", file=DEBUG_ROUTE)
         return jsonify(status=405, response=msg)
+    if method == "POST" and response["status"] == 503:
+        return jsonify(status=503, response=response), 503, {"Retry-After": "1"}
     if response is not None:
         return jsonify(status=200, response=response)
     else:
@@ -103,6 +142,126 @@ def process_payload():
         return jsonify(status=405, response=response)
 
 
+@app.route(f"/api_{version}/demographic_stream", methods=["POST"])
+@timeit
+def stream_payload():
+    """
+    :return jsonify(status, response): a JSON object containing the HTTP status and response object
+    Demographics are POSTed as newline-delimited JSON, one record per line, with
+    the user in the query string (?user=...). Send Content-Encoding: gzip for a
+    gzipped body. The body is parsed as it arrives and posted in bounded chunks.
+    Add &initial_load=true to leave the records inactive for build_network.
+    """
+    params = request.args.to_dict()
+    result, msg = DemographicsStreamValidator().validate(params)
+    if not result:
+        print(f"Invalid request parameters: {msg}", file=DEBUG_ROUTE)
+        return jsonify(status=405, response=msg)
+    body = request.stream
+    if request.content_encoding == "gzip":
+        body = gzip.GzipFile(fileobj=body, mode="rb")
+    records = iter_ndjson(io.TextIOWrapper(body, encoding="utf-8"))
+    metrics = None
+    with Auditor(params["user"], version, "demographic") as job_auditor:
+        metrics = demographic_stream(
+            records, 
+            job_auditor, 
+            initial_load=params.get("initial_load") in ("1", "true")
+        )
+    if metrics is None:  # the Auditor has logged the broken stream
+        return jsonify(
+            status=405,
+            response={"batch_key": job_auditor.batch_id, "status": 405}
+        )
+    response = {
+        "batch_key": job_auditor.batch_id,
+        "metrics": metrics,
+        "status": 200
+    }
+
+    return jsonify(status=200, response=response)
+
+
+def progress_events(batch_id: int):
+    """
+    :param batch_id: the unique locator for the API request
+    :return event: a Server-Sent Event each time the batch's progress changes,
+     until it is COMPUTED or FAILED, with a comment line to keep quiet
+     connections open
+    A stream is closed with a "timeout" event after PROGRESS_STREAM seconds, so
+     a stuck batch cannot hold a worker; an EventSource then reconnects
+    """
+    last_key = None
+    quiet = 0
+    deadline = time.monotonic() + PROGRESS_STREAM
+    while True:
+        progress = batch_progress(batch_id)
+        if progress is None:
+            yield "event: missing\ndata: null\n\n"
+            return
+        key = (progress["batch_status"], progress["pending_count"], progress["settled_count"])
+        if key != last_key:
+            yield f"data: {json.dumps(progress)}\n\n"
+            last_key = key
+            quiet = 0
+        elif quiet >= PROGRESS_KEEPALIVE:
+            yield ": keep-alive\n\n"
+            quiet = 0
+        if progress["batch_status"] in PROGRESS_FINAL:
+            return
+        if time.monotonic() >= deadline:
+            yield "event: timeout\ndata: null\n\n"
+            return
+        time.sleep(PROGRESS_INTERVAL)
+        quiet += PROGRESS_INTERVAL
+
+
+@app.route(f"/api_{version}/batch_progress", methods=["GET"])
+def progress_payload():
+    """
+    :return jsonify(status, response): a JSON object containing the HTTP status and response object
+    The progress of a batch is read from its running counts, with the user and
+    batch_id in the query string (?user=...&batch_id=...). Send
+    Accept: text/event-stream for a Server-Sent Event on every change until the
+    batch is COMPUTED or FAILED, for up to PROGRESS_STREAM seconds. Otherwise add &since=<settled_count>&wait=<seconds> to
+    long-poll until the batch moves past the settled_count already seen.
+    """
+    params = request.args.to_dict()
+    result, msg = BatchProgressValidator().validate(params)
+    if not result:
+        print(f"Invalid request parameters: {msg}", file=DEBUG_ROUTE)
+        return jsonify(status=405, response=msg)
+    batch_id = int(params["batch_id"])
+    if request.accept_mimetypes.best == "text/event-stream":
+        return Response(
+            progress_events(batch_id),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    progress = batch_progress(batch_id)
+    if "since" in params:
+        since = int(params["since"])
+        deadline = time.monotonic() + min(int(params.get("wait", 0)), PROGRESS_WAIT)
+        while progress is not None and progress["settled_count"] <= since and \
+                progress["batch_status"] not in PROGRESS_FINAL and \
+                time.monotonic() < deadline:
+            time.sleep(PROGRESS_INTERVAL)
+            progress = batch_progress(batch_id)
+    if progress is None:
+        return jsonify(status=405, response=progress)
+
+    return jsonify(status=200, response=progress)
+
+
+@app.route(f"/api_{version}/worker_pool", methods=["GET"])
+def pool_payload():
+    """
+    :return jsonify(status, response): a JSON object containing the HTTP status and response object
+    The queue depth and utilization of this app process's POST_POOL
+    """
+    return jsonify(status=200, response=POST_POOL.metrics())
+
+
 # register all API endpoints on service start
 for end_point, couplings in COUPLER.items():
     app.add_url_rule(
@@ -8,6 +8,19 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite://")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     STATIC_FOLDER = f"{os.getenv('APP_FOLDER')}/project/static"
+    # POST processors run on a bounded pool of threads in each app process
+    POST_WORKERS = int(os.getenv("POST_WORKERS", "8"))
+    POST_QUEUE_SIZE = int(os.getenv("POST_QUEUE_SIZE", "32"))
+    # a processor under a GraphLock holds two connections at once, so the pool
+    # has two for each POST worker and for the request thread
+    if not SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": 2 * (POST_WORKERS + 1), "max_overflow": 10}
+    # or, with JOB_QUEUE=1, POSTs are queued for `manage.py worker` processes
+    JOB_QUEUE = os.getenv("JOB_QUEUE", "0") == "1"
+    # with BLOCK_INDEX=1, each process holds the blocking table in memory
+    BLOCK_INDEX = os.getenv("BLOCK_INDEX", "0") == "1"
+    # the score_battery whose tests score pairs in "battery" mode
+    SCORE_BATTERY = int(os.getenv("SCORE_BATTERY")) if os.getenv("SCORE_BATTERY") else None
 
 
 app = Flask(__name__)
@@ -1,10 +1,14 @@
+from datetime import datetime
 import sys
 
+from sqlalchemy import case, insert
+
 from .app import app
 from .logger import mylogger
 from .model import (
     db,
     Batch,
+    KEY_ALLOCATOR,
     Process,
     key_gen
 )
@@ -37,10 +41,56 @@ class AuditStamp:
             }
             proc_record = Process(**staged_proc_record)  # type: ignore
             db.session.add(proc_record)
+            db.session.query(Batch).\
+                filter(Batch.batch_id == self.batch_id).\
+                update(
+                    {Batch.pending_count: Batch.pending_count + 1},
+                    synchronize_session=False
+                )
             db.session.commit()
 
         return self.proc_id
 
+    def bulk(self, rows: list, proc_status="PENDING") -> list:
+        """
+        :param rows: (row, foreign_record_id) for each record about to be posted
+        :param proc_status: the status of the stamped processes; only PENDING
+         processes are added to the Batch's pending_count
+        :return stamps: (proc_id, transaction_key) for each row, in order
+        Stamps every row at once, with a leased block of process IDs, one INSERT,
+         and one commit
+        """
+        if len(rows) == 0:
+            return []
+        with app.app_context():
+            proc_ids = KEY_ALLOCATOR.take(self.user, self.version, len(rows))
+            stamps = [
+                (proc_id, f"{self.batch_id}_{proc_id}") for proc_id in proc_ids
+            ]
+            staged_proc_records = [
+                {
+                    "batch_id": self.batch_id,
+                    "proc_id": proc_id,
+                    "proc_status": proc_status,
+                    "transaction_key": transaction_key,
+                    "row": row,
+                    "foreign_record_id": foreign_record_id
+                }
+                for (proc_id, transaction_key), (row, foreign_record_id)
+                in zip(stamps, rows)
+            ]
+            db.session.execute(insert(Process), staged_proc_records)
+            if proc_status == "PENDING":
+                db.session.query(Batch).\
+                    filter(Batch.batch_id == self.batch_id).\
+                    update(
+                        {Batch.pending_count: Batch.pending_count + len(rows)},
+                        synchronize_session=False
+                    )
+            db.session.commit()
+
+        return stamps
+
     def __str__(self):
         return f"<AuditStamp: \
 {self.batch_id}:{self.proc_id}:{self.record_id}:{self.row}:{self.user}>"
@@ -58,12 +108,31 @@ class Auditor:
         staged_batch_record = {
             "batch_id": self.batch_id,
             "batch_action": self.action,
-            "batch_status": "STARTING"
+            "batch_status": "STARTING",
+            "batch_ts": datetime.now()
         }
         batch_record = Batch(**staged_batch_record)  # type: ignore
         db.session.add(batch_record)
         db.session.commit()
 
+    @classmethod
+    def for_batch(cls, batch_id, user, version, action):
+        """
+        :param batch_id: the key of a Batch which already exists
+        :param user: the username issuing the command
+        :param version: the software version employed at the time
+        :param action: the batch action
+        :return auditor: an entered Auditor which stamps processes on the batch
+        For workers carrying on a batch that was opened elsewhere
+        """
+        auditor = cls.__new__(cls)
+        auditor.user = user
+        auditor.version = version
+        auditor.action = action
+        auditor.batch_id = batch_id
+
+        return auditor.__enter__()
+
     def __enter__(self):
         self.stamp = AuditStamp(self.batch_id, self.user, self.version)
 
@@ -76,11 +145,77 @@ class Auditor:
             print(error_msg, file=sys.stderr)
         else:
             # ToDo: wrap QC/exit strategy on activities here
-            db.session.query(Batch).filter(Batch.batch_id == self.batch_id).\
-                update({Batch.batch_status: "PENDING"}, synchronize_session=False)
-            db.session.commit()
+            # a batch already queued, streaming, or computed keeps its status
+            self.close("STARTING")
 
         return "ok"
 
+    def queue(self):
+        """
+        Hands the batch off to a worker: it stays QUEUED, rather than being closed
+         as the Auditor exits, until the worker closes it with run()
+        """
+        db.session.query(Batch).\
+            filter(
+                Batch.batch_id == self.batch_id,
+                Batch.batch_status == "STARTING"
+            ).\
+            update({Batch.batch_status: "QUEUED"}, synchronize_session=False)
+        db.session.commit()
+
+    def close(self, batch_status: str):
+        """
+        :param batch_status: the status the batch is closed from
+        No more processes are stamped on a closed batch: it is COMPUTED if none are
+         pending, and PENDING until they are
+        """
+        db.session.query(Batch).\
+            filter(
+                Batch.batch_id == self.batch_id,
+                Batch.batch_status == batch_status
+            ).\
+            update(
+                {Batch.batch_status: case(
+                    (Batch.pending_count <= 0, "COMPUTED"),
+                    else_="PENDING"
+                )},
+                synchronize_session=False
+            )
+        db.session.commit()
+
+    def fail(self, batch_status: str):
+        """
+        :param batch_status: the status the batch is failed from
+        The batch is FAILED, whatever its processes: its processor raised and no
+         retry will follow
+        """
+        db.session.query(Batch).\
+            filter(
+                Batch.batch_id == self.batch_id,
+                Batch.batch_status == batch_status
+            ).\
+            update({Batch.batch_status: "FAILED"}, synchronize_session=False)
+        db.session.commit()
+
+    def run(self, processor, payload: dict, final=True):
+        """
+        :param processor: the processor of a QUEUED batch
+        :param payload: the user-initiated data payload to POST with
+        :param final: fail the batch if the processor fails, as no retry will
+         follow; otherwise the caller decides
+        :return response: the processor's response
+        Runs in the worker which took the batch off the queue
+        """
+        with app.app_context():
+            try:
+                response = processor(payload, self)
+            except Exception:
+                if final:
+                    self.fail("QUEUED")
+                raise
+            self.close("QUEUED")
+
+        return response
+
     def __str__(self):
         return f"<Auditor: {self.version}:{self.stamp}>"
@@ -0,0 +1,196 @@
+from array import array
+import json
+import os
+from select import select as wait_readable
+import threading
+import time
+
+from sqlalchemy import select, text
+
+from .app import app
+from .logger import DEBUG_ROUTE, mylogger
+from .model import db, Blocking, Demographic
+
+BLOCK_CHANNEL = "block_index"  # the Postgres NOTIFY channel of index changes
+BLOCK_NOTIFY_LIMIT = 7900  # bytes of a NOTIFY payload; a larger change is reloaded
+BLOCK_RETRY = 5  # seconds before a dropped listener reconnects and reloads
+
+
+class BlockIndex:
+    """
+    The BlockIndex holds the blocking table in memory, as a compact array of
+    the active record IDs in each block, so that candidate IDs are found
+    without a round trip. Each worker process loads it once, in the background;
+    until it is ready, lookups return None and the table is read instead.
+    A change to the active records is applied locally once it is committed,
+    and broadcast with NOTIFY on Postgres, where every other worker's listener
+    applies it too.
+    """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.blocks = dict()
+        self.lock = threading.Lock()
+        self.ready = False
+        self.thread = None
+
+    def start(self):
+        """
+        Warms the index in a background thread, which then listens for changes
+        """
+        if not self.enabled or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        """
+        Forgets the index, e.g. in a forked process which inherited it without
+        its listener; lookups read the table until it is started again
+        """
+        with self.lock:
+            self.blocks = dict()
+            self.ready = False
+        self.thread = None
+
+    def load(self):
+        """
+        Reads the active blocks in an app context of its own, whose session is
+        committed and removed at once, so no transaction stays open after it
+        """
+        blocks = dict()
+        query = select(Blocking.block_key, Blocking.record_id).\
+            join(Demographic, Demographic.record_id == Blocking.record_id).\
+            where(Demographic.is_active.is_(True))
+        with app.app_context():
+            for block_key, record_id in db.session.execute(query):
+                blocks.setdefault(block_key, array("q")).append(record_id)
+            db.session.commit()
+            db.session.remove()
+        with self.lock:
+            self.blocks = blocks
+            self.ready = True
+        print(f"block index loaded {len(blocks)} blocks", file=DEBUG_ROUTE)
+
+    def apply(self, changes: dict, is_active: bool):
+        """
+        :param changes: the block keys of each record changed
+        :param is_active: whether the records were activated or deactivated
+        Applying a change twice leaves the index as applying it once
+        """
+        with self.lock:
+            for record_id, block_keys in changes.items():
+                record_id = int(record_id)
+                for block_key in block_keys:
+                    block = self.blocks.get(block_key)
+                    if is_active:
+                        if block is None:
+                            self.blocks[block_key] = array("q", [record_id])
+                        elif record_id not in block:
+                            block.append(record_id)
+                    elif block is not None and record_id in block:
+                        block.remove(record_id)
+                        if len(block) == 0:
+                            del self.blocks[block_key]
+
+    def candidates(self, block_keys: list, record_id: int):
+        """
+        :param block_keys: the blocking keys of the incoming record
+        :param record_id: the incoming record, never its own candidate
+        :return candidate_ids: the set of active records sharing a key with it,
+        or None if the index is not ready
+        """
+        if not self.ready:
+            return None
+        candidate_ids = set()
+        with self.lock:
+            for block_key in block_keys:
+                candidate_ids.update(self.blocks.get(block_key, ()))
+        candidate_ids.discard(record_id)
+
+        return candidate_ids
+
+    def sizes(self, block_keys: list):
+        """
+        :param block_keys: any blocking keys
+        :return block_sizes: the active records in each block, or None if the
+        index is not ready
+        """
+        if not self.ready:
+            return None
+        with self.lock:
+            return {
+                block_key: len(self.blocks[block_key])
+                for block_key in block_keys if block_key in self.blocks
+            }
+
+    def publish(self, record_ids, is_active: bool):
+        """
+        :param record_ids: the records just activated or deactivated
+        :param is_active: their new state
+        Called once the change is committed, in the app context which made it
+        """
+        if not self.enabled:
+            return
+        changes = dict()
+        query = select(Blocking.record_id, Blocking.block_key).\
+            where(Blocking.record_id.in_(list(record_ids)))
+        for record_id, block_key in db.session.execute(query):
+            changes.setdefault(record_id, list()).append(block_key)
+        self.apply(changes, is_active)
+        if db.engine.dialect.name != "postgresql":
+            return
+        payload = json.dumps(
+            {"pid": os.getpid(), "is_active": is_active, "changes": changes}
+        )
+        if len(payload) > BLOCK_NOTIFY_LIMIT:
+            payload = json.dumps({"pid": os.getpid(), "reload": True})
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": BLOCK_CHANNEL, "payload": payload}
+        )
+        db.session.commit()
+
+    def receive(self, message: dict):
+        if message["pid"] == os.getpid():
+            return
+        if message.get("reload"):
+            self.load()
+        else:
+            self.apply(message["changes"], message["is_active"])
+
+    def listen(self):
+        """
+        LISTENs before loading, so no change committed meanwhile is missed; on
+         any error the index stops serving until it has reconnected and reloaded.
+        The LISTEN holds a dedicated AUTOCOMMIT connection, outside any session,
+         so it never sits idle in a transaction.
+        """
+        while True:
+            connection = None
+            try:
+                with app.app_context():
+                    engine = db.engine
+                if engine.dialect.name != "postgresql":
+                    self.load()
+                    return
+                connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+                connection.execute(text(f"LISTEN {BLOCK_CHANNEL}"))
+                listener = connection.connection.driver_connection
+                self.load()
+                while True:
+                    if wait_readable([listener], [], [], BLOCK_RETRY)[0]:
+                        listener.poll()
+                        while listener.notifies:
+                            notify = listener.notifies.pop(0)
+                            self.receive(json.loads(notify.payload))
+            except Exception as error_msg:
+                self.ready = False
+                mylogger.error(f"block index listener failed: {error_msg}")
+                print(error_msg, file=DEBUG_ROUTE)
+            finally:
+                if connection is not None:
+                    connection.invalidate()
+            time.sleep(BLOCK_RETRY)
+
+
+BLOCK_INDEX = BlockIndex(app.config["BLOCK_INDEX"])
@@ -0,0 +1,411 @@
+import datetime
+
+from jellyfish import soundex
+from sqlalchemy import and_, delete, func, or_, select, union
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+
+from .block_index import BLOCK_INDEX
+from .data_utils import chunked, field
+from .logger import DEBUG_ROUTE
+from .lsh import LSH_PREFIX, lsh_keys
+from .model import db, Blocking, BlockSize, Demographic
+from .record_view import MATCH_COLUMNS, RecordView
+
+BLOCK_CHUNK_SIZE = 1000  # blocking rows per INSERT
+BLOCK_SIZE_LIMIT = 1000  # the most records a block may hold before it is split
+
+
+def family_year(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the family name's Soundex and the birth year, or None
+    """
+    family_name, name_day = field(record, "family_name"), field(record, "name_day")
+    if family_name and isinstance(name_day, datetime.date):
+        code = field(record, "family_name_soundex") or soundex(family_name)
+        return f"{code}{name_day.year}"
+
+
+def given_postal(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the first three letters of the given name and of the postal
+    code, or None
+    """
+    given_name, postal_code = field(record, "given_name"), field(record, "postal_code")
+    if given_name and postal_code:
+        return f"{given_name.strip()[:3].upper()}{postal_code.strip()[:3]}"
+
+
+def ssn_month(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the last four digits of the SSN and the birth month, or None
+    """
+    ssn, name_day = field(record, "social_security_number"), field(record, "name_day")
+    digits = "".join(char for char in str(ssn or "") if char.isdigit())
+    if len(digits) >= 4 and isinstance(name_day, datetime.date):
+        return f"{digits[-4:]}{name_day.month:02d}"
+
+
+def name_day_gender(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the name day as "%Y%m%d" and the gender, or None
+    """
+    name_day, gender = field(record, "name_day"), field(record, "gender")
+    if gender and isinstance(name_day, datetime.date):
+        return f"{name_day.year:04d}{name_day.month:02d}{name_day.day:02d}{gender.upper()}"
+
+
+def given_initial(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the initial of the given name, or None
+    """
+    given_name = field(record, "given_name")
+    if given_name and given_name.strip():
+        return given_name.strip()[0].upper()
+
+
+def birth_year(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the year of the name day, or None
+    """
+    name_day = field(record, "name_day")
+    if isinstance(name_day, datetime.date):
+        return f"{name_day.year}"
+
+
+def postal_prefix(record):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return value: the first three characters of the postal code, or None
+    """
+    postal_code = field(record, "postal_code")
+    if postal_code and postal_code.strip():
+        return postal_code.strip()[:3]
+
+
+BLOCKING_KEYS = {  # add a kind of block by naming a function of the record here
+    "family_year": family_year,
+    "given_postal": given_postal,
+    "ssn_month": ssn_month,
+    "name_day_gender": name_day_gender,
+}
+SPLIT_KEYS = {  # the secondary key by which an oversized block of a kind is split
+    "family_year": given_initial,
+    "given_postal": birth_year,
+    "ssn_month": birth_year,
+    "name_day_gender": postal_prefix,
+}
+
+
+def split_blocking_keys(record) -> list:
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return block_keys: a ("kind:value", "kind:value/secondary") pair for each
+    BLOCKING_KEYS function which the record has the fields for; the second is
+    None if it has no field for the kind's SPLIT_KEYS function
+    """
+    block_keys = list()
+    for kind, block_key in BLOCKING_KEYS.items():
+        value = block_key(record)
+        if value is not None:
+            secondary = SPLIT_KEYS[kind](record)
+            block_keys.append((
+                f"{kind}:{value}",
+                f"{kind}:{value}/{secondary}" if secondary is not None else None
+            ))
+
+    return block_keys
+
+
+def blocking_keys(record) -> list:
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return block_keys: every block the record is in, each split block included
+    """
+    return [
+        block_key
+        for block_key_pair in split_blocking_keys(record)
+        for block_key in block_key_pair
+        if block_key is not None
+    ]
+
+
+def index_blocks(records, lsh=False) -> int:
+    """
+    :param records: demographic records just inserted, with their record_id
+    :param lsh: index the LSH band keys alongside the blocking keys, as only the
+    "lsh" mode draws candidates from them
+    :return block_count: the blocking rows added
+    The rows are added to the session's transaction, and the records inserted
+    active are counted in their blocks' sizes; the caller commits
+    """
+    blocking_rows, active_counts = list(), dict()
+    for record in records:
+        for block_key in blocking_keys(record) + (lsh_keys(record) if lsh else []):
+            blocking_rows.append({"block_key": block_key, "record_id": field(record, "record_id")})
+            if field(record, "is_active") is True:
+                active_counts[block_key] = active_counts.get(block_key, 0) + 1
+    for chunk in chunked(blocking_rows, BLOCK_CHUNK_SIZE):
+        db.session.execute(insert(Blocking), chunk)
+    count_blocks(active_counts)
+
+    return len(blocking_rows)
+
+
+def count_blocks(size_changes: dict):
+    """
+    :param size_changes: the change in active records of each block
+    The BlockSize rows are changed in the session's transaction, in key order so
+    concurrent changes lock them in the same order, and a block left with no
+    active records is removed; the caller commits
+    """
+    size_rows = [
+        {"block_key": block_key, "record_count": record_count}
+        for block_key, record_count in sorted(size_changes.items()) if record_count != 0
+    ]
+    for chunk in chunked(size_rows, BLOCK_CHUNK_SIZE):
+        statement = insert(BlockSize).values(chunk)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=["block_key"],
+            set_={"record_count": BlockSize.record_count + statement.excluded.record_count}
+        ))
+    if any(size_row["record_count"] < 0 for size_row in size_rows):
+        db.session.execute(
+            delete(BlockSize).where(
+                BlockSize.block_key.in_(list(size_changes)),
+                BlockSize.record_count <= 0
+            )
+        )
+
+
+def resize_blocks(record_ids, is_active: bool):
+    """
+    :param record_ids: a list of the records about to be activated or
+    deactivated, or a selectable of them
+    :param is_active: their new state
+    Each record not yet in that state is added to, or removed from, the size of
+    each of its blocks. Call it before is_active is updated, in the same
+    transaction; the caller commits
+    """
+    changing = Demographic.is_active.is_not(True) if is_active else Demographic.is_active.is_(True)
+    query = select(Blocking.block_key, func.count()).\
+        join(Demographic, Demographic.record_id == Blocking.record_id).\
+        where(Blocking.record_id.in_(record_ids), changing).\
+        group_by(Blocking.block_key)
+    count_blocks({
+        block_key: record_count if is_active else -record_count
+        for block_key, record_count in db.session.execute(query)
+    })
+
+
+def drop_blocks(record_ids):
+    """
+    :param record_ids: demographic records about to be deleted
+    The rows are removed in the session's transaction, and any record still
+    active is taken out of its blocks' sizes; the caller commits
+    """
+    record_ids = list(record_ids)
+    resize_blocks(record_ids, False)
+    db.session.execute(
+        delete(Blocking).where(Blocking.record_id.in_(record_ids))
+    )
+
+
+def rebuild_blocks(chunk_size=BLOCK_CHUNK_SIZE, lsh=False) -> int:
+    """
+    :param chunk_size: the demographic records read at once
+    :param lsh: index the LSH band keys too, as for index_blocks
+    :return block_count: the blocking rows written
+    Recomputes the whole blocking table and its block sizes, e.g. after
+    BLOCKING_KEYS changes
+    """
+    db.session.execute(delete(Blocking))
+    db.session.execute(delete(BlockSize))
+    block_count, last_record_id = 0, None
+    while True:
+        query = select(Demographic).order_by(Demographic.record_id).limit(chunk_size)
+        if last_record_id is not None:
+            query = query.where(Demographic.record_id > last_record_id)
+        chunk = db.session.execute(query).scalars().all()
+        if len(chunk) == 0:
+            break
+        block_count += index_blocks(chunk, lsh=lsh)
+        last_record_id = chunk[-1].record_id
+    db.session.commit()
+
+    return block_count
+
+
+def block_sizes(block_keys: list) -> dict:
+    """
+    :param block_keys: any blocking keys
+    :return block_sizes: the active records in each block, from the BLOCK_INDEX
+    once it is ready, otherwise from the BlockSize table kept as they change
+    """
+    sizes = BLOCK_INDEX.sizes(block_keys)
+    if sizes is None:
+        query = select(BlockSize.block_key, BlockSize.record_count).\
+            where(BlockSize.block_key.in_(block_keys))
+        sizes = dict(db.session.execute(query).all())
+
+    return sizes
+
+
+def prune_blocks(demographic_record, report: dict) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: counts of the blocks split and skipped, and of the block
+    entries pruned by doing so, are added to this
+    :return block_keys: the blocks to draw candidates from
+    A block of more than BLOCK_SIZE_LIMIT records is replaced by its split on the
+    kind's secondary key, and skipped if that is oversized too. A record pruned
+    from one block may still be a candidate through another.
+    """
+    block_key_pairs = split_blocking_keys(demographic_record)
+    sizes = block_sizes([
+        block_key for block_key_pair in block_key_pairs
+        for block_key in block_key_pair if block_key is not None
+    ])
+    block_keys = list()
+    for block_key, split_key in block_key_pairs:
+        size = sizes.get(block_key, 0)
+        split_size = sizes.get(split_key, 0)
+        if size <= BLOCK_SIZE_LIMIT:
+            block_keys.append(block_key)
+        elif split_key is not None and split_size <= BLOCK_SIZE_LIMIT:
+            block_keys.append(split_key)
+            report["split_count"] += 1
+            report["pruned_count"] += size - split_size
+        else:
+            report["skipped_count"] += 1
+            report["pruned_count"] += size
+    report["block_count"] += len(block_keys)
+
+    return block_keys
+
+
+def keyed_candidates(record_id: int, block_keys: list) -> list:
+    """
+    :param record_id: the incoming record, never its own candidate
+    :param block_keys: the keys of the blocking table to draw candidates from
+    :return coarse_results: a RecordView of every other active record under any
+    of the keys
+    Each key is one lookup on the blocking table's primary key, and the UNION of
+    the lookups returns each candidate once, however many keys it shares. Once
+    the BLOCK_INDEX is ready, the candidate IDs are read from it instead, and
+    only their rows are selected.
+    """
+    if len(block_keys) == 0:
+        return []
+    indexed_ids = BLOCK_INDEX.candidates(block_keys, record_id)
+    if indexed_ids is not None:
+        if len(indexed_ids) == 0:
+            return []
+        candidate_ids = select(Demographic.record_id).\
+            where(Demographic.record_id.in_(indexed_ids)).subquery()
+    else:
+        candidate_ids = union(*[
+            select(Blocking.record_id).where(Blocking.block_key == block_key)
+            for block_key in block_keys
+        ]).subquery()
+    query = select(*MATCH_COLUMNS).\
+        join(candidate_ids, Demographic.record_id == candidate_ids.c.record_id).\
+        where(
+            Demographic.record_id != record_id,
+            Demographic.is_active.is_(True)
+        )
+    coarse_results = [RecordView(*row) for row in db.session.execute(query)]
+    print(f"{len(coarse_results)} candidates in {len(block_keys)} blocks", file=DEBUG_ROUTE)
+
+    return coarse_results
+
+
+def block_candidates(demographic_record, report=None) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: a dict given the counts of the blocks used, split, and
+    skipped, the block entries pruned, and the candidates found
+    :return coarse_results: every other active record sharing a blocking key
+    with it, after oversized blocks are pruned
+    """
+    if report is None:
+        report = dict()
+    report.update(
+        block_count=0, split_count=0, skipped_count=0, pruned_count=0, candidate_count=0
+    )
+    block_keys = prune_blocks(demographic_record, report)
+    coarse_results = keyed_candidates(field(demographic_record, "record_id"), block_keys)
+    report["candidate_count"] = len(coarse_results)
+
+    return coarse_results
+
+
+def lsh_candidates(demographic_record, report=None) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: a dict given the counts of the bands used and of the
+    candidates found
+    :return coarse_results: every other active record sharing an LSH band with
+    it, i.e. likely to have similar names and address despite typos
+    """
+    block_keys = lsh_keys(demographic_record)
+    coarse_results = keyed_candidates(field(demographic_record, "record_id"), block_keys)
+    if report is not None:
+        report.update(block_count=len(block_keys), candidate_count=len(coarse_results))
+
+    return coarse_results
+
+
+def blocked_pairs(record_ids, lsh=False) -> list:
+    """
+    :param record_ids: a selectable of the record IDs being loaded
+    :param lsh: pair on the LSH band keys rather than the BLOCKING_KEYS
+    :return pairs: a list of (record_id_a, record_id_b) for every loaded record
+    and every active or loaded record sharing a block with it
+    The pairs come back from one self-join of the blocking table, limited to
+    the blocks of the loaded records. A block of more than BLOCK_SIZE_LIMIT
+    records is left out, so an oversized block contributes only through its
+    split blocks, as in prune_blocks.
+    """
+    entry_a = aliased(Blocking)
+    entry_b = aliased(Blocking)
+    record_b = aliased(Demographic)
+    if lsh:
+        kind = Blocking.block_key.startswith(LSH_PREFIX)
+    else:
+        kind = ~Blocking.block_key.startswith(LSH_PREFIX)
+    blocks = select(Blocking.block_key).\
+        where(
+            kind,
+            Blocking.block_key.in_(
+                select(Blocking.block_key).where(Blocking.record_id.in_(record_ids))
+            )
+        ).\
+        group_by(Blocking.block_key).\
+        having(func.count() <= BLOCK_SIZE_LIMIT).\
+        subquery()
+    query = select(entry_a.record_id, entry_b.record_id).\
+        join(blocks, entry_a.block_key == blocks.c.block_key).\
+        join(entry_b, entry_b.block_key == entry_a.block_key).\
+        join(record_b, record_b.record_id == entry_b.record_id).\
+        where(
+            entry_a.record_id.in_(record_ids),
+            entry_b.record_id != entry_a.record_id,
+            or_(
+                record_b.is_active.is_(True),
+                and_(
+                    entry_b.record_id.in_(record_ids),
+                    entry_b.record_id > entry_a.record_id
+                )
+            )
+        ).\
+        distinct()
+    pairs = [tuple(pair) for pair in db.session.execute(query)]
+
+    return pairs
@@ -7,6 +7,7 @@ from .validators import (
     DeleteActionValidator,
     DemographicsPostValidator,
     MatchValidator,
+    NetworkBuildValidator,
     RecordIDValidator
 )
 
@@ -61,6 +62,12 @@ COUPLER = {
         'validator': MatchValidator,
         'methods': ['GET', 'POST'],
     },
+    'build_network': {
+        'model': MODEL_MAP['activate_demographic'],
+        'processor': PROCESSOR_MAP['build_network'],
+        'validator': NetworkBuildValidator,
+        'methods': ['POST'],
+    },
     'enterprise_group': {  # ToDo: GET validator for ETL ID
         'model': MODEL_MAP['enterprise_group'],
         'processor': None,
@@ -1,8 +1,13 @@
 import datetime
 from hashlib import sha256
+from itertools import islice
+import json
+from operator import itemgetter, methodcaller
 import random
 import uuid
 
+from .features import column_features, record_features, SEPARATOR
+
 HASH_KEYS = [
     "address_1",
     "address_2",
@@ -17,6 +22,50 @@ HASH_KEYS = [
 ]
 
 
+def chunked(records, chunk_size: int):
+    """
+    :param records: any iterable of records
+    :param chunk_size: the largest number of records to yield at once
+    :return chunk: successive lists of at most chunk_size records
+    """
+    records = iter(records)
+    chunk = list(islice(records, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(records, chunk_size))
+
+
+def field(record, name: str):
+    """
+    :param record: a demographic record, as a dict or as a row
+    :param name: the name of one of its columns
+    :return value: the record's value for that column
+    """
+    if isinstance(record, dict):
+        return record.get(name)
+
+    return getattr(record, name, None)
+
+
+def iter_ndjson(lines):
+    """
+    :param lines: an iterable of newline-delimited JSON lines (str or bytes)
+    :return record: each JSON object in turn, or None for a malformed line
+    Blank lines are skipped; nothing beyond the current line is held in memory
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if type(record) is not dict:
+            record = None
+        yield record
+
+
 def choose(input_list: list):
     return random.choice(input_list)
 
@@ -48,6 +97,56 @@ def apply_hash(record: dict, hash_keys: list):
     return my_hash
 
 
+def composite_names(given_names: list, family_names: list) -> list:
+    """
+    :param given_names: the given names of a chunk of records
+    :param family_names: their family names, in order
+    :return composite_names: the composite_name of each record, as
+    apply_record_metadata gives
+    Where every record has both names, the composites are joined into one
+    buffer whose spaces and hyphens are removed at once.
+    """
+    if all(given_names) and all(family_names):
+        buffer = SEPARATOR.join(map(
+            ":".join,
+            zip(map(itemgetter(slice(5)), given_names), family_names)
+        ))
+        if buffer.count(SEPARATOR) == len(given_names) - 1:
+            return buffer.replace(" ", "").replace("-", "").split(SEPARATOR)
+
+    return [
+        create_composite_name(given_name, family_name)
+        if given_name and family_name else given_name
+        for given_name, family_name in zip(given_names, family_names)
+    ]
+
+
+def composite_name_day_postal_codes(name_days: list, name_day_texts: list, postal_codes: list) -> list:
+    """
+    :param name_days: the name days of a chunk of records
+    :param name_day_texts: their text, as hashed by apply_batch_metadata
+    :param postal_codes: their postal codes, in order
+    :return composite_ndpcs: the composite_name_day_postal_code of each record,
+    as apply_record_metadata gives
+    A date's text is "%Y-%m-%d ..." for any year from 1000 on, so where every
+    record has a postal code and such a date, the "%Y%m%d" of each is sliced
+    from its text and the hyphens of the whole chunk removed in one buffer.
+    """
+    if all(postal_codes) and len(set(map(type, name_days))) == 1 and \
+            isinstance(name_days[0], datetime.date) and min(name_days).year >= 1000:
+        buffer = SEPARATOR.join(map(itemgetter(slice(10)), name_day_texts))
+        return list(map(
+            value_composite,
+            buffer.replace("-", "").split(SEPARATOR),
+            postal_codes
+        ))
+
+    return [
+        create_composite_name_day_postal_code(name_day, postal_code) if postal_code else None
+        for name_day, postal_code in zip(name_days, postal_codes)
+    ]
+
+
 def apply_record_metadata(record, user):
     composite_ndpc = None
     ts = datetime.datetime.now()
@@ -72,12 +171,82 @@ def apply_record_metadata(record, user):
     record["composite_key"] = composite_key
     record["composite_name"] = composite_name
     record["composite_name_day_postal_code"] = composite_ndpc
+    record.update(record_features(record))
     record["touched_by"] = user
     record["touched_ts"] = ts
 
     return record, ts
 
 
+def record_columns(records: list, keys: list) -> dict:
+    """
+    :param records: a chunk of records
+    :param keys: the keys to pivot
+    :return columns: a list of each key's values across the chunk, in order,
+    None where a record lacks the key
+    """
+    columns = dict()
+    for key in keys:
+        try:
+            columns[key] = list(map(itemgetter(key), records))
+        except KeyError:
+            columns[key] = [record.get(key) for record in records]
+
+    return columns
+
+
+def apply_batch_metadata(records: list, user: str):
+    """
+    :param records: a chunk of records, each as for apply_record_metadata
+    :param user: the username issuing the command
+    :return records, ts: the records with their metadata applied, and the one
+    timestamp they share
+    The chunk is pivoted to columns, and each column of metadata is computed by
+    mapping over, or substituting in one joined buffer of, the whole column; the
+    values are identical to apply_record_metadata.
+    """
+    ts = datetime.datetime.now()
+    columns = record_columns(
+        records,
+        HASH_KEYS + ["system_key", "system_id", "middle_name"]
+    )
+    # apply_record_metadata indexes these keys, so a record lacking one raises here too
+    list(map(itemgetter("given_name", "family_name", "postal_code"), records))
+    text_columns = [
+        list(map(str, columns[key])) if all(columns[key])
+        else [str(value or "") for value in columns[key]]
+        for key in HASH_KEYS
+    ]
+    hashes = list(map(
+        methodcaller("hexdigest"),
+        map(sha256, map(str.encode, map("".join, zip(*text_columns))))
+    ))
+    composite_keys = list(map(
+        key_composite,
+        [value or "" for value in columns["organization_key"]],
+        [value or "" for value in columns["system_key"]],
+        [value or "" for value in columns["system_id"]]
+    ))
+    composite_ndpcs = composite_name_day_postal_codes(
+        columns["name_day"],
+        text_columns[HASH_KEYS.index("name_day")],
+        columns["postal_code"]
+    )
+    metadata = dict(
+        uq_hash=hashes,
+        composite_key=composite_keys,
+        composite_name=composite_names(columns["given_name"], columns["family_name"]),
+        composite_name_day_postal_code=composite_ndpcs,
+        **column_features(columns),
+        touched_by=[user] * len(records),
+        touched_ts=[ts] * len(records)
+    )
+    for record, values in zip(records, zip(*metadata.values())):
+        record.update(zip(metadata, values))
+
+    return records, ts
+
+
 def random_float() -> float:
     value = random.uniform(0, 1)
     scalar = random.random()
@@ -0,0 +1,111 @@
+from math import ceil, log
+import os
+import threading
+
+from .app import app
+from .logger import DEBUG_ROUTE
+from .model import db, Demographic
+
+CAPACITY = 1000000  # the least number of hashes the filter is sized for
+ERROR_RATE = 0.001  # the rate of false positives sent for an exact check
+
+
+class BloomFilter:
+    """
+    A Bloom filter over uq_hash values. Since every uq_hash is already a sha256
+    hex digest, the bit positions are taken straight from the digest by double
+    hashing rather than hashing it again.
+    """
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.bit_count = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.bit_count / capacity * log(2)))
+        self.bits = bytearray(ceil(self.bit_count / 8))
+        self.count = 0
+
+    def positions(self, key: str):
+        h1 = int(key[:16], 16)
+        h2 = int(key[16:32], 16) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, key: str):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        for position in self.positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+class DuplicateFilter:
+    """
+    The DuplicateFilter finds demographic records which are already stored,
+    before an ID is minted for them. Each worker process keeps its own Bloom
+    filter, seeded from every uq_hash in the demographic table on first use and
+    updated as records are inserted. A hash the filter may contain is confirmed
+    against the table, so a false positive never drops a new record; a hash
+    another worker inserted since seeding is still caught by the uq_hash
+    unique constraint, as before.
+    """
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.pid = None
+        self.bloom = None
+
+    def seed(self):
+        """
+        Stream every stored uq_hash into a filter with room to grow
+        """
+        with app.app_context():
+            count = db.session.query(Demographic.uq_hash).count()
+            bloom = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+            query = db.session.query(Demographic.uq_hash).\
+                filter(Demographic.uq_hash.is_not(None)).\
+                yield_per(10000)
+            for uq_hash, in query:
+                bloom.add(uq_hash)
+        print(f"duplicate filter seeded with {len(bloom)} hashes", file=DEBUG_ROUTE)
+        self.bloom = bloom
+        self.pid = os.getpid()
+
+    def ready(self):
+        with self.lock:
+            if self.pid != os.getpid() or len(self.bloom) > self.bloom.capacity:
+                self.seed()
+
+    def duplicates(self, hashes: list) -> set:
+        """
+        :param hashes: the uq_hash of each record about to be posted
+        :return duplicates: the hashes already stored in the demographic table
+        """
+        self.ready()
+        maybe = {uq_hash for uq_hash in hashes if uq_hash in self.bloom}
+        if len(maybe) == 0:
+            return set()
+        with app.app_context():
+            query = db.session.query(Demographic.uq_hash).\
+                filter(Demographic.uq_hash.in_(maybe))
+            duplicates = {uq_hash for uq_hash, in query.all()}
+
+        return duplicates
+
+    def add(self, hashes):
+        """
+        :param hashes: the uq_hash of each record just inserted
+        """
+        self.ready()
+        for uq_hash in hashes:
+            self.bloom.add(uq_hash)
+
+
+DUPLICATE_FILTER = DuplicateFilter()
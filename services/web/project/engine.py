@@ -1,14 +1,28 @@
-from sqlalchemy import and_, or_
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+import multiprocessing
+import os
+from sqlalchemy import and_, false, func, or_, select, union
+from sqlalchemy.orm import aliased
 from time import time
 
+from .blocking import block_candidates, blocked_pairs, lsh_candidates
+from .data_utils import chunked, field
 from .logger import DEBUG_ROUTE
 from .matching import (
+    batch_record_metrics,
     compare_nameday_equal, 
     compare_ssn_equal, 
+    LazyMetrics,
+    pair_string_metrics,
     wrap_address_check, 
     wrap_name_check
 )
-from .model import Demographic
+from .model import db, Demographic, TRIGRAM_COLUMNS
+from .record_view import MATCH_COLUMNS, RecordView
+from .score_weighting import active_tests, run_cascade, SCORE_THRESHOLD
 
 
 def parse_result(metrics: dict) -> bool:
@@ -30,6 +44,7 @@ def toy_fine_matching(record_a, record_b) -> dict:
     :return toy_fine_match: an object containing a "coerced-result" match
     metric object without deterministic tests
     """
+    record_a, record_b = RecordView.from_record(record_a), RecordView.from_record(record_b)
     stride = 0.3
     match_score = 0
     threshold = 0.5
@@ -50,18 +65,23 @@ def toy_fine_matching(record_a, record_b) -> dict:
     return toy_fine_match
 
 
-def fine_matching(record_a: dict, record_b: dict) -> dict:
+def fine_matching(record_a: dict, record_b: dict, field_metrics=None) -> dict:
     """
     :param record_a: the new demographics record to be networked
     :param record_b: one coarse match record
+    :param field_metrics: a string_metrics function for any field, as
+    batch_fine_matching gives
     :return fine_match: an object containing a match metric object
     containing all deterministic tests
     """
     start = time()
+    record_a, record_b = RecordView.from_record(record_a), RecordView.from_record(record_b)
     # ToDo: score and threshold
-    fine_match = {"address_matching": wrap_address_check(record_a, record_b),
+    fine_match = {"record_a_id": record_a.record_id,
+                  "record_b_id": record_b.record_id,
+                  "address_matching": wrap_address_check(record_a, record_b, field_metrics),
                   "model_score": None,
-                  "name_matching": wrap_name_check(record_a, record_b),
+                  "name_matching": wrap_name_check(record_a, record_b, field_metrics),
                   "name_day_matching": compare_nameday_equal(
                     record_a.name_day, record_b.name_day    # type: ignore
                     ),
@@ -78,65 +98,500 @@ def fine_matching(record_a: dict, record_b: dict) -> dict:
     return fine_match
 
 
-def toy_coarse_matching(demographic_record) -> list:
+def batch_fine_matching(record_a, records_b: list) -> list:
+    """
+    :param record_a: the new demographics record to be networked
+    :param records_b: its coarse match records
+    :return fine_matches: the fine_matching of record_a with each, in order
+    The string metrics of every field are scored against all of records_b at
+    once, and each pair's metrics dict is then read from those arrays, only
+    where a check needs it. Each exec_time includes an equal share of the batch.
+    Only the string metrics are batched: the checks, and the nested dict each
+    pair keeps as its stored output, still run pair by pair, so the whole fine
+    match gains far less than the metrics alone (see benchmarks/string_metrics).
+    """
+    start = time()
+    record_a = RecordView.from_record(record_a)
+    records_b = [RecordView.from_record(record_b) for record_b in records_b]
+    batch = batch_record_metrics(record_a, records_b)
+    share = (time() - start) / max(len(records_b), 1)
+    fine_matches = list()
+    for index, record_b in enumerate(records_b):
+        field_metrics = {
+            name: partial(pair_string_metrics, metrics, index)
+            for name, metrics in batch.items()
+        }
+        fine_match = fine_matching(record_a, record_b, field_metrics)
+        fine_match["exec_time"] = f"{float(fine_match['exec_time']) + share:.8f}"
+        fine_matches.append(fine_match)
+
+    return fine_matches
+
+
+def battery_fine_matching(record_a, record_b, tests=None) -> dict:
+    """
+    :param record_a: the new demographics record to be networked
+    :param record_b: one coarse match record
+    :param tests: the active_tests to score with, read here by default
+    :return fine_match: the score of the pair under the SCORE_BATTERY, the
+    metrics its tests read, and the count of its tests skipped
+    The tests run cheapest first, only until the match is decided, and only the
+    metrics named by the tests run are computed. Without a SCORE_BATTERY of any
+    tests no pair could match, so this raises rather than score every pair 0.
+    """
+    start = time()
+    if tests is None:
+        tests = active_tests()
+    if len(tests) == 0:
+        raise ValueError('"battery" mode needs a SCORE_BATTERY with at least one test')
+    record_a, record_b = RecordView.from_record(record_a), RecordView.from_record(record_b)
+    metrics = LazyMetrics(record_a, record_b)
+    score, match, skipped_count = run_cascade(tests, metrics)
+    fine_match = {"record_a_id": record_a.record_id,
+                  "record_b_id": record_b.record_id,
+                  "metrics": metrics.computed,
+                  "model_score": None,
+                  "score": score,
+                  "threshold": SCORE_THRESHOLD,
+                  "match": match,
+                  "skipped_tests": skipped_count}
+    end = time()
+    fine_match["exec_time"] = f"{end - start:.8f}"
+
+    return fine_match
+
+
+def toy_coarse_matching(demographic_record, report=None) -> list:
     """
     :param demographic_record: The input demographics record
+    :param report: a dict given the count of candidates found
     :return coarse_results: a list of all the records against which the
     new record should be compared
     """
+    demographic_record = RecordView.from_record(demographic_record)
     record_id = demographic_record.record_id
     postal_code = demographic_record.postal_code
     name_day = demographic_record.name_day
     family_name = demographic_record.family_name
     coarse_results = []
     source_table = Demographic
-    query = Demographic.query
+    query = select(*MATCH_COLUMNS)
     query = query.filter(or_(
         source_table.__table__.c['postal_code'] == postal_code,
         source_table.__table__.c['name_day'] == name_day,
         source_table.__table__.c['family_name'] == family_name))\
         .filter(and_(source_table.__table__.c['record_id'] != record_id))
-    for row in query.all():
-        coarse_results.append(row)
+    for row in db.session.execute(query):
+        coarse_results.append(RecordView(*row))
         print(row, file=DEBUG_ROUTE)
+    if report is not None:
+        report["candidate_count"] = len(coarse_results)
 
     return coarse_results
 
 
-def coarse_matching(demographic_record) -> list:
+def coarse_matching(demographic_record, report=None) -> list:
     """
     :param demographic_record: The input demographics record
+    :param report: a dict given the counts of blocks used, split, and skipped,
+    of the block entries pruned, and of the candidates found
     :return coarse_results: a list of all the records against which the new
     record should be compared
+    Candidates are the active records sharing a key of the blocking table
+    """
+    coarse_results = block_candidates(demographic_record, report=report)
+
+    return coarse_results
+
+
+def lsh_coarse_matching(demographic_record, report=None) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: a dict given the counts of bands used and candidates found
+    :return coarse_results: the active records sharing a MinHash band over the
+    q-grams of the record's names and address; tune lsh.LSH_BANDS and
+    lsh.LSH_ROWS to trade recall against candidate volume
+    """
+    coarse_results = lsh_candidates(demographic_record, report=report)
+
+    return coarse_results
+
+
+TRIGRAM_SIMILARITY = 0.5  # the least similarity of a name or address candidate
+
+
+def trigram_query(demographic_record):
+    """
+    :param demographic_record: The input demographics record
+    :return query: the MATCH_FIELDS of the active records with a similar name on
+    the same name day or in the same postal code, or with a similar address in
+    the same postal code
+    The % operator finds similar values in the trigram GIN index, at pg_trgm's
+    own threshold, and similarity() then holds them to TRIGRAM_SIMILARITY
     """
-    # ToDo: implement data-aware coarse matching technique
-    # This bypass leaves coarse matching in guaranteed toy mode for now
-    coarse_results = toy_coarse_matching(demographic_record)
+    similar = dict()
+    for column_name in TRIGRAM_COLUMNS:
+        value = field(demographic_record, column_name)
+        if value:
+            normalized = func.lower(getattr(Demographic, column_name))
+            similar[column_name] = and_(
+                normalized.op("%")(value.lower()),
+                func.similarity(normalized, value.lower()) >= TRIGRAM_SIMILARITY
+            )
+        else:
+            similar[column_name] = false()
+    same_name_day = Demographic.name_day == field(demographic_record, "name_day")
+    same_postal_code = Demographic.postal_code == field(demographic_record, "postal_code")
+    query = select(*MATCH_COLUMNS).\
+        where(
+            or_(
+                and_(
+                    similar["family_name"],
+                    similar["given_name"],
+                    or_(same_name_day, same_postal_code)
+                ),
+                and_(similar["address_1"], same_postal_code)
+            ),
+            Demographic.record_id != field(demographic_record, "record_id"),
+            Demographic.is_active.is_(True)
+        )
+
+    return query
+
+
+def trigram_coarse_matching(demographic_record, report=None) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: a dict given the count of candidates found
+    :return coarse_results: the candidates of trigram_query, holding only the
+    fields the matchers read
+    pg_trgm is Postgres only; on any other database the blocking table is read
+    """
+    if db.engine.dialect.name != "postgresql":
+        return coarse_matching(demographic_record, report=report)
+    coarse_results = [
+        RecordView(*row) for row in db.session.execute(trigram_query(demographic_record))
+    ]
+    if report is not None:
+        report["candidate_count"] = len(coarse_results)
+
+    return coarse_results
+
+
+# the composite keys records are sorted on, and the records compared at once
+NEIGHBORHOOD_KEYS = ("composite_name", "composite_name_day_postal_code")
+NEIGHBORHOOD_WINDOW = 10
+
+
+def neighborhood_coarse_matching(demographic_record, report=None) -> list:
+    """
+    :param demographic_record: The input demographics record
+    :param report: a dict given the count of candidates found
+    :return coarse_results: the active records within NEIGHBORHOOD_WINDOW of
+    the record, in the order of each of the NEIGHBORHOOD_KEYS
+    The neighbors on either side are each one indexed ORDER BY ... LIMIT
+    """
+    record_id = field(demographic_record, "record_id")
+    neighbors = dict()
+    for key in NEIGHBORHOOD_KEYS:
+        value = field(demographic_record, key)
+        if value is None:
+            continue
+        column = getattr(Demographic, key)
+        before = or_(column < value, and_(column == value, Demographic.record_id < record_id))
+        after = or_(column > value, and_(column == value, Demographic.record_id > record_id))
+        for where, order_by in (
+            (before, (column.desc(), Demographic.record_id.desc())),
+            (after, (column, Demographic.record_id))
+        ):
+            query = select(*MATCH_COLUMNS).\
+                where(where, Demographic.is_active.is_(True)).\
+                order_by(*order_by).\
+                limit(NEIGHBORHOOD_WINDOW - 1)
+            for row in db.session.execute(query):
+                neighbors[row.record_id] = RecordView(*row)
+    coarse_results = list(neighbors.values())
+    if report is not None:
+        report["candidate_count"] = len(coarse_results)
 
     return coarse_results
 
 
 MODES = {  # implement any kind of blocking / filtering by setting a mode here
     "toy": (toy_coarse_matching, toy_fine_matching),
-    "prod": (coarse_matching, fine_matching)
+    "prod": (coarse_matching, fine_matching),
+    "sorted_neighborhood": (neighborhood_coarse_matching, fine_matching),
+    "lsh": (lsh_coarse_matching, fine_matching),
+    "trigram": (trigram_coarse_matching, fine_matching),
+    "battery": (coarse_matching, battery_fine_matching)
 }
 MODE = "toy"
 
 
-def compute_all_matches(demographic_record) -> (list, str):
+def lsh_indexed() -> bool:
+    """
+    :return lsh: whether the MODE draws candidates from the LSH band keys, which
+    are then indexed with the blocking keys
+    """
+    return MODE == "lsh"
+
+
+PARALLEL = os.getenv("MATCH_PARALLEL", "0") == "1"  # opt in to parallel matching
+PARALLEL_MIN = 500  # the fewest pairs matched in parallel; fewer stay serial
+PARALLEL_CHUNK = 250  # the pairs sent to a worker process at once
+PARALLEL_WORKERS = int(os.getenv("MATCH_WORKERS", "0")) or os.cpu_count()
+MATCH_POOL = None
+BATCH_MIN = 50  # the fewest candidates of one record scored by batch_fine_matching
+
+
+def record_payload(record) -> tuple:
+    """
+    :param record: a demographic record
+    :return payload: the record's MATCH_FIELDS, in order, a compact picklable
+    payload
+    """
+    return tuple(RecordView.from_record(record))
+
+
+def payload_record(payload: tuple) -> RecordView:
+    """
+    :param payload: a record's MATCH_FIELDS, in order
+    :return record: its RecordView
+    """
+    return RecordView(*payload)
+
+
+def match_record_pairs(fine_matcher, record_pairs: list) -> list:
+    """
+    :param fine_matcher: the fine matcher of the mode
+    :param record_pairs: a list of (record_a, record_b) to be compared
+    :return fine_matches: the fine match of each pair, in order
+    With fine_matching, each run of at least BATCH_MIN pairs sharing one
+     record_a is matched by batch_fine_matching
+    """
+    if fine_matcher is not fine_matching:
+        return [fine_matcher(record_a, record_b) for record_a, record_b in record_pairs]
+    fine_matches = list()
+    for _, run in groupby(record_pairs, key=lambda record_pair: id(record_pair[0])):
+        run = list(run)
+        if len(run) >= BATCH_MIN:
+            fine_matches.extend(
+                batch_fine_matching(run[0][0], [record_b for _, record_b in run])
+            )
+        else:
+            fine_matches.extend(fine_matching(record_a, record_b) for record_a, record_b in run)
+
+    return fine_matches
+
+
+def match_payloads(task: tuple) -> list:
+    """
+    :param task: (mode, the active_tests in "battery" mode or None, a list of
+    (payload_a, payload_b))
+    :return fine_matches: the fine match of each pair, in order
+    Runs in a worker process of the MATCH_POOL
+    """
+    mode, tests, payload_pairs = task
+    _, fine_matcher = MODES[mode]
+    if tests is not None:
+        fine_matcher = partial(fine_matcher, tests=tests)
+    records = dict()  # a record is sent once per chunk, so unpack it once
+    for payload_pair in payload_pairs:
+        for payload in payload_pair:
+            if id(payload) not in records:
+                records[id(payload)] = payload_record(payload)
+
+    return match_record_pairs(fine_matcher, [
+        (records[id(payload_a)], records[id(payload_b)])
+        for payload_a, payload_b in payload_pairs
+    ])
+
+
+def match_pool() -> ProcessPoolExecutor:
+    """
+    :return MATCH_POOL: the pool of matching processes, started on first use
+    The workers are spawned rather than forked, as the app's threads may hold
+     locks, and only ever receive record payloads and the battery's loaded
+     tests, never a database connection
+    """
+    global MATCH_POOL
+    if MATCH_POOL is None:
+        MATCH_POOL = ProcessPoolExecutor(
+            PARALLEL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return MATCH_POOL
+
+
+def fine_match_pairs(record_pairs: list, parallel=None) -> list:
+    """
+    :param record_pairs: a list of (record_a, record_b) to be compared
+    :param parallel: match in the MATCH_POOL; MATCH_PARALLEL by default
+    :return fine_matches: the fine match of each pair, in order
+    In parallel, the pairs are sent in chunks as compact payloads, with the
+     battery's tests in "battery" mode; fewer than PARALLEL_MIN pairs are always
+     matched serially
+    """
+    _, fine_matcher = MODES[MODE]
+    if parallel is None:
+        parallel = PARALLEL
+    if not parallel or len(record_pairs) < PARALLEL_MIN:
+        return match_record_pairs(fine_matcher, record_pairs)
+    payloads = dict()  # each record is packed once, however many pairs it is in
+    for record_pair in record_pairs:
+        for record in record_pair:
+            if id(record) not in payloads:
+                payloads[id(record)] = record_payload(record)
+    tests = active_tests() if MODE == "battery" else None
+    tasks = [
+        (
+            MODE,
+            tests,
+            [(payloads[id(record_a)], payloads[id(record_b)]) for record_a, record_b in chunk]
+        )
+        for chunk in chunked(record_pairs, PARALLEL_CHUNK)
+    ]
+    fine_matches = list()
+    for chunk_matches in match_pool().map(match_payloads, tasks):
+        fine_matches.extend(chunk_matches)
+
+    return fine_matches
+
+
+def compute_all_matches(demographic_record, parallel=None, report=None) -> (list, str):
     """
     :param demographic_record: The input demographics record
+    :param parallel: fine match in the MATCH_POOL; MATCH_PARALLEL by default
+    :param report: a dict given the coarse matcher's counts of candidates, and
+    the count of score tests skipped, in "battery" mode
     :return computed_matches, exec_time: (the list of all results for all
     coarse matches, the duration of the computation)
     """
-    coarse_matcher, fine_matcher = MODES[MODE]
+    coarse_matcher, _ = MODES[MODE]
     start = time()
-    computed_matches = []
-    for coarse_match in coarse_matcher(demographic_record):
-        if demographic_record.record_id != coarse_match.record_id:
-            computed_matches.append(
-                fine_matcher(demographic_record, coarse_match)
+    record_view = RecordView.from_record(demographic_record)
+    record_pairs = [
+        (record_view, coarse_match)
+        for coarse_match in coarse_matcher(demographic_record, report=report)
+        if record_view.record_id != coarse_match.record_id
+    ]
+    computed_matches = fine_match_pairs(record_pairs, parallel=parallel)
+    if report is not None:
+        report["skipped_tests"] = sum(
+            computed_match.get("skipped_tests", 0) for computed_match in computed_matches
+        )
+    end = time()
+    exec_time = f"{end - start:.8f}"
+
+    return computed_matches, exec_time
+
+
+BLOCKING_COLUMNS = ("postal_code", "name_day", "family_name")
+
+
+def candidate_pairs(record_ids) -> list:
+    """
+    :param record_ids: a selectable of the record IDs being loaded
+    :return pairs: a list of (record_id_a, record_id_b) for every loaded record
+    and every active or loaded record sharing a blocking value with it
+    In "toy" mode all candidate pairs come back from one set-based self-join on
+    the blocking columns; UNION removes pairs found on more than one column. In
+    "sorted_neighborhood" mode they come from neighborhood_pairs, in "lsh" mode
+    from blocked_pairs on the LSH bands, and otherwise from blocked_pairs on the
+    blocking keys, as the coarse matchers draw them.
+    """
+    if MODE == "sorted_neighborhood":
+        return neighborhood_pairs(record_ids)
+    if MODE != "toy":
+        return blocked_pairs(record_ids, lsh=lsh_indexed())
+    record_a = aliased(Demographic)
+    record_b = aliased(Demographic)
+    selects = list()
+    for column_name in BLOCKING_COLUMNS:
+        selects.append(
+            select(record_a.record_id, record_b.record_id).
+            select_from(record_a).
+            join(
+                record_b,
+                getattr(record_a, column_name) == getattr(record_b, column_name)
+            ).
+            where(
+                record_a.record_id.in_(record_ids),
+                record_b.record_id != record_a.record_id,
+                or_(
+                    record_b.is_active.is_(True),
+                    and_(
+                        record_b.record_id.in_(record_ids),
+                        record_b.record_id > record_a.record_id
+                    )
+                )
+            )
+        )
+    pairs = [tuple(pair) for pair in db.session.execute(union(*selects))]
+
+    return pairs
+
+
+def neighborhood_pairs(record_ids=None, window=NEIGHBORHOOD_WINDOW) -> list:
+    """
+    :param record_ids: a selectable of the record IDs being loaded, or None to
+    re-match every active record
+    :param window: the records compared at once
+    :return pairs: a list of (record_id_a, record_id_b) for every two records
+    within window of each other in the order of any of the NEIGHBORHOOD_KEYS,
+    where at least one is being loaded
+    Each key is one streaming pass over the active and loaded records, so the
+    comparisons are O(n * window) per key rather than one query per record.
+    """
+    pairs = set()
+    for key in NEIGHBORHOOD_KEYS:
+        column = getattr(Demographic, key)
+        query = select(Demographic.record_id, Demographic.is_active).\
+            where(column.is_not(None)).\
+            order_by(column, Demographic.record_id).\
+            execution_options(yield_per=1000)
+        if record_ids is None:
+            query = query.where(Demographic.is_active.is_(True))
+        else:
+            query = query.where(
+                or_(Demographic.is_active.is_(True), Demographic.record_id.in_(record_ids))
             )
+        neighbors = deque(maxlen=window - 1)
+        for record_id, is_active in db.session.execute(query):
+            is_loaded = record_ids is None or not is_active
+            for neighbor_id, neighbor_is_loaded in neighbors:
+                if is_loaded and neighbor_is_loaded:
+                    pairs.add((min(record_id, neighbor_id), max(record_id, neighbor_id)))
+                elif is_loaded:
+                    pairs.add((record_id, neighbor_id))
+                elif neighbor_is_loaded:
+                    pairs.add((neighbor_id, record_id))
+            neighbors.append((record_id, is_loaded))
+
+    return sorted(pairs)
+
+
+def compute_pair_matches(pairs: list, parallel=None) -> (list, str):
+    """
+    :param pairs: a list of (record_id_a, record_id_b) to be compared
+    :param parallel: fine match in the MATCH_POOL; MATCH_PARALLEL by default
+    :return computed_matches, exec_time: (the fine match for each pair, in
+    order, the duration of the computation)
+    Every record appearing in a pair is selected once, in chunks, rather than
+    once per comparison.
+    """
+    start = time()
+    record_ids = {record_id for pair in pairs for record_id in pair}
+    records = dict()
+    for chunk in chunked(record_ids, 1000):
+        query = select(*MATCH_COLUMNS).where(Demographic.record_id.in_(chunk))
+        for row in db.session.execute(query):
+            records[row.record_id] = RecordView(*row)
+    computed_matches = fine_match_pairs(
+        [(records[record_id_a], records[record_id_b]) for record_id_a, record_id_b in pairs],
+        parallel=parallel
+    )
     end = time()
     exec_time = f"{end - start:.8f}"
 
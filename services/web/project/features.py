@@ -0,0 +1,182 @@
+from itertools import compress
+import re
+
+from jellyfish import metaphone, nysiis, soundex
+from sqlalchemy import event, inspect, select, update
+
+from .model import db, Demographic, DemographicArchive
+
+ALPHA = re.compile("[^a-zA-Z]")
+SEPARATOR = "\x00"  # joins a column's strings into one buffer; alpha_composite drops it
+ALPHA_BUFFER = re.compile(f"[^a-zA-Z{SEPARATOR}]")
+FEATURE_CHUNK_SIZE = 1000  # records read and updated at once by rebuild_features
+
+
+def alpha_composite(value: str) -> str:
+    return ALPHA.sub("", value)
+
+
+def junior_stripped(value: str) -> str:
+    return alpha_composite(value).replace("JR", "").strip()
+
+
+def senior_stripped(value: str) -> str:
+    return alpha_composite(value).replace("SR", "").strip()
+
+
+FEATURES = {  # add a kind of feature by naming a function of the field's string here
+    "alpha": alpha_composite,
+    "junior": junior_stripped,
+    "senior": senior_stripped,
+    "metaphone": metaphone,
+    "soundex": soundex,
+    "nysiis": nysiis,
+}
+BUFFER_FEATURES = {  # the features computed over a column's alpha buffer; it has no whitespace to strip
+    "alpha": lambda buffer: buffer,
+    "junior": lambda buffer: buffer.replace("JR", ""),
+    "senior": lambda buffer: buffer.replace("SR", ""),
+}
+FEATURE_FIELDS = {  # the features stored for each field, as "<field>_<feature>" columns
+    "given_name": ("alpha", "metaphone", "soundex", "nysiis"),
+    "middle_name": ("metaphone",),
+    "family_name": ("alpha", "junior", "senior", "metaphone", "soundex", "nysiis"),
+    "address_1": ("metaphone",),
+    "address_2": ("metaphone",),
+    "postal_code": ("metaphone",),
+}
+FEATURE_COLUMNS = tuple(
+    f"{name}_{kind}" for name, kinds in FEATURE_FIELDS.items() for kind in kinds
+)
+
+
+def record_features(record: dict) -> dict:
+    """
+    :param record: a demographic record
+    :return features: the value of each of FEATURE_COLUMNS, None where the
+    field is not a string
+    """
+    return {
+        f"{name}_{kind}": FEATURES[kind](value) if isinstance(value, str) else None
+        for name, kinds in FEATURE_FIELDS.items()
+        for value in (record.get(name),)
+        for kind in kinds
+    }
+
+
+def alpha_buffer(strings: list):
+    """
+    :param strings: a column's strings
+    :return buffer: the strings' alpha_composite joined by SEPARATOR, or None
+    where a string holds SEPARATOR itself
+    """
+    buffer = SEPARATOR.join(strings)
+    if len(strings) == 0 or buffer.count(SEPARATOR) != len(strings) - 1:
+        return None
+
+    return ALPHA_BUFFER.sub("", buffer)
+
+
+def column_features(columns: dict) -> dict:
+    """
+    :param columns: each of FEATURE_FIELDS's values across a chunk of records,
+    as record_columns gives
+    :return features: each of FEATURE_COLUMNS's values across the chunk, the
+    same as record_features gives
+    A column's alpha, junior and senior features are substituted over one
+    joined buffer of its strings and split apart once; the other features are
+    mapped over the strings.
+    """
+    features = dict()
+    for name, kinds in FEATURE_FIELDS.items():
+        if set(map(type, columns[name])) == {str}:
+            present, strings = None, columns[name]
+        else:
+            present = [isinstance(value, str) for value in columns[name]]
+            strings = list(compress(columns[name], present))
+        buffer = alpha_buffer(strings) if any(kind in BUFFER_FEATURES for kind in kinds) else None
+        for kind in kinds:
+            if buffer is not None and kind in BUFFER_FEATURES:
+                computed = BUFFER_FEATURES[kind](buffer).split(SEPARATOR)
+            else:
+                computed = list(map(FEATURES[kind], strings))
+            if present is not None:
+                computed = iter(computed)
+                computed = [next(computed) if is_string else None for is_string in present]
+            features[f"{name}_{kind}"] = computed
+
+    return features
+
+
+def field_features(record, name: str) -> dict:
+    """
+    :param record: a demographic record, as a dict or a RecordView
+    :param name: one of FEATURE_FIELDS
+    :return features: the stored value of each of the field's features, None
+    where the record has none
+    """
+    return {kind: record.get(f"{name}_{kind}") for kind in FEATURE_FIELDS[name]}
+
+
+def feature(value: str, kind: str, features=None):
+    """
+    :param value: the string of a field
+    :param kind: one of FEATURES
+    :param features: the field's stored features, as field_features gives
+    :return feature: the stored feature, or else the feature of value
+    """
+    stored = features.get(kind) if features else None
+    if stored is not None:
+        return stored
+
+    return FEATURES[kind](value)
+
+
+def rebuild_features(chunk_size=FEATURE_CHUNK_SIZE) -> int:
+    """
+    :param chunk_size: the records read at once
+    :return record_count: the demographic and archived records updated
+    Recomputes every stored feature, e.g. after FEATURES changes or for records
+    ingested before features were stored
+    """
+    record_count = 0
+    for model in (Demographic, DemographicArchive):
+        last_record_id = None
+        while True:
+            query = select(model.record_id, *[getattr(model, name) for name in FEATURE_FIELDS]).\
+                order_by(model.record_id).limit(chunk_size)
+            if last_record_id is not None:
+                query = query.where(model.record_id > last_record_id)
+            chunk = db.session.execute(query).all()
+            if len(chunk) == 0:
+                break
+            db.session.execute(
+                update(model),
+                [dict(record_features(row._mapping), record_id=row.record_id) for row in chunk]
+            )
+            record_count += len(chunk)
+            last_record_id = chunk[-1].record_id
+    db.session.commit()
+
+    return record_count
+
+
+def refresh_features(mapper, connection, target):
+    """
+    :param mapper: the mapper of the demographic model being written
+    :param connection: the connection of the flush
+    :param target: a demographic or archived record being updated
+    The stored features are recomputed from the record's own fields when any of
+    FEATURE_FIELDS changed since it was loaded, so that an ORM update never
+    leaves them stale; an insert keeps the features its metadata applied
+    """
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in FEATURE_FIELDS):
+        return
+    features = record_features({name: getattr(target, name) for name in FEATURE_FIELDS})
+    for column, value in features.items():
+        setattr(target, column, value)
+
+
+for model in (Demographic, DemographicArchive):
+    event.listen(model, "before_update", refresh_features)
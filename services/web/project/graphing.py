@@ -5,6 +5,7 @@ from sqlalchemy import or_
 from sqlalchemy.dialects.postgresql import insert
 
 from .app import app
+from .data_utils import chunked
 from .logger import DEBUG_ROUTE, SYSTEM_USER, version
 from .model import (
     db, 
@@ -13,6 +14,7 @@ from .model import (
     EnterpriseGroup, 
     EnterpriseMatch, 
     key_gen, 
+    KEY_ALLOCATOR,
     Process
     )
 
@@ -23,6 +25,7 @@ ALPHA = 0.5
 WIDTH = 6
 SEED = 7
 AX_MARGINS = 0.08
+CHUNK_SIZE = 1000  # rows per multi-row INSERT when building a network
 
 
 class GraphReCursor:
@@ -360,3 +363,126 @@ class GraphCursor:
                f"{len(self.graph.nodes)} records | " \
                f"{len(self.graph.edges)} edges | " \
                f"{self.match_count} matches>"
+
+
+def build_enterprise_network(
+        nodes_and_weights: list,
+        batch_id,
+        proc_id,
+        match_threshold=MATCH_THRESHOLD
+) -> dict:
+    """
+    :param nodes_and_weights: a list of tups of (a: int, b: int, weight: float)
+    covering every pair computed for a set of newly loaded records
+    :param batch_id: the batch building the network
+    :param proc_id: the process building the network
+    :param match_threshold: the weight at or above which a pair is a match
+    :return counts: the numbers of match, group, and bulletin rows written
+    The one-shot counterpart to a GraphCursor per record: every match is
+    inserted, connected components are computed once (joined with any existing
+    groups they touch), and the Match, Group, and Bulletin rows are written
+    with multi-row statements. Nothing is committed here: the writes join the
+    caller's session, so they commit or roll back with the rest of its work.
+    """
+    user = SYSTEM_USER
+    transaction_key = f"{batch_id}_{proc_id}"
+    ts = datetime.datetime.now()
+    graph = nx.Graph()
+    matches = list()
+    for a, b, weight in nodes_and_weights:
+        if a != b and weight >= match_threshold:
+            graph.add_edge(a, b)
+            matches.append((min(a, b), max(a, b), weight))
+    for chunk in chunked(matches, CHUNK_SIZE):
+        etl_ids = KEY_ALLOCATOR.take(user, version, len(chunk))
+        staged_match_records = [
+            {
+                "etl_id": etl_id,
+                "record_id_low": low,
+                "record_id_high": high,
+                "match_weight": weight,
+                "transaction_key": transaction_key,
+                "is_valid": True,
+                "touched_by": user,
+                "touched_ts": ts
+            }
+            for etl_id, (low, high, weight) in zip(etl_ids, chunk)
+        ]
+        statement = insert(EnterpriseMatch).\
+            values(staged_match_records).\
+            on_conflict_do_nothing()
+        db.session.execute(statement)
+    # fold in the existing groups these matches reach
+    for chunk in chunked(list(graph.nodes), CHUNK_SIZE):
+        touched_groups = db.session.query(EnterpriseGroup.enterprise_id).\
+            filter(EnterpriseGroup.record_id.in_(chunk))
+        query = db.session.query(
+            EnterpriseGroup.enterprise_id, 
+            EnterpriseGroup.record_id
+        ).filter(EnterpriseGroup.enterprise_id.in_(touched_groups))
+        for enterprise_id, record_id in query.all():
+            if enterprise_id != record_id:
+                graph.add_edge(enterprise_id, record_id)
+    staged_groups = list()
+    for component in nx.connected_components(graph):
+        enterprise_id = min(component)
+        for record_id in component:
+            staged_groups.append((enterprise_id, record_id))
+    bulletin_count = 0
+    for chunk in chunked(staged_groups, CHUNK_SIZE):
+        etl_ids = KEY_ALLOCATOR.take(user, version, len(chunk))
+        staged_group_records = [
+            {
+                "etl_id": etl_id,
+                "enterprise_id": enterprise_id,
+                "record_id": record_id,
+                "transaction_key": transaction_key,
+                "touched_by": user,
+                "touched_ts": ts
+            }
+            for etl_id, (enterprise_id, record_id) in zip(etl_ids, chunk)
+        ]
+        statement = insert(EnterpriseGroup).values(staged_group_records)
+        statement = statement.\
+            on_conflict_do_update(
+                index_elements=[EnterpriseGroup.record_id],
+                where=(  # type: ignore
+                    EnterpriseGroup.enterprise_id != 
+                    statement.excluded.enterprise_id
+                ),
+                set_=dict(
+                    transaction_key=transaction_key,
+                    touched_ts=ts,
+                    enterprise_id=statement.excluded.enterprise_id
+                ),
+            ).\
+            returning(EnterpriseGroup.record_id, EnterpriseGroup.enterprise_id)
+        regrouped = db.session.execute(statement).all()
+        if len(regrouped) == 0:
+            continue
+        # create bulletin records for every new or changed group assignment
+        etl_ids = KEY_ALLOCATOR.take(user, version, len(regrouped))
+        staged_graph_bulletin_records = [
+            {
+                "etl_id": etl_id,
+                "batch_id": batch_id,
+                "proc_id": proc_id,
+                "record_id": record_id,
+                "empi_id": enterprise_id,
+                "transaction_key": transaction_key,
+                "bulletin_ts": ts
+            }
+            for etl_id, (record_id, enterprise_id) in zip(etl_ids, regrouped)
+        ]
+        db.session.execute(
+            insert(Bulletin).values(staged_graph_bulletin_records)
+        )
+        bulletin_count += len(regrouped)
+    counts = {
+        "match_count": len(matches),
+        "group_count": len(staged_groups),
+        "bulletin_count": bulletin_count
+    }
+    print(f"network built: {counts}", file=DEBUG_ROUTE)
+
+    return counts
@@ -0,0 +1,249 @@
+from datetime import datetime, timedelta
+import os
+import signal
+import socket
+import threading
+
+from sqlalchemy import and_, or_
+
+from .app import app
+from .auditor import Auditor
+from .coupler import COUPLER
+from .logger import DEBUG_ROUTE, mylogger, version
+from .model import db, Batch, Job
+
+JOB_ATTEMPTS = 3  # the times a job is run before it is FAILED
+JOB_BACKOFF = 30  # seconds before a failed job's first retry, doubled each time
+JOB_HEARTBEAT = 10  # seconds between a running job's heartbeats
+JOB_TIMEOUT = 60  # seconds without a heartbeat before a job is claimed again
+JOB_POLL = 1  # seconds an idle worker waits before looking for a job again
+
+
+def enqueue_job(auditor, endpoint: str, payload: dict):
+    """
+    :param auditor: the Auditor of the batch, handed off with queue()
+    :param endpoint: a string denoting the endpoint invoked
+    :param payload: the validated payload to POST with
+    The job is added before queue() commits, so the job and the QUEUED batch are
+     committed together, and the job waits for any worker to claim it; if that
+     commit fails, the batch is FAILED and the error raised
+    """
+    now = datetime.now()
+    job_record = Job(
+        batch_id=auditor.batch_id,
+        endpoint=endpoint,
+        payload=payload,
+        user=auditor.user,
+        job_status="QUEUED",
+        attempts=0,
+        enqueued_ts=now,
+        run_after_ts=now
+    )  # type: ignore
+    db.session.add(job_record)
+    try:
+        auditor.queue()
+    except Exception:
+        db.session.rollback()
+        auditor.fail("STARTING")
+        raise
+
+
+def claim_job(worker_id: str):
+    """
+    :param worker_id: the unique name of the claiming worker
+    :return job: the claimed job's columns, or None if no job is ready
+    The oldest job ready to run is locked with FOR UPDATE SKIP LOCKED, so workers
+     in any number of containers each claim a different job. A RUNNING job whose
+     worker has stopped sending heartbeats is ready to run again.
+    """
+    now = datetime.now()
+    with app.app_context():
+        job_record = db.session.query(Job).\
+            filter(
+                or_(
+                    and_(Job.job_status == "QUEUED", Job.run_after_ts <= now),
+                    and_(
+                        Job.job_status == "RUNNING",
+                        Job.heartbeat_ts < now - timedelta(seconds=JOB_TIMEOUT)
+                    )
+                )
+            ).\
+            order_by(Job.run_after_ts).\
+            limit(1).\
+            with_for_update(skip_locked=True).\
+            first()
+        if job_record is None:
+            db.session.rollback()
+            return None
+        job_record.job_status = "RUNNING"
+        job_record.attempts += 1
+        job_record.worker_id = worker_id
+        job_record.heartbeat_ts = now
+        job = {
+            "attempts": job_record.attempts,
+            "batch_id": job_record.batch_id,
+            "endpoint": job_record.endpoint,
+            "payload": job_record.payload,
+            "user": job_record.user,
+        }
+        db.session.commit()
+
+    return job
+
+
+def settle_job(batch_id: int, worker_id: str, job_status: str, error=None, retry_in=None):
+    """
+    :param batch_id: the unique locator for the job's batch
+    :param worker_id: the worker which ran it
+    :param job_status: DONE, FAILED, or QUEUED to retry it
+    :param error: the reason it failed
+    :param retry_in: the seconds before a retry may be claimed
+    A job claimed again by another worker is left to that worker
+    """
+    now = datetime.now()
+    settled = {Job.job_status: job_status, Job.error: error}
+    if job_status == "QUEUED":
+        settled[Job.run_after_ts] = now + timedelta(seconds=retry_in or 0)
+    else:
+        settled[Job.finished_ts] = now
+    with app.app_context():
+        db.session.query(Job).\
+            filter(Job.batch_id == batch_id, Job.worker_id == worker_id).\
+            update(settled, synchronize_session=False)
+        db.session.commit()
+
+
+def batch_touched(batch_id: int) -> bool:
+    """
+    :param batch_id: the unique locator for the job's batch
+    :return touched: whether any of the batch's counts has moved, i.e. whether an
+     attempt stamped a process or skipped a record, and so may have left changes
+     which running the processor again would apply twice
+    """
+    with app.app_context():
+        batch_record = db.session.get(Batch, batch_id)
+
+        return any((
+            batch_record.pending_count,
+            batch_record.done_count,
+            batch_record.skipped_count,
+            batch_record.error_count
+        ))
+
+
+def fail_job(job: dict, worker_id: str, error: str):
+    """
+    :param job: the columns of a claimed job
+    :param worker_id: the worker which ran it
+    :param error: the reason it failed
+    The job and its batch are both FAILED
+    """
+    with app.app_context():
+        Auditor.for_batch(job["batch_id"], job["user"], version, job["endpoint"]).\
+            fail("QUEUED")
+    settle_job(job["batch_id"], worker_id, "FAILED", error=error)
+
+
+class Heartbeat(threading.Thread):
+    """
+    The Heartbeat keeps a running job claimed by its worker
+    """
+    def __init__(self, batch_id: int, worker_id: str, interval=JOB_HEARTBEAT):
+        super().__init__(daemon=True)
+        self.batch_id = batch_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            with app.app_context():
+                db.session.query(Job).\
+                    filter(
+                        Job.batch_id == self.batch_id,
+                        Job.worker_id == self.worker_id,
+                        Job.job_status == "RUNNING"
+                    ).\
+                    update(
+                        {Job.heartbeat_ts: datetime.now()},
+                        synchronize_session=False
+                    )
+                db.session.commit()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def run_job(job: dict, worker_id: str):
+    """
+    :param job: the columns of a claimed job
+    :param worker_id: the worker running it
+    A failed job is queued again with exponential backoff until its last attempt,
+    but only while its batch is untouched, so no change is ever applied twice; a
+    job which fails after changing its batch is FAILED at once, with its batch
+    """
+    batch_id, attempts = job["batch_id"], job["attempts"]
+    auditor = Auditor.for_batch(batch_id, job["user"], version, job["endpoint"])
+    heartbeat = Heartbeat(batch_id, worker_id)
+    heartbeat.start()
+    try:
+        auditor.run(COUPLER[job["endpoint"]]["processor"], job["payload"], final=False)
+        error = None
+    except Exception as error_msg:
+        mylogger.error(f"job {batch_id} attempt {attempts} failed: {error_msg}")
+        print(error_msg, file=DEBUG_ROUTE)
+        error = str(error_msg)
+    finally:
+        heartbeat.stop()
+    if error is None:
+        settle_job(batch_id, worker_id, "DONE")
+    elif attempts >= JOB_ATTEMPTS or batch_touched(batch_id):
+        fail_job(job, worker_id, error)
+    else:
+        retry_in = JOB_BACKOFF * 2 ** (attempts - 1)
+        settle_job(batch_id, worker_id, "QUEUED", error=error, retry_in=retry_in)
+
+
+class JobWorker:
+    """
+    The JobWorker claims jobs from the queue and runs them one at a time, until
+     it is sent SIGTERM or SIGINT, when it finishes its job and stops. Run as many
+     as needed, in as many containers, with `python manage.py worker`.
+    """
+    def __init__(self, worker_id=None, poll_interval=JOB_POLL):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run_once(self) -> bool:
+        """
+        :return ran: whether there was a job to run
+        """
+        job = claim_job(self.worker_id)
+        if job is None:
+            return False
+        print(f"{self.worker_id}: running job {job['batch_id']}", file=DEBUG_ROUTE)
+        if job["attempts"] > JOB_ATTEMPTS:
+            fail_job(job, self.worker_id, "the job's worker stopped on its last attempt")
+        elif job["attempts"] > 1 and batch_touched(job["batch_id"]):
+            fail_job(job, self.worker_id, "the job's worker stopped after changing its batch")
+        else:
+            run_job(job, self.worker_id)
+
+        return True
+
+    def run(self, burst=False):
+        """
+        :param burst: stop once the queue is empty
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping.is_set():
+            if not self.run_once():
+                if burst:
+                    break
+                self.stopping.wait(self.poll_interval)
@@ -0,0 +1,272 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import csv
+import gzip
+import json
+import os
+import pyarrow.parquet as pq
+from sqlalchemy import select
+
+from .app import app
+from .auditor import Auditor
+from .block_index import BLOCK_INDEX
+from .data_utils import chunked, iter_ndjson
+from .logger import DEBUG_ROUTE
+from .model import db, Demographic, Process
+from .processor import (
+    activate_demographic,
+    post_demographic_chunk,
+    start_streaming,
+    stop_streaming
+)
+
+FILE_FORMATS = ("csv", "ndjson", "parquet")
+CHUNK_SIZE = 1000
+WORKERS = 4
+
+
+def infer_format(path: str) -> str:
+    """
+    :param path: the location of a local demographics file
+    :return file_format: one of FILE_FORMATS, read from the file extension
+    """
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for file_format, extensions in (
+        ("csv", (".csv",)),
+        ("ndjson", (".ndjson", ".jsonl", ".json")),
+        ("parquet", (".parquet", ".pq"))
+    ):
+        if name.endswith(extensions):
+            return file_format
+    raise ValueError(f"Cannot infer the format of {path}: use {FILE_FORMATS}")
+
+
+def open_text(path: str):
+    """
+    :param path: the location of a local file, gzipped if it ends in .gz
+    :return file: the file opened for reading text
+    """
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def read_records(path: str, file_format=None, batch_size=CHUNK_SIZE):
+    """
+    :param path: the location of a local demographics file
+    :param file_format: one of FILE_FORMATS, inferred from the path by default
+    :param batch_size: the number of Parquet rows decoded at once
+    :return record: each demographic record in the file, in order
+    Records are read lazily, so only the records in flight are held in memory.
+    Blank CSV fields are read as None.
+    """
+    file_format = file_format or infer_format(path)
+    if file_format == "csv":
+        with open_text(path) as file:
+            for record in csv.DictReader(file):
+                yield {k: (v if v != "" else None) for k, v in record.items()}
+    elif file_format == "ndjson":
+        with open_text(path) as file:
+            yield from iter_ndjson(file)
+    elif file_format == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield from record_batch.to_pylist()
+    else:
+        raise ValueError(f"Unsupported format {file_format}: use {FILE_FORMATS}")
+
+
+class Checkpoint:
+    """
+    The Checkpoint records which chunks of a load have been committed, so a load
+    which crashes can be run again and resume where it stopped. It is a JSON
+    file, replaced atomically every time a chunk is marked complete.
+    """
+    def __init__(self, path: str, chunk_size: int):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.batch_id = None
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                state = json.load(file)
+            if state["chunk_size"] != chunk_size:
+                raise ValueError(
+                    f"{path} was written with chunk_size {state['chunk_size']}"
+                )
+            self.batch_id = state["batch_id"]
+            self.completed = set(state["completed"])
+
+    def save(self):
+        state = {
+            "batch_id": self.batch_id,
+            "chunk_size": self.chunk_size,
+            "completed": sorted(self.completed)
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.path)
+
+    def complete(self, chunk_index: int):
+        self.completed.add(chunk_index)
+        self.save()
+
+    def __str__(self):
+        return f"<Checkpoint: {self.batch_id}:{len(self.completed)} chunks>"
+
+
+def init_worker():
+    """
+    Each worker process opens its own database connections, and reads the
+    blocking table rather than a copy of the parent's block index
+    """
+    BLOCK_INDEX.reset()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def load_chunk(task: tuple) -> tuple:
+    """
+    :param task: (chunk_index, records, row, batch_id, user, version, initial_load)
+    :return chunk_index, metrics: the chunk's index and the counts it posted
+    Runs in a worker process: the chunk is posted on the load's batch with one
+    INSERT and one commit, then activated unless this is an initial load.
+    """
+    chunk_index, records, row, batch_id, user, version, initial_load = task
+    metrics = {
+        "affected_records": [],
+        "error_count": 0,
+        "error_rows": [],
+        "proc_ids": [],
+        "pending_count": 0,
+        "record_count": 0,
+        "skipped_count": 0,
+    }
+    with app.app_context():
+        auditor = Auditor.for_batch(batch_id, user, version, "demographic")
+        posted = post_demographic_chunk(records, auditor, metrics, row=row)
+        if not initial_load:
+            for _, record_id in posted:
+                activate_demographic({"record_id": record_id}, auditor)
+    del metrics["affected_records"], metrics["proc_ids"]
+
+    return chunk_index, metrics
+
+
+def recover_activations(batch_id: int, user: str, version: str) -> int:
+    """
+    :param batch_id: the batch of a load being resumed
+    :param user: the username issuing the command
+    :param version: the software version employed at the time
+    :return record_count: the records activated
+    A load which crashed after a chunk was inserted, but before it was
+    activated and checkpointed, leaves records POSTED on the batch but
+    inactive. Posting the chunk again drops them as duplicates, so they are
+    activated here instead.
+    """
+    with app.app_context():
+        query = select(Process.proc_record_id).\
+            join(Demographic, Demographic.record_id == Process.proc_record_id).\
+            where(
+                Process.batch_id == batch_id,
+                Process.proc_status == "POSTED",
+                Demographic.is_active.is_not(True)
+            ).\
+            order_by(Process.proc_record_id)
+        record_ids = db.session.execute(query).scalars().all()
+        auditor = Auditor.for_batch(batch_id, user, version, "demographic")
+        for record_id in record_ids:
+            activate_demographic({"record_id": record_id}, auditor)
+    print(f"batch {batch_id}: {len(record_ids)} records recovered", file=DEBUG_ROUTE)
+
+    return len(record_ids)
+
+
+def collect_chunks(done, checkpoint: Checkpoint, metrics: dict):
+    """
+    :param done: the finished futures of load_chunk
+    :param checkpoint: the Checkpoint of the load
+    :param metrics: the running metrics of the load
+    """
+    for future in done:
+        chunk_index, chunk_metrics = future.result()
+        checkpoint.complete(chunk_index)
+        metrics["chunk_count"] += 1
+        for key in ("error_count", "pending_count", "record_count", "skipped_count"):
+            metrics[key] += chunk_metrics[key]
+        metrics["error_rows"].extend(chunk_metrics["error_rows"])
+        print(
+            f"batch {checkpoint.batch_id}: chunk {chunk_index} committed",
+            file=DEBUG_ROUTE
+        )
+
+
+def load_file(
+        path: str,
+        user: str,
+        version: str,
+        file_format=None,
+        chunk_size=CHUNK_SIZE,
+        workers=WORKERS,
+        initial_load=False,
+        checkpoint_path=None
+) -> dict:
+    """
+    :param path: the location of a local demographics file
+    :param user: the username issuing the command
+    :param version: the software version employed at the time
+    :param file_format: one of FILE_FORMATS, inferred from the path by default
+    :param chunk_size: the number of records posted per chunk
+    :param workers: the number of worker processes posting chunks
+    :param initial_load: leave the records inactive for build_network
+    :param checkpoint_path: the checkpoint file, f"{path}.checkpoint" by default
+    :return metrics: the batch_id of the load and the counts it posted
+    The file is read lazily and split into chunks, which are posted in-process
+    by a pool of workers with at most two chunks per worker in flight. Run the
+    same load again after a crash to skip every chunk already committed, and
+    to activate any records a crash left inactive. The batch is closed only
+    once every chunk is collected; a load which fails leaves it STREAMING.
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{path}.checkpoint", chunk_size)
+    resumed = checkpoint.batch_id is not None
+    with app.app_context():
+        if not resumed:
+            checkpoint.batch_id = Auditor(user, version, "demographic").batch_id
+            checkpoint.save()
+        batch_id = checkpoint.batch_id
+        start_streaming(batch_id)
+    metrics = {
+        "batch_id": batch_id,
+        "chunk_count": 0,
+        "error_count": 0,
+        "error_rows": [],
+        "pending_count": 0,
+        "record_count": 0,
+        "recovered_count": 0,
+        "resumed_chunks": len(checkpoint.completed),
+        "skipped_count": 0,
+    }
+    if resumed and not initial_load:
+        metrics["recovered_count"] = recover_activations(batch_id, user, version)
+    with ProcessPoolExecutor(workers, initializer=init_worker) as executor:
+        in_flight = set()
+        records = read_records(path, file_format, chunk_size)
+        for chunk_index, chunk in enumerate(chunked(records, chunk_size)):
+            if chunk_index in checkpoint.completed:
+                continue
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect_chunks(done, checkpoint, metrics)
+            row = chunk_index * chunk_size + 1
+            task = (
+                chunk_index, chunk, row, batch_id, user, version, initial_load
+            )
+            in_flight.add(executor.submit(load_chunk, task))
+        done, _ = wait(in_flight)
+        collect_chunks(done, checkpoint, metrics)
+    stop_streaming(batch_id)
+
+    return metrics
@@ -0,0 +1,213 @@
+from hashlib import sha256
+import threading
+
+from sqlalchemy import select, text
+
+from . import engine
+from .logger import DEBUG_ROUTE
+from .model import db, Blocking, Demographic, EnterpriseGroup
+
+LOCK_STRIPES = 1024  # in-process locks standing in for advisory locks off Postgres
+# one set of stripes per kind of key, so they are ordered as the keys are
+STRIPES = {
+    "blocking": [threading.RLock() for _ in range(LOCK_STRIPES)],
+    "component": [threading.RLock() for _ in range(LOCK_STRIPES)],
+}
+
+
+class SharedLock:
+    """
+    An in-process lock held by any number of sharers or by one exclusive
+    holder, standing in for the network advisory lock off Postgres. As in
+    Postgres, a sharer waits behind an exclusive holder already waiting.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared_count = 0
+        self.exclusive_waiting = 0
+        self.exclusive = False
+
+    def acquire(self, exclusive=False):
+        with self.condition:
+            if exclusive:
+                self.exclusive_waiting += 1
+                self.condition.wait_for(lambda: not self.exclusive and self.shared_count == 0)
+                self.exclusive_waiting -= 1
+                self.exclusive = True
+            else:
+                self.condition.wait_for(
+                    lambda: not self.exclusive and self.exclusive_waiting == 0
+                )
+                self.shared_count += 1
+
+    def release(self, exclusive=False):
+        with self.condition:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.shared_count -= 1
+            self.condition.notify_all()
+
+
+NETWORK_LOCK = SharedLock()
+
+
+def lock_key(namespace: str, value) -> int:
+    """
+    :param namespace: "component" or "blocking"
+    :param value: the enterprise ID, or the blocking column and value
+    :return key: a signed 64-bit advisory lock key
+    """
+    digest = sha256(f"{namespace}:{value}".encode()).digest()
+
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def component_ids(record_ids) -> set:
+    """
+    :param record_ids: any demographic record IDs
+    :return component_ids: the enterprise ID of each record's patient graph, or
+    the record ID itself for a record in no graph
+    """
+    record_ids = set(record_ids)
+    query = select(EnterpriseGroup.record_id, EnterpriseGroup.enterprise_id).\
+        where(EnterpriseGroup.record_id.in_(record_ids))
+    groups = dict(db.session.execute(query).all())
+
+    return {groups.get(record_id, record_id) for record_id in record_ids}
+
+
+def blocking_values(record_ids) -> set:
+    """
+    :param record_ids: any demographic record IDs
+    :return blocking_values: each (column, value) these records could be matched
+    on, or each key of the blocking table they are in, in "prod", "lsh", or
+    "battery" mode
+    Neighbors in sort order share no value, so in "sorted_neighborhood" mode all
+     activations share one key
+    """
+    if engine.MODE == "sorted_neighborhood":
+        return {("neighborhood", None)}
+    if engine.MODE in ("prod", "lsh", "battery"):
+        query = select(Blocking.block_key).\
+            where(Blocking.record_id.in_(set(record_ids)))
+        return {("block_key", value) for value in db.session.execute(query).scalars()}
+    columns = [getattr(Demographic, column) for column in engine.BLOCKING_COLUMNS]
+    query = select(*columns).where(Demographic.record_id.in_(set(record_ids)))
+    values = set()
+    for row in db.session.execute(query).all():
+        for column, value in zip(engine.BLOCKING_COLUMNS, row):
+            if value is not None:
+                values.add((column, str(value)))
+
+    return values
+
+
+class GraphLock:
+    """
+    The GraphLock serializes only those changes to the patient network which
+    overlap. It takes Postgres session-level advisory locks, on a connection of
+    its own so that they outlive the processor's commits, keyed by:
+    - the blocking values of a record being activated, so that two records which
+      could match each other are never activated at once, and
+    - the patient graphs (components) a change touches.
+    Changes to disjoint graphs run in parallel. Every GraphLock first shares one
+    network key, which an exclusive GraphLock holds alone, so a bulk change such
+    as build_network waits for the others and they wait for it. Keys are always
+    taken in sorted order, the network key before blocking keys before component
+    keys, so two GraphLocks cannot deadlock.
+    A GraphLock holds a second pooled connection beside the session's, so the
+    pool is sized for two per POST worker in app.Config.
+    """
+    def __init__(self, exclusive=False):
+        """
+        :param exclusive: lock the whole network, as build_network does, rather
+        than share it with the other GraphLocks
+        """
+        self.connection = None
+        self.exclusive = exclusive
+        self.blocking_keys = list()
+        self.component_keys = list()
+
+    def __enter__(self):
+        if db.engine.dialect.name == "postgresql":
+            self.connection = db.engine.connect().\
+                execution_options(isolation_level="AUTOCOMMIT")
+        self.lock_network()
+
+        return self
+
+    def __exit__(self, e_type, value, traceback):
+        self.release("component", self.component_keys)
+        self.release("blocking", self.blocking_keys)
+        self.unlock_network()
+        if self.connection is not None:
+            self.connection.close()
+
+    def lock_network(self):
+        if self.connection is not None:
+            function = "pg_advisory_lock" if self.exclusive else "pg_advisory_lock_shared"
+            self.connection.execute(
+                text(f"SELECT {function}(:key)"), {"key": lock_key("network", None)}
+            )
+        else:
+            NETWORK_LOCK.acquire(self.exclusive)
+
+    def unlock_network(self):
+        if self.connection is not None:
+            function = "pg_advisory_unlock" if self.exclusive else "pg_advisory_unlock_shared"
+            self.connection.execute(
+                text(f"SELECT {function}(:key)"), {"key": lock_key("network", None)}
+            )
+        else:
+            NETWORK_LOCK.release(self.exclusive)
+
+    def acquire(self, namespace: str, keys: list):
+        if self.connection is not None:
+            for key in sorted(keys):
+                self.connection.execute(
+                    text("SELECT pg_advisory_lock(:key)"), {"key": key}
+                )
+        else:
+            for stripe in sorted({key % LOCK_STRIPES for key in keys}):
+                STRIPES[namespace][stripe].acquire()
+
+    def release(self, namespace: str, keys: list):
+        if self.connection is not None:
+            for key in keys:
+                self.connection.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": key}
+                )
+        else:
+            for stripe in {key % LOCK_STRIPES for key in keys}:
+                STRIPES[namespace][stripe].release()
+        keys.clear()
+
+    def lock_blocking(self, record_ids):
+        """
+        :param record_ids: the records about to be activated
+        """
+        self.blocking_keys.extend(
+            lock_key("blocking", value) for value in blocking_values(record_ids)
+        )
+        self.acquire("blocking", self.blocking_keys)
+
+    def lock_components(self, find_record_ids):
+        """
+        :param find_record_ids: a callable returning every record whose patient
+        graph is about to change
+        A graph can be merged or split while its lock is awaited, so the graphs
+        are found again once locked, until the locks held cover them all
+        """
+        while True:
+            keys = {
+                lock_key("component", component_id)
+                for component_id in component_ids(find_record_ids())
+            }
+            if keys.issubset(self.component_keys):
+                return
+            keys.update(self.component_keys)
+            self.release("component", self.component_keys)
+            self.component_keys.extend(keys)
+            self.acquire("component", self.component_keys)
+            print(f"graph lock holds {len(keys)} components", file=DEBUG_ROUTE)
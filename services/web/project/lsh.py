@@ -0,0 +1,88 @@
+from functools import lru_cache
+from hashlib import blake2b
+import re
+
+import numpy as np
+
+from .data_utils import field
+
+LSH_FIELDS = ("given_name", "family_name", "address_1")  # the text q-grams are taken from
+LSH_QGRAM = 3  # characters per q-gram
+LSH_BANDS = 20  # more bands: more candidates, fewer near-duplicates missed
+LSH_ROWS = 3  # more rows per band: fewer candidates, each more alike
+LSH_SEED = 8675309  # every process must draw the same hash functions
+LSH_PREFIX = "lsh:"  # the prefix of a band key in the blocking table
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def stable_hash(text: str) -> int:
+    """
+    :param text: any string
+    :return hash: a 64-bit hash, the same in every process, unlike hash()
+    """
+    return int.from_bytes(blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+@lru_cache(maxsize=None)
+def hash_functions(count: int) -> tuple:
+    """
+    :param count: the length of a signature
+    :return a, b: the coefficients of count universal hashes (a * x + b) mod p
+    """
+    generator = np.random.default_rng(LSH_SEED)
+    a = generator.integers(1, MERSENNE_PRIME, count, dtype=np.uint64)
+    b = generator.integers(0, MERSENNE_PRIME, count, dtype=np.uint64)
+
+    return a, b
+
+
+def qgrams(record) -> set:
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return qgrams: the character q-grams of each of LSH_FIELDS, lowercased and
+    stripped to letters and digits, each tagged with its field
+    """
+    grams = set()
+    for name in LSH_FIELDS:
+        text = re.sub(r"[^a-z0-9]", "", str(field(record, name) or "").lower())
+        if len(text) == 0:
+            continue
+        text = f"^{text}$"
+        for start in range(max(len(text) - LSH_QGRAM + 1, 1)):
+            grams.add(f"{name}:{text[start:start + LSH_QGRAM]}")
+
+    return grams
+
+
+def minhash(grams: set) -> np.ndarray:
+    """
+    :param grams: a non-empty set of q-grams
+    :return signature: the least hash of the set under each of the
+    LSH_BANDS * LSH_ROWS hash functions
+    """
+    a, b = hash_functions(LSH_BANDS * LSH_ROWS)
+    x = np.fromiter(
+        (stable_hash(gram) % MERSENNE_PRIME for gram in grams),
+        dtype=np.uint64,
+        count=len(grams)
+    )
+    # a and x are below 2 ** 31, so no product overflows 64 bits
+    return ((np.outer(a, x) + b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+
+def lsh_keys(record) -> list:
+    """
+    :param record: a demographic record, as a dict or as a row
+    :return block_keys: one "lsh:band:hash" key per band of its signature; two
+    records share a key with a probability rising steeply with their q-gram
+    Jaccard similarity, around (1 / LSH_BANDS) ** (1 / LSH_ROWS)
+    """
+    grams = qgrams(record)
+    if len(grams) == 0:
+        return []
+    bands = minhash(grams).reshape(LSH_BANDS, LSH_ROWS)
+
+    return [
+        f"{LSH_PREFIX}{band}:{blake2b(rows.tobytes(), digest_size=8).hexdigest()}"
+        for band, rows in enumerate(bands)
+    ]
@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+from functools import partial
 from jellyfish import (
     levenshtein_distance,
     damerau_levenshtein_distance,
@@ -6,22 +8,141 @@ from jellyfish import (
     metaphone
     )
 import Levenshtein as Lev
-import re
-
-
-def pairwise_string_metrics(a: str, b: str) -> dict:
+import numpy as np
+from os.path import commonprefix
+from rapidfuzz.distance import (
+    DamerauLevenshtein,
+    Hamming,
+    Indel,
+    JaroWinkler,
+    Levenshtein
+)
+from rapidfuzz.process import cdist
+
+from .features import alpha_composite, feature, field_features
+
+# the same metrics as pairwise_string_metrics, as rapidfuzz scorers for cdist
+BATCH_SCORERS = {
+    "damerau_levenshtein_distance": (DamerauLevenshtein.distance, np.int32),
+    "hamming_distance": (Hamming.distance, np.int32),
+    "jaro_winkler": (JaroWinkler.normalized_similarity, np.float64),
+    "levenshtein_distance": (Levenshtein.distance, np.int32),
+    "ratio": (Indel.normalized_similarity, np.float64),
+}
+STRING_FIELDS = (
+    "family_name",
+    "given_name",
+    "middle_name",
+    "address_1",
+    "address_2",
+    "postal_code",
+)
+
+
+def pairwise_string_metrics(a: str, b: str, metaphone_a=None, metaphone_b=None) -> dict:
+    if metaphone_a is None:
+        metaphone_a = metaphone(a)
+    if metaphone_b is None:
+        metaphone_b = metaphone(b)
     return {
         "damerau_levenshtein_distance": damerau_levenshtein_distance(a, b),
         "equal": a == b,
         "hamming_distance": hamming_distance(a, b),
         "jaro_winkler": jaro_winkler(a, b),
         "levenshtein_distance": levenshtein_distance(a, b),
-        "metaphone": metaphone(a) == metaphone(b),
+        "metaphone": metaphone_a == metaphone_b,
         "ratio": Lev.ratio(a, b),
         "strings": (a, b)
     }
 
 
+def batch_string_metrics(a: str, candidates: list, metaphone_a=None, metaphones=None) -> dict:
+    """
+    :param a: the query string
+    :param candidates: the N strings to compare it with
+    :param metaphone_a: the stored metaphone of a, if any
+    :param metaphones: the stored metaphone of each candidate, None where it has none
+    :return metrics: an array of N values for each metric of
+    pairwise_string_metrics, each scored against all candidates in one call
+    """
+    metrics = {
+        name: cdist([a], candidates, scorer=scorer, dtype=dtype)[0]
+        for name, (scorer, dtype) in BATCH_SCORERS.items()
+    }
+    if len(a) == 0:  # jellyfish scores two empty strings 0.0, not 1.0
+        metrics["jaro_winkler"][[len(b) == 0 for b in candidates]] = 0.0
+    candidate_array = np.array(candidates, dtype=object)
+    metrics["equal"] = candidate_array == a
+    if metaphone_a is None:
+        metaphone_a = metaphone(a)
+    if metaphones is None:
+        metaphones = [None] * len(candidates)
+    metrics["metaphone"] = np.fromiter(
+        (
+            (metaphone_b if metaphone_b is not None else metaphone(b)) == metaphone_a
+            for b, metaphone_b in zip(candidates, metaphones)
+        ),
+        dtype=bool,
+        count=len(candidates)
+    )
+
+    return metrics
+
+
+def pair_string_metrics(metrics: dict, index: int, a: str, b: str) -> dict:
+    """
+    :param metrics: the output of batch_string_metrics
+    :param index: the candidate's place in the batch
+    :param a: the query string
+    :param b: the candidate string
+    :return metrics: the candidate's pairwise_string_metrics
+    """
+    return {
+        "damerau_levenshtein_distance": int(metrics["damerau_levenshtein_distance"][index]),
+        "equal": bool(metrics["equal"][index]),
+        "hamming_distance": int(metrics["hamming_distance"][index]),
+        "jaro_winkler": float(metrics["jaro_winkler"][index]),
+        "levenshtein_distance": int(metrics["levenshtein_distance"][index]),
+        "metaphone": bool(metrics["metaphone"][index]),
+        "ratio": float(metrics["ratio"][index]),
+        "strings": (a, b)
+    }
+
+
+def batch_record_metrics(record_a, records_b: list, fields=STRING_FIELDS) -> dict:
+    """
+    :param record_a: the query record
+    :param records_b: the N candidate records
+    :param fields: the string fields to score
+    :return metrics: the batch_string_metrics of each field, with the records'
+    stored metaphones
+    """
+    return {
+        name: batch_string_metrics(
+            record_a.get(name) or "",
+            [record_b.get(name) or "" for record_b in records_b],
+            record_a.get(f"{name}_metaphone"),
+            [record_b.get(f"{name}_metaphone") for record_b in records_b]
+        )
+        for name in fields
+    }
+
+
+def stored_string_metrics(record_a, record_b, name: str):
+    """
+    :param record_a: one record series to be compared
+    :param record_b: one record series to be compared
+    :param name: the field to be scored
+    :return string_metrics: pairwise_string_metrics, given the records' stored
+    metaphones of the field
+    """
+    return partial(
+        pairwise_string_metrics,
+        metaphone_a=record_a.get(f"{name}_metaphone"),
+        metaphone_b=record_b.get(f"{name}_metaphone")
+    )
+
+
 def string_replacer(a: str, b: str, pattern: str, repl: str) -> (str, str):
     return a.replace(pattern, repl), b.replace(pattern, repl)
 
@@ -60,13 +181,14 @@ def slice_string_check(a: str, b: str, slice_min=3) -> (bool, int):
         slice_max = len_a
     else:
         slice_max = len_b
+    # the longest slice found equal is the common prefix, so go straight to it
+    prefix = len(commonprefix([a, b]))
+    if prefix < slice_min:
+        return False, 0
     slice_weight = 1.0
-    for i in range(slice_max, slice_min-1, -1):
-        slice_result = compare_strings_equal(*string_slicer(a, b, i))
-        if slice_result:
-            return slice_result, round(slice_weight, 1)
+    for _ in range(slice_max - prefix):  # the same steps as slicing down to it
         slice_weight -= 1 / slice_max
-    return False, 0
+    return True, round(slice_weight, 1)
 
 
 def alpha_composite_name_check(a: str, b: str) -> (bool, str, str):
@@ -76,73 +198,79 @@ def alpha_composite_name_check(a: str, b: str) -> (bool, str, str):
     :return result, a_sub, b_sub: (a bool of a test result, and the
     composite identified)
     """
-    regex = re.compile("[^a-zA-Z]")
-    a_sub = regex.sub("", a)
-    b_sub = regex.sub("", b)
+    a_sub = alpha_composite(a)
+    b_sub = alpha_composite(b)
     result = compare_strings_equal(a_sub, b_sub)
 
     return result, a_sub, b_sub
 
 
-def family_name_check(a: str, b: str) -> (bool, dict):
+def family_name_check(a: str, b: str, string_metrics=pairwise_string_metrics,
+                      features_a=None, features_b=None) -> (bool, dict):
     """
     :param a: one string value to be compared
     :param b: one string value to be compared
+    :param string_metrics: the function scoring a and b
+    :param features_a: the stored features of a, as field_features gives
+    :param features_b: the stored features of b, as field_features gives
     :return result, metrics: (a bool of a test result, and the result details)
     """
     result = compare_strings_equal(a, b)
     if result:
         return result, {"equal": True}
-    metrics = pairwise_string_metrics(a, b)
+    metrics = string_metrics(a, b)
     trim_a, trim_b = string_trimmer(a, b)
     if compare_strings_equal(trim_a, trim_b):
         metrics["trim_result"] = trim_a
-    alpha_composite_result, sub_a, sub_b = alpha_composite_name_check(a, b)
-    if alpha_composite_result:
+    sub_a = feature(a, "alpha", features_a)
+    if compare_strings_equal(sub_a, feature(b, "alpha", features_b)):
         metrics["sub_result"] = sub_a
     if compare_strings_equal(
-        *string_trimmer(
-            *string_replacer(sub_a, sub_b, "JR", "")
-        )
+        feature(a, "junior", features_a),
+        feature(b, "junior", features_b)
     ):
         metrics["junior_detected"] = True
     if compare_strings_equal(
-        *string_trimmer(
-            *string_replacer(sub_a, sub_b, "SR", "")
-        )
+        feature(a, "senior", features_a),
+        feature(b, "senior", features_b)
     ):
         metrics["senior_detected"] = True
 
     return result, metrics
 
 
-def given_name_check(a: str, b: str) -> (bool, dict):
+def given_name_check(a: str, b: str, string_metrics=pairwise_string_metrics,
+                     features_a=None, features_b=None) -> (bool, dict):
     """
     :param a: one string value to be compared
     :param b: one string value to be compared
+    :param string_metrics: the function scoring a and b
+    :param features_a: the stored features of a, as field_features gives
+    :param features_b: the stored features of b, as field_features gives
     :return result, metrics: (a bool of a test result, and the result details)
     """
     result = compare_strings_equal(a, b)
     if result:
         return result, {"equal": True}
-    metrics = pairwise_string_metrics(a, b)
+    metrics = string_metrics(a, b)
     trim_a, trim_b = string_trimmer(a, b)
     if compare_strings_equal(trim_a, trim_b):
         metrics["trim_result"] = trim_a
     slice_result, slice_weight = slice_string_check(a, b)
     if slice_result:
         metrics["slice_weight"] = slice_weight
-    alpha_composite_result, sub_a, _ = alpha_composite_name_check(a, b)
-    if alpha_composite_result:
+    sub_a = feature(a, "alpha", features_a)
+    if compare_strings_equal(sub_a, feature(b, "alpha", features_b)):
         metrics["sub_result"] = sub_a
 
     return result, metrics
     
 
-def middle_name_check(a: str, b: str) -> (bool, dict):
+def middle_name_check(a: str, b: str, string_metrics=pairwise_string_metrics) -> (bool, dict):
     """
     :param a: one string value to be compared
     :param b: one string value to be compared
+    :param string_metrics: the function scoring a and b
     :return result, metrics: (a bool of a test result, and the result details)
     """
     result = compare_strings_equal(a, b)
@@ -150,7 +278,7 @@ def middle_name_check(a: str, b: str) -> (bool, dict):
         return result, {"blank": True}
     if result:
         return result, {"equal": True}
-    metrics = pairwise_string_metrics(a, b)
+    metrics = string_metrics(a, b)
     trim_a, trim_b = string_trimmer(a, b)
     if compare_strings_equal(trim_a, trim_b):
         metrics["trim_result"] = trim_a
@@ -160,10 +288,11 @@ def middle_name_check(a: str, b: str) -> (bool, dict):
     return result, metrics
 
 
-def address_check(a: str, b: str) -> (bool, dict):
+def address_check(a: str, b: str, string_metrics=pairwise_string_metrics) -> (bool, dict):
     """
     :param a: one string value to be compared
     :param b: one string value to be compared
+    :param string_metrics: the function scoring a and b
     :return result, metrics: (a bool of a test result, and the result details)
     """
     result = compare_strings_equal(a, b)
@@ -171,7 +300,7 @@ def address_check(a: str, b: str) -> (bool, dict):
         return result, {"address_blank": True}
     if result:
         return result, {"equal": True}
-    metrics = pairwise_string_metrics(a, b)
+    metrics = string_metrics(a, b)
     slice_result, slice_weight = slice_string_check(a, b)
     if slice_result:
         metrics["slice_weight"] = slice_weight
@@ -179,10 +308,11 @@ def address_check(a: str, b: str) -> (bool, dict):
     return result, metrics
 
 
-def postal_check(a: str, b: str) -> (bool, dict):
+def postal_check(a: str, b: str, string_metrics=pairwise_string_metrics) -> (bool, dict):
     """
     :param a: one string value to be compared
     :param b: one string value to be compared
+    :param string_metrics: the function scoring a and b
     :return result, metrics: (a bool of a test result, and the result details)
     """
     result = compare_strings_equal(a, b)
@@ -190,28 +320,35 @@ def postal_check(a: str, b: str) -> (bool, dict):
         return result, {"postal_blank": True}
     if result:
         return result, {"equal": True}
-    metrics = pairwise_string_metrics(a, b)
+    metrics = string_metrics(a, b)
 
     return result, metrics
 
 
-def wrap_address_check(record_a: dict, record_b: dict) -> dict:
+def wrap_address_check(record_a: dict, record_b: dict, field_metrics=None) -> dict:
     """
     :param record_a: one record series to be compared
     :param record_b: one record series to be compared
+    :param field_metrics: a string_metrics function for any field, in place of
+    pairwise_string_metrics
     :return wrapped metrics: a wrapper on address metrics results
+    The records' stored features are read rather than computed, where they have them
     """
+    field_metrics = field_metrics or dict()
     postal_result, postal_metrics = postal_check(
         record_a.get("postal_code", None),
-        record_b.get("postal_code", None)
+        record_b.get("postal_code", None),
+        field_metrics.get("postal_code") or stored_string_metrics(record_a, record_b, "postal_code")
     )
     address_1_result, address_1_metrics = address_check(
         record_a.get("address_1", None),
-        record_b.get("address_1", None)
+        record_b.get("address_1", None),
+        field_metrics.get("address_1") or stored_string_metrics(record_a, record_b, "address_1")
     )
     address_2_result, address_2_metrics = address_check(
         record_a.get("address_2", None),
-        record_b.get("address_2", None)
+        record_b.get("address_2", None),
+        field_metrics.get("address_2") or stored_string_metrics(record_a, record_b, "address_2")
     )
 
     return {
@@ -226,23 +363,34 @@ def wrap_address_check(record_a: dict, record_b: dict) -> dict:
     }
 
 
-def wrap_name_check(record_a: dict, record_b: dict) -> dict:
+def wrap_name_check(record_a: dict, record_b: dict, field_metrics=None) -> dict:
     """
     :param record_a: one record series to be compared
     :param record_b: one record series to be compared
+    :param field_metrics: a string_metrics function for any field, in place of
+    pairwise_string_metrics
     :return wrapped metrics: a wrapper on name metrics results
+    The records' stored features are read rather than computed, where they have them
     """
+    field_metrics = field_metrics or dict()
     fam_name_result, fam_name_metrics = family_name_check(
         record_a.get("family_name", None),
-        record_b.get("family_name", None)
+        record_b.get("family_name", None),
+        field_metrics.get("family_name") or stored_string_metrics(record_a, record_b, "family_name"),
+        field_features(record_a, "family_name"),
+        field_features(record_b, "family_name")
     )
     given_name_result, given_name_metrics = given_name_check(
         record_a.get("given_name", None),
-        record_b.get("given_name", None)
+        record_b.get("given_name", None),
+        field_metrics.get("given_name") or stored_string_metrics(record_a, record_b, "given_name"),
+        field_features(record_a, "given_name"),
+        field_features(record_b, "given_name")
     )
     mid_name_result, mid_name_metrics = middle_name_check(
         record_a.get("middle_name", None),
-        record_b.get("middle_name", None)
+        record_b.get("middle_name", None),
+        field_metrics.get("middle_name") or stored_string_metrics(record_a, record_b, "middle_name")
     )
     
     return {
@@ -255,3 +403,61 @@ def wrap_name_check(record_a: dict, record_b: dict) -> dict:
             "middle_name": mid_name_metrics
         }
     }
+
+
+# the metrics a score test may name, as "<field>.<metric>", and how each is computed
+STRING_METRICS = {
+    "damerau_levenshtein_distance": damerau_levenshtein_distance,
+    "equal": compare_strings_equal,
+    "hamming_distance": hamming_distance,
+    "jaro_winkler": jaro_winkler,
+    "levenshtein_distance": levenshtein_distance,
+    "metaphone": compare_strings_equal,  # of the two metaphones
+    "ratio": Lev.ratio,
+}
+RECORD_METRICS = {
+    "name_day.equal": ("name_day", compare_nameday_equal),
+    "social_security_number.equal": ("social_security_number", compare_ssn_equal),
+}
+METRIC_NAMES = frozenset(
+    [f"{name}.{metric}" for name in STRING_FIELDS for metric in STRING_METRICS] +
+    list(RECORD_METRICS)
+)
+
+
+class LazyMetrics(Mapping):
+    """
+    The LazyMetrics of two records maps each of METRIC_NAMES to its value. A
+    metric is computed when it is first read, and memoized in computed, so a
+    battery of score tests costs only the metrics its tests name.
+    """
+    def __init__(self, record_a, record_b):
+        self.record_a = record_a
+        self.record_b = record_b
+        self.computed = dict()
+
+    def __getitem__(self, metric_name: str):
+        if metric_name not in self.computed:
+            self.computed[metric_name] = self.compute(metric_name)
+
+        return self.computed[metric_name]
+
+    def compute(self, metric_name: str):
+        if metric_name not in METRIC_NAMES:
+            raise KeyError(metric_name)
+        if metric_name in RECORD_METRICS:
+            name, compare = RECORD_METRICS[metric_name]
+            return compare(self.record_a.get(name), self.record_b.get(name))
+        name, metric = metric_name.split(".")
+        a, b = self.record_a.get(name) or "", self.record_b.get(name) or ""
+        if metric == "metaphone":
+            a = feature(a, "metaphone", field_features(self.record_a, name))
+            b = feature(b, "metaphone", field_features(self.record_b, name))
+
+        return STRING_METRICS[metric](a, b)
+
+    def __iter__(self):
+        return iter(sorted(METRIC_NAMES))
+
+    def __len__(self):
+        return len(METRIC_NAMES)
@@ -1,11 +1,113 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+import os
+from sqlalchemy import DDL, event, func, select
 from sqlalchemy_serializer import SerializerMixin
+import threading
 
 from .app import app
 db = SQLAlchemy(app)
 
 
+ETL_ID_BLOCK_SIZE = 100  # the increment of etl_id_seq: IDs leased per block
+
+# every primary key in the warehouse is drawn from this one number-line
+etl_id_sequence = db.Sequence(
+    "etl_id_seq",
+    start=1,
+    increment=ETL_ID_BLOCK_SIZE,
+    metadata=db.metadata
+)
+
+
+class KeyAllocator:
+    """
+    The KeyAllocator leases contiguous blocks of ETL IDs from etl_id_seq and
+    hands them out from memory. Each worker process holds its own blocks, one
+    per (user, version), so the user/version provenance is inserted into the
+    ETLIDSource once per block rather than once per ID. An ETLIDSource row's
+    etl_id is the first ID of its block and block_size says how far it runs.
+    IDs left in a block when a worker exits are simply never used.
+    """
+    def __init__(self, block_size=ETL_ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.blocks = dict()
+
+    def next_block_start(self) -> int:
+        """
+        :return block_start: the first ID of a newly reserved block
+        Postgres reserves the block atomically with nextval() on etl_id_seq;
+        dialects without sequences (sqlite, in testing) continue after the
+        highest block already recorded in the ETLIDSource.
+        """
+        if db.engine.dialect.name == "postgresql":
+            return db.session.execute(
+                select(etl_id_sequence.next_value())
+            ).scalar()
+        block_end = db.session.execute(
+            select(
+                func.max(
+                    ETLIDSource.etl_id +
+                    func.coalesce(ETLIDSource.block_size, 1)
+                )
+            )
+        ).scalar()
+
+        return block_end or 1
+
+    def lease(self, user: str, version: str) -> list:
+        """
+        :param user: the username issuing the command
+        :param version: the software version employed at the time
+        :return block: [next_id, stop] for a newly leased block of IDs
+        """
+        with app.app_context():
+            block_start = self.next_block_start()
+            staged_key_record = {
+                "etl_id": block_start,
+                "block_size": self.block_size,
+                "id_created_ts": datetime.now(),
+                "user": user,
+                "version": version
+            }
+            etl_id_source_record = ETLIDSource(**staged_key_record)  # type: ignore
+            db.session.add(etl_id_source_record)
+            db.session.commit()
+
+        return [block_start, block_start + self.block_size]
+
+    def take(self, user: str, version: str, count: int = 1) -> list:
+        """
+        :param user: the username issuing the command
+        :param version: the software version employed at the time
+        :param count: how many IDs to hand out
+        :return etl_ids: a list of unique IDs, leasing new blocks as needed
+        """
+        etl_ids = list()
+        with self.lock:
+            if self.pid != os.getpid():  # blocks do not survive a fork
+                self.pid = os.getpid()
+                self.blocks = dict()
+            while len(etl_ids) < count:
+                block = self.blocks.get((user, version))
+                if block is None or block[0] >= block[1]:
+                    block = self.lease(user, version)
+                    self.blocks[(user, version)] = block
+                stop = min(block[1], block[0] + count - len(etl_ids))
+                etl_ids.extend(range(block[0], stop))
+                block[0] = stop
+
+        return etl_ids
+
+    def __call__(self, user: str, version: str) -> int:
+        return self.take(user, version)[0]
+
+
+KEY_ALLOCATOR = KeyAllocator()
+
+
 def key_gen(user: str, version: str) -> int:
     """
     :param user: the username issuing the command
@@ -17,22 +119,11 @@ def key_gen(user: str, version: str) -> int:
         (and soon, crosswalk IDs)
       (3) it actually makes sense to do this all along one number-line
     This function is employed wherever a new record is staged for insertion
-    User, version, and timestamp metadata are inserted into the ETLIDSource,
-    this insertion provides the auto-incremented ID which is what's returned.
+    IDs are handed out from the worker's KEY_ALLOCATOR, which leases them in
+    blocks from etl_id_seq and records the user, version, and timestamp
+    metadata in the ETLIDSource once per block.
     """
-    with app.app_context():
-        staged_key_record = {
-            "id_created_ts": datetime.now(),
-            "user": user,
-            "version": version
-        }
-        etl_id_source_record = ETLIDSource(**staged_key_record)  # type: ignore
-        db.session.add(etl_id_source_record)
-        db.session.commit()
-        db.session.refresh(etl_id_source_record)
-        etl_id = etl_id_source_record.etl_id
-
-    return etl_id
+    return KEY_ALLOCATOR(user, version)
 
 
 # the record of requests to delete an action
@@ -56,17 +147,31 @@ class Demographic(db.Model, SerializerMixin):
     middle_name = db.Column(db.Text)
     family_name = db.Column(db.Text)
     gender = db.Column(db.Text)
-    name_day = db.Column(db.DateTime)
+    name_day = db.Column(db.DateTime, index=True)
     address_1 = db.Column(db.Text)
     address_2 = db.Column(db.Text)
     city = db.Column(db.Text)
     state = db.Column(db.Text)
-    postal_code = db.Column(db.Text)
+    postal_code = db.Column(db.Text, index=True)
     social_security_number = db.Column(db.Text)
     uq_hash = db.Column(db.Text, unique=True)
     composite_key = db.Column(db.Text)
-    composite_name = db.Column(db.Text)
-    composite_name_day_postal_code = db.Column(db.Text)
+    composite_name = db.Column(db.Text, index=True)
+    composite_name_day_postal_code = db.Column(db.Text, index=True)
+    given_name_alpha = db.Column(db.Text)
+    given_name_metaphone = db.Column(db.Text)
+    given_name_soundex = db.Column(db.Text)
+    given_name_nysiis = db.Column(db.Text)
+    middle_name_metaphone = db.Column(db.Text)
+    family_name_alpha = db.Column(db.Text)
+    family_name_junior = db.Column(db.Text)
+    family_name_senior = db.Column(db.Text)
+    family_name_metaphone = db.Column(db.Text)
+    family_name_soundex = db.Column(db.Text)
+    family_name_nysiis = db.Column(db.Text)
+    address_1_metaphone = db.Column(db.Text)
+    address_2_metaphone = db.Column(db.Text)
+    postal_code_metaphone = db.Column(db.Text)
     is_active = db.Column(db.Boolean)
     transaction_key = db.Column(db.Text, index=True)
     source_key = db.Column(db.Text)
@@ -75,12 +180,32 @@ class Demographic(db.Model, SerializerMixin):
     touched_ts = db.Column(db.DateTime)
 
 
+# the trigram indexes of the "trigram" coarse-matching mode, on Postgres only
+TRIGRAM_COLUMNS = ("given_name", "family_name", "address_1")
+event.listen(
+    Demographic.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+for trigram_column in TRIGRAM_COLUMNS:
+    event.listen(
+        Demographic.__table__,
+        "after_create",
+        DDL(
+            f"CREATE INDEX IF NOT EXISTS demographic_{trigram_column}_trgm "
+            f"ON demographic USING gin (lower({trigram_column}) gin_trgm_ops)"
+        ).execute_if(dialect="postgresql")
+    )
+
+
 # the record of requests to activate a demographic record
 class DemographicActivation(db.Model, SerializerMixin):  
     __tablename__ = "activate_demographic"
     etl_id = db.Column(db.BigInteger, primary_key=True)
     record_id = db.Column(db.BigInteger)
     transaction_key = db.Column(db.Text, index=True)
+    candidate_count = db.Column(db.BigInteger)
+    pruned_count = db.Column(db.BigInteger)
 
 
 # the record of requests to archive a demographic record
@@ -105,6 +230,20 @@ class DemographicArchive(db.Model, SerializerMixin):
     composite_key = db.Column(db.Text)
     composite_name = db.Column(db.Text)
     composite_name_day_postal_code = db.Column(db.Text)
+    given_name_alpha = db.Column(db.Text)
+    given_name_metaphone = db.Column(db.Text)
+    given_name_soundex = db.Column(db.Text)
+    given_name_nysiis = db.Column(db.Text)
+    middle_name_metaphone = db.Column(db.Text)
+    family_name_alpha = db.Column(db.Text)
+    family_name_junior = db.Column(db.Text)
+    family_name_senior = db.Column(db.Text)
+    family_name_metaphone = db.Column(db.Text)
+    family_name_soundex = db.Column(db.Text)
+    family_name_nysiis = db.Column(db.Text)
+    address_1_metaphone = db.Column(db.Text)
+    address_2_metaphone = db.Column(db.Text)
+    postal_code_metaphone = db.Column(db.Text)
     is_active = db.Column(db.Boolean)
     archive_transaction_key = db.Column(db.Text)
     transaction_key = db.Column(db.Text, index=True)
@@ -136,6 +275,12 @@ class Batch(db.Model, SerializerMixin):
     batch_id = db.Column(db.BigInteger, primary_key=True)
     batch_action = db.Column(db.Text, nullable=False)
     batch_status = db.Column(db.Text, nullable=False)
+    batch_ts = db.Column(db.DateTime)
+    # running counts of the batch's processes, kept for progress reporting
+    pending_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    done_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    skipped_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    error_count = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
 
 
 # the record of patient graph changes
@@ -150,6 +295,20 @@ class Bulletin(db.Model, SerializerMixin):
     bulletin_ts = db.Column(db.DateTime)
 
 
+# the blocking keys of each demographic record: records sharing a key are compared
+class Blocking(db.Model, SerializerMixin):
+    __tablename__ = "blocking"
+    block_key = db.Column(db.Text, primary_key=True)
+    record_id = db.Column(db.BigInteger, primary_key=True, index=True)
+
+
+# the active records in each block of the blocking table, counted as they change
+class BlockSize(db.Model, SerializerMixin):
+    __tablename__ = "block_size"
+    block_key = db.Column(db.Text, primary_key=True)
+    record_count = db.Column(db.BigInteger, nullable=False)
+
+
 # the record of processes spawned by API requests
 class Process(db.Model, SerializerMixin):
     __tablename__ = "process"
@@ -163,14 +322,64 @@ class Process(db.Model, SerializerMixin):
 
 
 # the source table for all primary keys, preserving request meta-data
+# each row is one leased block: etl_id through etl_id + block_size - 1
 class ETLIDSource(db.Model, SerializerMixin):  
     __tablename__ = "etl_id_source"
     etl_id = db.Column(db.BigInteger, primary_key=True)
+    block_size = db.Column(db.BigInteger)
     user = db.Column(db.Text)
     version = db.Column(db.Text)
     id_created_ts = db.Column(db.DateTime)
 
 
+def etl_id_seq_setval():
+    """
+    :return statement: a SELECT moving etl_id_seq past the end of the highest
+    block recorded in the ETLIDSource, and never backwards
+    """
+    block_end = select(
+        func.max(ETLIDSource.etl_id + func.coalesce(ETLIDSource.block_size, 1))
+    ).scalar_subquery()
+
+    return select(func.setval(
+        etl_id_sequence.name,
+        func.greatest(func.coalesce(block_end, 1), etl_id_sequence.next_value()),
+        False
+    ))
+
+
+def sync_etl_id_seq():
+    """
+    Starts etl_id_seq after every ID already in the ETLIDSource, e.g. in a
+    database whose IDs were minted before the sequence existed, so that no
+    leased block reuses one. Off Postgres, blocks already continue after the
+    highest recorded, so there is nothing to do.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(etl_id_seq_setval())
+        db.session.commit()
+
+
+# the durable queue of POSTed batches waiting on a worker: one job per batch
+class Job(db.Model, SerializerMixin):
+    __tablename__ = "job"
+    __table_args__ = (
+        db.Index("job_claim_index", "job_status", "run_after_ts"),
+    )
+    batch_id = db.Column(db.BigInteger, primary_key=True)
+    endpoint = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    user = db.Column(db.Text)
+    job_status = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker_id = db.Column(db.Text)
+    error = db.Column(db.Text)
+    enqueued_ts = db.Column(db.DateTime)
+    run_after_ts = db.Column(db.DateTime)
+    heartbeat_ts = db.Column(db.DateTime)
+    finished_ts = db.Column(db.DateTime)
+
+
 # the record of match affirmation activities
 class MatchAffirmation(db.Model, SerializerMixin):  
     __tablename__ = "match_affirm"
@@ -266,7 +475,7 @@ class CrosswalkBind(db.Model, SerializerMixin):
 class Battery(db.Model, SerializerMixin):
     __tablename__ = "score_battery"
     battery_id = db.Column(db.BigInteger, primary_key=True)
-    test_id = db.Column(db.BigInteger)
+    test_id = db.Column(db.BigInteger, primary_key=True)
     touched_by = db.Column(db.Text)
     touched_ts = db.Column(db.DateTime)
 
@@ -287,6 +496,7 @@ MODEL_MAP = {
     "activate_demographic": DemographicActivation,
     "archive_demographic": DemographicArchive,
     "batch": Batch,
+    "blocking": Blocking,
     "bulletin": Bulletin,
     "crosswalk": Crosswalk,
     "crosswalk_bind": CrosswalkBind,
@@ -297,6 +507,7 @@ MODEL_MAP = {
     "enterprise_group": EnterpriseGroup,
     "enterprise_match": EnterpriseMatch,
     "etl_id_source": ETLIDSource,
+    "job": Job,
     "match_affirm": MatchAffirmation,
     "match_deny": MatchDenial,
     "process": Process,
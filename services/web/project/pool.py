@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from .app import app
+from .logger import DEBUG_ROUTE, mylogger
+
+
+class WorkerPool:
+    """
+    The WorkerPool runs POST processors on a fixed number of threads. Beyond the
+    jobs running, at most queue_size jobs wait their turn; a job admitted past
+    that is refused, so the request can be answered busy instead of spawning
+    another thread to fight over the database connections.
+    """
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="post")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def admit(self) -> bool:
+        """
+        :return admitted: whether there is room for one more job
+        An admitted job holds its place until it is submitted and finished, or
+         until it is released
+        """
+        admitted = self.slots.acquire(blocking=False)
+        with self.lock:
+            if admitted:
+                self.admitted += 1
+            else:
+                self.rejected += 1
+
+        return admitted
+
+    def release(self):
+        """
+        Gives up the place of an admitted job which will not be submitted
+        """
+        with self.lock:
+            self.admitted -= 1
+        self.slots.release()
+
+    def run(self, processor, *args):
+        with self.lock:
+            self.running += 1
+        try:
+            processor(*args)
+            with self.lock:
+                self.completed += 1
+        except Exception as error_msg:
+            mylogger.error(f"{processor.__name__} failed: {error_msg}")
+            print(error_msg, file=DEBUG_ROUTE)
+            with self.lock:
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.running -= 1
+            self.release()
+
+    def submit(self, processor, *args):
+        """
+        :param processor: the processor of an admitted job
+        :param args: the arguments of the processor
+        """
+        try:
+            self.executor.submit(self.run, processor, *args)
+        except RuntimeError:
+            self.release()
+            raise
+
+    def metrics(self) -> dict:
+        """
+        :return metrics: the pool's size, its queue depth, and its utilization
+        """
+        with self.lock:
+            metrics = {
+                "completed_count": self.completed,
+                "failed_count": self.failed,
+                "queue_depth": self.admitted - self.running,
+                "queue_size": self.queue_size,
+                "rejected_count": self.rejected,
+                "running_count": self.running,
+                "utilization": round(self.running / self.workers, 2),
+                "workers": self.workers,
+            }
+
+        return metrics
+
+
+POST_POOL = WorkerPool(app.config["POST_WORKERS"], app.config["POST_QUEUE_SIZE"])
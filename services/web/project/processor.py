@@ -1,15 +1,28 @@
-from datetime import datetime
-from sqlalchemy import or_
+from datetime import date, datetime
+from sqlalchemy import and_, case, column, or_, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 
 from .app import app
-from .data_utils import apply_record_metadata
-from .engine import compute_all_matches
-from .graphing import GraphCursor, GraphReCursor
+from .block_index import BLOCK_INDEX
+from .blocking import drop_blocks, index_blocks, resize_blocks
+from .data_utils import apply_batch_metadata, apply_record_metadata, chunked
+from .dedupe import DUPLICATE_FILTER
+from .engine import (
+    candidate_pairs,
+    compute_all_matches,
+    compute_pair_matches,
+    lsh_indexed,
+    neighborhood_pairs,
+    NEIGHBORHOOD_WINDOW
+)
+from .graphing import build_enterprise_network, GraphCursor, GraphReCursor
+from .locking import GraphLock
 from .logger import DEBUG_ROUTE, version
 from .model import (
     db,
     key_gen,
+    KEY_ALLOCATOR,
     Batch,
     Delete,
     Demographic,
@@ -25,6 +38,9 @@ from .model import (
     MODEL_MAP
 )
 
+BULK_CHUNK_SIZE = 1000  # records per INSERT in demographic_bulk
+STREAM_CHUNK_SIZE = 1000  # records held in memory by demographic_stream
+
 
 def mint_transaction_key(auditor, row=None, foreign_record_id=None) -> tuple:
     """
@@ -42,6 +58,18 @@ def mint_transaction_key(auditor, row=None, foreign_record_id=None) -> tuple:
     return transaction_key, proc_id, auditor.batch_id, auditor.user, ts
 
 
+def mint_transaction_keys(auditor, rows: list, proc_status="PENDING") -> list:
+    """
+    :param auditor: context management object for the transaction
+    :param rows: (row, foreign_record_id) for each record about to be posted
+    :param proc_status: the status the processes are stamped with
+    :return stamps: (proc_id, transaction_key) for each row, in order
+    This function wraps the call to auditor.stamp.bulk(), which stamps every row
+     of a multi-row POST before any of its records are posted
+    """
+    return auditor.stamp.bulk(rows, proc_status)
+
+
 def transact_records(record, table: str) -> int:
     """
     :param record: a sqla data object for insertion into a target table
@@ -101,28 +129,181 @@ def update_status(batch_id: int, proc_id: int, message: str):
      to each of 8 processors
     """
     with app.app_context():
-        db.session.query(Process). \
+        settled_count = db.session.query(Process). \
             filter(
                 Process.batch_id == batch_id, 
-                Process.proc_id == proc_id
+                Process.proc_id == proc_id,
+                Process.proc_status == "PENDING"
             ). \
             update(
                 {Process.proc_status: message}, 
                 synchronize_session=False
             )
-        db.session.commit()
-        batch_check_query = db.session.query(Process). \
-            filter(
-                Process.batch_id == batch_id, 
-                Process.proc_status == 'PENDING'
+        if settled_count > 0:
+            settle_batch(
+                batch_id,
+                done_count=int(message not in ("ERROR", "SKIPPED")),
+                skipped_count=int(message == "SKIPPED"),
+                error_count=int(message == "ERROR")
             )
-        if len(batch_check_query.all()) == 0:
-            db.session.query(Batch).filter(Batch.batch_id == batch_id).\
+        else:
+            db.session.query(Process). \
+                filter(
+                    Process.batch_id == batch_id, 
+                    Process.proc_id == proc_id
+                ). \
                 update(
-                    {Batch.batch_status: "COMPUTED"}, 
+                    {Process.proc_status: message}, 
                     synchronize_session=False
                 )
-            db.session.commit()
+        db.session.commit()
+
+
+def settle_batch(
+        batch_id: int,
+        done_count=0,
+        skipped_count=0,
+        error_count=0,
+        settled_count=None
+):
+    """
+    :param batch_id: the unique locator for the API request
+    :param done_count: the number of its processes just done
+    :param skipped_count: the number of its records just skipped
+    :param error_count: the number of its records just found in error
+    :param settled_count: the number of its processes which just left PENDING,
+     all of the above by default
+    Moves the Batch's counts in one atomic UPDATE, within the caller's
+     transaction, and marks the Batch COMPUTED as its pending_count reaches zero
+     unless records are still being submitted to it
+    """
+    if settled_count is None:
+        settled_count = done_count + skipped_count + error_count
+    pending_count = Batch.pending_count - settled_count
+    db.session.query(Batch). \
+        filter(Batch.batch_id == batch_id). \
+        update(
+            {
+                Batch.pending_count: pending_count,
+                Batch.done_count: Batch.done_count + done_count,
+                Batch.skipped_count: Batch.skipped_count + skipped_count,
+                Batch.error_count: Batch.error_count + error_count,
+                Batch.batch_status: case(
+                    (
+                        and_(pending_count <= 0, Batch.batch_status == "PENDING"),
+                        "COMPUTED"
+                    ),
+                    else_=Batch.batch_status
+                )
+            },
+            synchronize_session=False
+        )
+
+
+def check_batch_status(batch_id: int):
+    """
+    :param batch_id: the unique locator for the API request
+    Marks a PENDING Batch COMPUTED if none of its processes are PENDING; the
+     check reads the Batch's pending_count rather than its processes
+    """
+    with app.app_context():
+        db.session.query(Batch).\
+            filter(
+                Batch.batch_id == batch_id,
+                Batch.batch_status == "PENDING",
+                Batch.pending_count <= 0
+            ).\
+            update(
+                {Batch.batch_status: "COMPUTED"}, 
+                synchronize_session=False
+            )
+        db.session.commit()
+
+
+def batch_progress(batch_id: int):
+    """
+    :param batch_id: the unique locator for the API request
+    :return progress: the Batch's status and counts, its rate in rows settled per
+     second, and the seconds it is expected to take to finish; None if there is
+     no such Batch
+    Read from the Batch's running counts, so the process table is never scanned
+    """
+    with app.app_context():
+        batch = db.session.get(Batch, batch_id)
+        if batch is None:
+            return None
+        settled_count = batch.done_count + batch.skipped_count + batch.error_count
+        rows_per_sec = None
+        eta_seconds = None
+        if batch.batch_ts is not None:
+            elapsed = (datetime.now() - batch.batch_ts).total_seconds()
+            if elapsed > 0 and settled_count > 0:
+                rows_per_sec = round(settled_count / elapsed, 2)
+                eta_seconds = round(max(batch.pending_count, 0) / rows_per_sec, 1)
+        progress = {
+            "batch_id": batch.batch_id,
+            "batch_status": batch.batch_status,
+            "done_count": batch.done_count,
+            "error_count": batch.error_count,
+            "eta_seconds": eta_seconds,
+            "pending_count": batch.pending_count,
+            "rows_per_sec": rows_per_sec,
+            "settled_count": settled_count,
+            "skipped_count": batch.skipped_count,
+        }
+
+    return progress
+
+
+def parse_name_day(name_day_input):
+    """
+    :param name_day_input: a name day as a '%Y%m%d' string, date, or datetime
+    :return name_day_datetime: the name day as a datetime, or None
+    """
+    if type(name_day_input) is str:
+        name_day_format = '%Y%m%d'
+        name_day_datetime = datetime.\
+            strptime(name_day_input, name_day_format)
+    elif isinstance(name_day_input, datetime):
+        name_day_datetime = name_day_input
+    elif isinstance(name_day_input, date):  # e.g. read from a Parquet file
+        name_day_datetime = datetime.combine(name_day_input, datetime.min.time())
+    else:
+        name_day_datetime = None
+
+    return name_day_datetime
+
+
+def stage_demographic(record: dict, record_id: int, transaction_key: str) -> dict:
+    """
+    :param record: a json/dict-like demographic record as POSTed
+    :param record_id: the primary key minted for this record
+    :param transaction_key: the transaction key of the record's process
+    :return staged_record: the record's columns, ready for apply_record_metadata
+    """
+    staged_record = {
+        "record_id": record_id,
+        "address_1": record.get("address_1", None),
+        "address_2": record.get("address_2", None),
+        "city": record.get("city", None),
+        "family_name": record.get("family_name", None),
+        "gender": record.get("gender", None),
+        "given_name": record.get("given_name", None),
+        "middle_name": record.get("middle_name", None),
+        "name_day":  parse_name_day(record.get('name_day', None)),
+        "organization_key": record.get("organization_key", None),
+        "postal_code": record.get("postal_code", None),
+        "social_security_number": record.get(
+            "social_security_number", 
+            None
+        ),
+        "state": record.get("state", None),
+        "system_key": record.get("system_key", None),
+        "system_id": record.get("system_id", None),
+        "transaction_key": transaction_key
+    }
+
+    return staged_record
 
 
 def demographic(payload: dict, auditor) -> dict:
@@ -131,7 +312,11 @@ def demographic(payload: dict, auditor) -> dict:
     :param auditor: native Auditor class object for data warehousing
     :return metrics: the results of posting a list of demographic records
     This processor is accessed when a list of demographics is POSTed.
+    Set "bulk" in the payload to post the list in chunks with demographic_bulk,
+     or "initial_load" to post it in chunks without activating the records
     """
+    if payload.get("bulk") or payload.get("initial_load"):
+        return demographic_bulk(payload, auditor)
     metrics = {
         "affected_records": [],
         "bulletin_ids": [],
@@ -143,51 +328,30 @@ def demographic(payload: dict, auditor) -> dict:
         "skipped_count": 0,
         "telecoms_count": 0,
     }
-    row = 1
-    for record in payload.get('demographics'):
-        foreign_record_id = record.get("foreign_record_id")
-        transaction_key, proc_id, batch_id, user, _ = mint_transaction_key(
-            auditor,
-            row=row,
-            foreign_record_id=foreign_record_id
-        )
-        name_day_input = record.get('name_day', None)
-        if type(name_day_input) is str:
-            name_day_format = '%Y%m%d'
-            name_day_datetime = datetime.\
-                strptime(name_day_input, name_day_format)
-        elif type(name_day_input) is datetime:
-            name_day_datetime = name_day_input
-        else:
-            name_day_datetime = None
+    batch_id, user = auditor.batch_id, auditor.user
+    staged_rows = list()
+    for row, record in enumerate(payload.get('demographics'), start=1):
         try:
-            staged_record = {
-                "record_id": key_gen(user, version),
-                "address_1": record.get("address_1", None),
-                "address_2": record.get("address_2", None),
-                "city": record.get("city", None),
-                "family_name": record.get("family_name", None),
-                "gender": record.get("gender", None),
-                "given_name": record.get("given_name", None),
-                "middle_name": record.get("address_1", None),
-                "name_day":  name_day_datetime,
-                "organization_key": record.get("organization_key", None),
-                "postal_code": record.get("postal_code", None),
-                "social_security_number": record.get(
-                    "social_security_number", 
-                    None
-                ),
-                "state": record.get("state", None),
-                "system_key": record.get("system_key", None),
-                "system_id": record.get("system_id", None),
-                "transaction_key": transaction_key
-            }
-        except KeyError:
+            staged_record = stage_demographic(record, None, None)
+            staged_record, _ = apply_record_metadata(staged_record, user)
+        except (AttributeError, KeyError, ValueError):
+            staged_record = None
+        staged_rows.append((row, record, staged_record))
+    staged_rows = drop_duplicates(staged_rows, metrics, auditor)
+    stamps = mint_transaction_keys(
+        auditor,
+        [(row, record.get("foreign_record_id")) for row, record, _ in staged_rows]
+    )
+    for (row, record, staged_record), (proc_id, transaction_key) in \
+            zip(staged_rows, stamps):
+        if staged_record is None:
             metrics["error_count"] += 1
             metrics["error_rows"].append(row)
-            staged_record = None
-        if staged_record is not None:
-            record, _ = apply_record_metadata(staged_record, user)
+            update_status(batch_id, proc_id, "ERROR")
+        else:
+            staged_record["record_id"] = key_gen(user, version)
+            staged_record["transaction_key"] = transaction_key
+            record = staged_record
             metrics["record_count"] += 1
             record_id = None
             with app.app_context():
@@ -197,6 +361,9 @@ def demographic(payload: dict, auditor) -> dict:
                         demographics_record, 
                         "demographic"
                     )
+                    index_blocks([record], lsh=lsh_indexed())
+                    db.session.commit()
+                    DUPLICATE_FILTER.add([record["uq_hash"]])
                     metrics["proc_ids"].append(proc_id)
                     metrics["affected_records"].append(
                         (batch_id, proc_id, record_id, transaction_key)
@@ -205,6 +372,7 @@ def demographic(payload: dict, auditor) -> dict:
                 except IntegrityError:
                     db.session.rollback()
                     metrics["skipped_count"] += 1
+                    update_status(batch_id, proc_id, "SKIPPED")
                 except Exception as error_msg:
                     print(error_msg, file=DEBUG_ROUTE)
                 if record_id is not None:
@@ -220,7 +388,390 @@ def demographic(payload: dict, auditor) -> dict:
                     db.session.commit()
                     update_status(batch_id, proc_id, "POSTED")
                     activate_demographic({"record_id": record_id}, auditor)
+
+    return metrics
+
+
+def drop_duplicates(staged_rows: list, metrics: dict, auditor) -> list:
+    """
+    :param staged_rows: (row, record, staged_record) of each record in a POST
+    :param metrics: the running metrics of the POST
+    :param auditor: native Auditor class object for data warehousing
+    :return staged_rows: the same, less each record already stored
+    Known duplicates are stamped SKIPPED and counted as skipped here, before any
+     record ID is minted for them
+    """
+    duplicates = DUPLICATE_FILTER.duplicates([
+        staged_record["uq_hash"]
+        for _, _, staged_record in staged_rows if staged_record is not None
+    ])
+    kept_rows, dropped_rows = list(), list()
+    for row, record, staged_record in staged_rows:
+        if staged_record is not None and staged_record["uq_hash"] in duplicates:
+            metrics["record_count"] += 1
+            metrics["skipped_count"] += 1
+            dropped_rows.append((row, record.get("foreign_record_id")))
+        else:
+            kept_rows.append((row, record, staged_record))
+    if len(dropped_rows) > 0:
+        mint_transaction_keys(auditor, dropped_rows, "SKIPPED")
+        with app.app_context():
+            settle_batch(
+                auditor.batch_id,
+                skipped_count=len(dropped_rows),
+                settled_count=0
+            )
+            db.session.commit()
+
+    return kept_rows
+
+
+def stage_metadata(staged_rows: list, user: str) -> list:
+    """
+    :param staged_rows: (row, record, staged_record) of each record in a chunk
+    :param user: the username issuing the command
+    :return staged_rows: the same, with metadata applied to every staged record,
+    or staged_record None where it cannot be
+    The metadata of the chunk is applied at once, falling back to record by
+    record only to find the rows at fault.
+    """
+    staged_records = [
+        staged_record for _, _, staged_record in staged_rows
+        if staged_record is not None
+    ]
+    try:
+        apply_batch_metadata(staged_records, user)
+    except (AttributeError, KeyError, ValueError):
+        checked_rows = list()
+        for row, record, staged_record in staged_rows:
+            if staged_record is not None:
+                try:
+                    staged_record, _ = apply_record_metadata(staged_record, user)
+                except (AttributeError, KeyError, ValueError):
+                    staged_record = None
+            checked_rows.append((row, record, staged_record))
+        staged_rows = checked_rows
+
+    return staged_rows
+
+
+def post_demographic_chunk(records: list, auditor, metrics: dict, row=1) -> list:
+    """
+    :param records: a chunk of json/dict-like demographic records (None marks
+    a record which could not be parsed, and is counted as an error row)
+    :param auditor: native Auditor class object for data warehousing
+    :param metrics: the running metrics of the demographic_bulk call
+    :param row: the row number of the chunk's first record within the batch
+    :return posted: a list of (proc_id, record_id) for each inserted record
+    Known duplicates are dropped by the DUPLICATE_FILTER before IDs are minted.
+    The rest of the chunk is inserted with one multi-row INSERT, any duplicates
+    left on uq_hash are skipped by ON CONFLICT DO NOTHING, the blocking keys of
+    the inserted records are added, and the chunk's Process rows are updated
+    with one UPDATE ... FROM (VALUES ...), settling the Batch's pending_count in
+    the same commit.
+    """
+    batch_id, user = auditor.batch_id, auditor.user
+    staged_rows = list()
+    for record in records:
+        try:
+            staged_record = stage_demographic(record, None, None)
+        except (AttributeError, KeyError, ValueError):
+            staged_record = None
+        staged_rows.append((row, record, staged_record))
         row += 1
+    staged_rows = stage_metadata(staged_rows, user)
+    staged_rows = drop_duplicates(staged_rows, metrics, auditor)
+    stamps = mint_transaction_keys(
+        auditor,
+        [
+            (row, record.get("foreign_record_id") if record is not None else None)
+            for row, record, _ in staged_rows
+        ]
+    )
+    staged_records = list()
+    staged_procs = list()
+    for (row, record, staged_record), (proc_id, transaction_key) in \
+            zip(staged_rows, stamps):
+        if staged_record is None:
+            metrics["error_count"] += 1
+            metrics["error_rows"].append(row)
+            staged_procs.append((proc_id, None, transaction_key))
+        else:
+            staged_record["transaction_key"] = transaction_key
+            staged_records.append(staged_record)
+            staged_procs.append((proc_id, staged_record, transaction_key))
+            metrics["record_count"] += 1
+    record_ids = KEY_ALLOCATOR.take(user, version, len(staged_records))
+    for staged_record, record_id in zip(staged_records, record_ids):
+        staged_record["record_id"] = record_id
+    staged_procs = [
+        (proc_id, staged_record["record_id"], transaction_key)
+        if staged_record is not None else (proc_id, None, transaction_key)
+        for proc_id, staged_record, transaction_key in staged_procs
+    ]
+    inserted = dict()
+    with app.app_context():
+        if len(staged_records) > 0:
+            statement = insert(Demographic).\
+                values(staged_records).\
+                on_conflict_do_nothing(index_elements=["uq_hash"]).\
+                returning(Demographic.record_id, Demographic.uq_hash)
+            inserted = dict(db.session.execute(statement).all())
+            index_blocks(
+                (
+                    staged_record for staged_record in staged_records
+                    if staged_record["record_id"] in inserted
+                ),
+                lsh=lsh_indexed()
+            )
+        posted = list()
+        proc_updates = list()
+        for proc_id, record_id, transaction_key in staged_procs:
+            if record_id in inserted:
+                proc_updates.append((proc_id, record_id, "POSTED"))
+                posted.append((proc_id, record_id))
+                metrics["proc_ids"].append(proc_id)
+                metrics["affected_records"].append(
+                    (batch_id, proc_id, record_id, transaction_key)
+                )
+                metrics["pending_count"] += 1
+            elif record_id is not None:
+                proc_updates.append((proc_id, None, "SKIPPED"))
+                metrics["skipped_count"] += 1
+            else:
+                proc_updates.append((proc_id, None, "ERROR"))
+        if len(proc_updates) > 0:
+            staged_proc_values = values(
+                column("proc_id", db.BigInteger),
+                column("proc_record_id", db.BigInteger),
+                column("proc_status", db.Text),
+                name="staged_process"
+            ).data(proc_updates)
+            settled = db.session.execute(
+                update(Process).
+                where(
+                    Process.batch_id == batch_id,
+                    Process.proc_id == staged_proc_values.c.proc_id,
+                    Process.proc_status == "PENDING"
+                ).
+                values(
+                    proc_record_id=staged_proc_values.c.proc_record_id,
+                    proc_status=staged_proc_values.c.proc_status
+                )
+            )
+            statuses = [proc_status for _, _, proc_status in proc_updates]
+            settle_batch(
+                batch_id,
+                done_count=statuses.count("POSTED"),
+                skipped_count=statuses.count("SKIPPED"),
+                error_count=statuses.count("ERROR"),
+                settled_count=settled.rowcount
+            )
+        db.session.commit()
+        DUPLICATE_FILTER.add(inserted.values())
+
+    return posted
+
+
+def demographic_bulk(payload: dict, auditor) -> dict:
+    """
+    :param payload: a list of json/dict-like records to be computed
+    :param auditor: native Auditor class object for data warehousing
+    :return metrics: the results of posting a list of demographic records
+    This processor posts the demographics in chunks of BULK_CHUNK_SIZE, with
+    one INSERT, one Process UPDATE, and one commit per chunk, then activates
+    each posted record. With "initial_load" set in the payload the records are
+    left inactive for build_network to activate all at once.
+    """
+    initial_load = payload.get("initial_load", False)
+    metrics = {
+        "affected_records": [],
+        "bulletin_ids": [],
+        "error_count": 0,
+        "error_rows": [],
+        "proc_ids": [],
+        "pending_count": 0,
+        "record_count": 0,
+        "skipped_count": 0,
+        "telecoms_count": 0,
+    }
+    row = 1
+    for chunk in chunked(payload.get('demographics'), BULK_CHUNK_SIZE):
+        posted = post_demographic_chunk(chunk, auditor, metrics, row=row)
+        if not initial_load:
+            for _, record_id in posted:
+                activate_demographic({"record_id": record_id}, auditor)
+        row += len(chunk)
+
+    return metrics
+
+
+def start_streaming(batch_id: int):
+    """
+    :param batch_id: the unique locator for the API request
+    Marks the Batch STREAMING, so it is not COMPUTED between chunks
+    """
+    with app.app_context():
+        db.session.query(Batch).filter(Batch.batch_id == batch_id).\
+            update({Batch.batch_status: "STREAMING"}, synchronize_session=False)
+        db.session.commit()
+
+
+def stop_streaming(batch_id: int):
+    """
+    :param batch_id: the unique locator for the API request
+    Returns a STREAMING Batch to PENDING and checks whether it is COMPUTED
+    """
+    with app.app_context():
+        db.session.query(Batch).filter(Batch.batch_id == batch_id).\
+            update({Batch.batch_status: "PENDING"}, synchronize_session=False)
+        db.session.commit()
+    check_batch_status(batch_id)
+
+
+def demographic_stream(records, auditor, initial_load=False) -> dict:
+    """
+    :param records: an iterator of json/dict-like records, e.g. from iter_ndjson
+    :param auditor: native Auditor class object for data warehousing
+    :param initial_load: leave the records inactive for build_network
+    :return metrics: the counts of records posted, skipped, and in error
+    This processor is accessed when demographics are streamed as NDJSON. The
+    records are consumed STREAM_CHUNK_SIZE at a time, so memory stays bounded,
+    and each chunk is posted, committed, and activated before the next is read.
+    The Batch reads STREAMING until the stream ends; progress so far is in its
+    Process rows.
+    """
+    metrics = {
+        "affected_records": [],
+        "bulletin_ids": [],
+        "error_count": 0,
+        "error_rows": [],
+        "proc_ids": [],
+        "pending_count": 0,
+        "record_count": 0,
+        "skipped_count": 0,
+        "telecoms_count": 0,
+    }
+    batch_id = auditor.batch_id
+    start_streaming(batch_id)
+    row = 1
+    try:
+        for chunk in chunked(records, STREAM_CHUNK_SIZE):
+            posted = post_demographic_chunk(chunk, auditor, metrics, row=row)
+            if not initial_load:
+                for _, record_id in posted:
+                    activate_demographic({"record_id": record_id}, auditor)
+            row += len(chunk)
+            # only the counts are kept across chunks
+            metrics["affected_records"] = []
+            metrics["proc_ids"] = []
+            print(
+                f"batch {batch_id}: {row - 1} rows streamed",
+                file=DEBUG_ROUTE
+            )
+    finally:  # a broken stream leaves the chunks already committed
+        stop_streaming(batch_id)
+    del metrics["affected_records"], metrics["proc_ids"]
+
+    return metrics
+
+
+def build_network(payload: dict, auditor) -> dict:
+    """
+    :param payload: a dict with the batch_id of an initial_load demographic POST
+    :param auditor: native Auditor class object for data warehousing
+    :return metrics: the counts of pairs, matches, groups, and activations
+    This processor is accessed to activate an initially loaded batch at once.
+    Candidate pairs come from one self-join, are scored in bulk, and are written
+    to the network in one pass instead of one GraphCursor per record, under an
+    exclusive GraphLock.
+    """
+    with app.app_context(), GraphLock(exclusive=True):
+        transaction_key, proc_id, batch_id, user, touched_ts = \
+            mint_transaction_key(auditor)
+        load_batch_id = payload["batch_id"]
+        loaded_record_ids = select(Process.proc_record_id).\
+            where(
+                Process.batch_id == load_batch_id,
+                Process.proc_status == "POSTED",
+                Process.proc_record_id.is_not(None)
+            )
+        pairs = candidate_pairs(loaded_record_ids)
+        computed_matches, exec_time = compute_pair_matches(pairs)
+        nodes_and_weights = [
+            (record_id_a, record_id_b, computed_match["score"])
+            for (record_id_a, record_id_b), computed_match
+            in zip(pairs, computed_matches)
+        ]
+        metrics = build_enterprise_network(nodes_and_weights, batch_id, proc_id)
+        record_ids = db.session.execute(loaded_record_ids).scalars().all()
+        resize_blocks(loaded_record_ids, True)
+        db.session.query(Demographic).\
+            filter(Demographic.record_id.in_(loaded_record_ids)).\
+            update(
+            {
+                Demographic.is_active: True,
+                Demographic.touched_by: user,
+                Demographic.touched_ts: touched_ts
+            },
+            synchronize_session=False
+        )
+        for chunk in chunked(record_ids, BULK_CHUNK_SIZE):
+            etl_ids = KEY_ALLOCATOR.take(user, version, len(chunk))
+            staged_demo_activate_records = [
+                {
+                    "etl_id": etl_id,
+                    "record_id": record_id,
+                    "transaction_key": transaction_key,
+                }
+                for etl_id, record_id in zip(etl_ids, chunk)
+            ]
+            db.session.execute(
+                insert(DemographicActivation).values(staged_demo_activate_records)
+            )
+        db.session.query(Process). \
+            filter(
+                Process.batch_id == load_batch_id, 
+                Process.proc_status == "POSTED"
+            ). \
+            update(
+                {Process.proc_status: "ACTIVATED"}, 
+                synchronize_session=False
+            )
+        db.session.commit()
+        BLOCK_INDEX.publish(record_ids, True)
+        update_status(batch_id, proc_id, "NETWORK BUILT")
+    metrics["pair_count"] = len(pairs)
+    metrics["activated_count"] = len(record_ids)
+    metrics["exec_time"] = exec_time
+
+    return metrics
+
+
+def rematch_network(payload: dict, auditor) -> dict:
+    """
+    :param payload: a dict with an optional window, NEIGHBORHOOD_WINDOW by default
+    :param auditor: native Auditor class object for data warehousing
+    :return metrics: the counts of pairs, matches, and groups
+    This processor is accessed for a periodic full re-match of every active
+    record. Candidate pairs come from one sorted-neighborhood pass per key, are
+    scored in bulk, and any new matches are joined to the network in one pass,
+    under an exclusive GraphLock.
+    """
+    with app.app_context(), GraphLock(exclusive=True):
+        _, proc_id, batch_id, _, _ = mint_transaction_key(auditor)
+        pairs = neighborhood_pairs(window=payload.get("window") or NEIGHBORHOOD_WINDOW)
+        computed_matches, exec_time = compute_pair_matches(pairs)
+        nodes_and_weights = [
+            (record_id_a, record_id_b, computed_match["score"])
+            for (record_id_a, record_id_b), computed_match
+            in zip(pairs, computed_matches)
+        ]
+        metrics = build_enterprise_network(nodes_and_weights, batch_id, proc_id)
+        db.session.commit()
+        update_status(batch_id, proc_id, "NETWORK BUILT")
+    metrics["pair_count"] = len(pairs)
+    metrics["exec_time"] = exec_time
 
     return metrics
 
@@ -232,10 +783,12 @@ def activate_demographic(payload: dict, auditor) -> int:
     :return graph.enterprise_id: the graph ID for the activated record
     This processor is accessed when a demographic is Activated
     """
-    with app.app_context():
+    with app.app_context(), GraphLock() as graph_lock:
         transaction_key, proc_id, batch_id, user, touched_ts = \
             mint_transaction_key(auditor)
         record_id = payload.get("record_id")
+        graph_lock.lock_blocking([record_id])
+        resize_blocks([record_id], True)
         db.session.query(Demographic).\
             filter(Demographic.record_id == record_id).\
             update(
@@ -256,6 +809,7 @@ def activate_demographic(payload: dict, auditor) -> int:
                 synchronize_session=False
             )
         db.session.commit()
+        BLOCK_INDEX.publish([record_id], True)
         db.session.query(EnterpriseMatch).\
             filter(EnterpriseMatch.is_valid is False,
                    or_(
@@ -274,7 +828,9 @@ def activate_demographic(payload: dict, auditor) -> int:
         db.session.commit()
         record = db.session.query(Demographic).\
             filter(Demographic.record_id == record_id).first()
-        computed_matches, _ = compute_all_matches(record)
+        coarse_report = dict()
+        computed_matches, _ = compute_all_matches(record, report=coarse_report)
+        print(f"activating {record_id}: {coarse_report}", file=DEBUG_ROUTE)
         nodes_and_weights = list()
         for computed_match in computed_matches:
             tup = (
@@ -283,6 +839,10 @@ def activate_demographic(payload: dict, auditor) -> int:
                 computed_match['score']
             )
             nodes_and_weights.append(tup)
+        graph_lock.lock_components(
+            lambda: [record_id] + [a for a, _, _ in nodes_and_weights] +
+            [b for _, b, _ in nodes_and_weights]
+        )
         graph = GraphCursor(nodes_and_weights, batch_id, proc_id)
         graph()
         update_status(batch_id, proc_id, "ACTIVATED")
@@ -290,6 +850,8 @@ def activate_demographic(payload: dict, auditor) -> int:
             "etl_id": key_gen(user, version),
             "record_id": record_id,
             "transaction_key": transaction_key,
+            "candidate_count": coarse_report.get("candidate_count"),
+            "pruned_count": coarse_report.get("pruned_count"),
         }
         demo_act_record = DemographicActivation(**staged_demo_activate_record)  # type: ignore
         transact_records(demo_act_record, "activations")
@@ -341,15 +903,19 @@ def deactivate_demographic(payload: dict, auditor) -> int:
     This processor is accessed when a demographic is Deactivated
     """
     
-    with app.app_context():
+    with app.app_context(), GraphLock() as graph_lock:
         transaction_key, proc_id, batch_id, user, touched_ts = \
             mint_transaction_key(auditor)
         record_id = payload.get("record_id")
+        graph_lock.lock_components(
+            lambda: [record_id] + list(GraphReCursor(record_id).matched_records)
+        )
         recursor = GraphReCursor(record_id)
         print(
             f'deac nodes and weights 1 {recursor.nodes_and_weights}', 
             file=DEBUG_ROUTE
         )
+        resize_blocks([record_id], False)
         db.session.query(Demographic).\
             filter(Demographic.record_id == record_id).\
             update(
@@ -361,6 +927,7 @@ def deactivate_demographic(payload: dict, auditor) -> int:
             synchronize_session=False
         )
         db.session.commit()
+        BLOCK_INDEX.publish([record_id], False)
         db.session.query(EnterpriseMatch). \
             filter(
             or_(
@@ -433,6 +1000,7 @@ def delete_demographic(payload: dict, auditor) -> int:
         deactivate_demographic({"record_id": record_id}, auditor)
         archive_demographic(record_id, auditor)
         Demographic.query.filter_by(record_id=record_id).delete()
+        drop_blocks([record_id])
         db.session.commit()
         db.session.query(Process). \
             filter(
@@ -551,6 +1119,19 @@ def delete_action(payload: dict, auditor) -> int:
     return transact_records(delete_action_record, "delete")
 
 
+def matched_pair_records(record_id_low: int, record_id_high: int) -> list:
+    """
+    :param record_id_low: the lower record ID of a match
+    :param record_id_high: the higher record ID of a match
+    :return record_ids: both records, and each record matched with either
+    """
+    record_ids = [record_id_low, record_id_high]
+    for record_id in (record_id_low, record_id_high):
+        record_ids.extend(GraphReCursor(record_id).matched_records)
+
+    return record_ids
+
+
 def affirm_matching(payload: dict, auditor) -> int:
     """
     :param payload: a dict representing a json/dict-like record to be computed
@@ -558,11 +1139,14 @@ def affirm_matching(payload: dict, auditor) -> int:
     :return transact_records(): this transacts and surfaces a new record locator
     This processor is accessed when a Match is Affirmed
     """
-    with app.app_context():
+    with app.app_context(), GraphLock() as graph_lock:
         transaction_key, proc_id, batch_id, user, touched_ts = \
             mint_transaction_key(auditor)
         record_id_low = payload.get("record_id_low")
         record_id_high = payload.get("record_id_high")
+        graph_lock.lock_components(
+            lambda: matched_pair_records(record_id_low, record_id_high)
+        )
         record = db.session.query(EnterpriseMatch). \
             filter(
             EnterpriseMatch.record_id_low == record_id_low,
@@ -634,11 +1218,14 @@ def deny_matching(payload: dict, auditor) -> int:
     :return transact_records(): this transacts and surfaces a new record locator
     This processor is accessed when a Match is Denied
     """
-    with app.app_context():
+    with app.app_context(), GraphLock() as graph_lock:
         transaction_key, proc_id, batch_id, user, touched_ts = \
             mint_transaction_key(auditor)
         record_id_low = payload.get("record_id_low")
         record_id_high = payload.get("record_id_high")
+        graph_lock.lock_components(
+            lambda: matched_pair_records(record_id_low, record_id_high)
+        )
         record = db.session.query(EnterpriseMatch). \
             filter(
             EnterpriseMatch.record_id_low == record_id_low,
@@ -712,6 +1299,7 @@ def deny_matching(payload: dict, auditor) -> int:
 
 # processor-dependencies are shipped with this map
 PROCESSOR_MAP = {
+    "build_network": build_network,
     "delete_action": delete_action,
     "demographic": demographic,
     "activate_demographic": activate_demographic,
@@ -719,6 +1307,7 @@ PROCESSOR_MAP = {
     "delete_demographic": delete_demographic,
     "match_affirm": affirm_matching,
     "match_deny": deny_matching,
-    "query_records": query_records
+    "query_records": query_records,
+    "rematch_network": rematch_network
 }
 
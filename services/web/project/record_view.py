@@ -0,0 +1,78 @@
+from .data_utils import field
+from .features import FEATURE_COLUMNS
+from .model import Demographic
+
+# the fields of a record which the matchers read, and their stored features
+MATCH_FIELDS = (
+    "record_id",
+    "given_name",
+    "middle_name",
+    "family_name",
+    "name_day",
+    "address_1",
+    "address_2",
+    "postal_code",
+    "social_security_number",
+) + FEATURE_COLUMNS
+MATCH_COLUMNS = tuple(getattr(Demographic, name) for name in MATCH_FIELDS)
+
+
+class RecordView:
+    """
+    The RecordView holds only the MATCH_FIELDS of a demographic record, in
+    slots, with none of an ORM instance's session state. The matchers read it
+    with attributes or with .get(), as they would a dict. Build it from a row
+    of MATCH_COLUMNS, in order, or with from_record.
+    """
+    __slots__ = MATCH_FIELDS
+
+    def __init__(self, record_id, given_name, middle_name, family_name, name_day,
+                 address_1, address_2, postal_code, social_security_number,
+                 given_name_alpha, given_name_metaphone, given_name_soundex,
+                 given_name_nysiis, middle_name_metaphone, family_name_alpha,
+                 family_name_junior, family_name_senior, family_name_metaphone,
+                 family_name_soundex, family_name_nysiis, address_1_metaphone,
+                 address_2_metaphone, postal_code_metaphone):
+        self.record_id = record_id
+        self.given_name = given_name
+        self.middle_name = middle_name
+        self.family_name = family_name
+        self.name_day = name_day
+        self.address_1 = address_1
+        self.address_2 = address_2
+        self.postal_code = postal_code
+        self.social_security_number = social_security_number
+        self.given_name_alpha = given_name_alpha
+        self.given_name_metaphone = given_name_metaphone
+        self.given_name_soundex = given_name_soundex
+        self.given_name_nysiis = given_name_nysiis
+        self.middle_name_metaphone = middle_name_metaphone
+        self.family_name_alpha = family_name_alpha
+        self.family_name_junior = family_name_junior
+        self.family_name_senior = family_name_senior
+        self.family_name_metaphone = family_name_metaphone
+        self.family_name_soundex = family_name_soundex
+        self.family_name_nysiis = family_name_nysiis
+        self.address_1_metaphone = address_1_metaphone
+        self.address_2_metaphone = address_2_metaphone
+        self.postal_code_metaphone = postal_code_metaphone
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        :param record: a demographic record, as a dict, a row, or a RecordView
+        :return view: its RecordView
+        """
+        if isinstance(record, cls):
+            return record
+
+        return cls(*[field(record, name) for name in MATCH_FIELDS])
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in MATCH_FIELDS)
+
+    def __repr__(self):
+        return f"<RecordView {self.record_id}>"
@@ -1,9 +1,26 @@
 from datetime import datetime
 import operator
+from time import monotonic
+
+from sqlalchemy import select
 
 from .app import app
+from .matching import METRIC_NAMES, RECORD_METRICS
 from .model import Battery, db, key_gen, Test
-from .processor import transact_records
+
+BATTERY_TTL = 60  # seconds before the active battery is read again
+SCORE_THRESHOLD = 0.5  # the score at and above which a pair is a match
+SCORE_TOLERANCE = 1e-9  # a cascade decides no closer to the threshold, for float sums
+METRIC_COSTS = {  # the relative cost of each string metric; a cascade runs cheap tests first
+	'equal': 1,
+	'metaphone': 2,
+	'hamming_distance': 3,
+	'jaro_winkler': 4,
+	'ratio': 4,
+	'levenshtein_distance': 5,
+	'damerau_levenshtein_distance': 6,
+}
+BATTERY_CACHE = dict()
 
 ops = {  # ToDo: greater operations support or just these 6?
 	'lt': operator.lt,  # less than <
@@ -34,8 +51,11 @@ def create_test(packet: dict) -> int:
 	}
 	with app.app_context():
 		record = Test(**staged_test_record)  # type: ignore
+		db.session.add(record)
+		db.session.commit()
+		test_id = record.test_id
 
-	return transact_records(record, "test")
+	return test_id
 
 
 def delete_test(test_id: int):
@@ -70,7 +90,8 @@ def create_battery(packet: dict) -> int:
 				"touched_ts": battery_ts
 			}
 			record = Battery(**staged_battery_record)  # type: ignore
-			transact_records(record, "battery")
+			db.session.add(record)
+		db.session.commit()
 
 	return battery_id
 
@@ -101,32 +122,96 @@ def assemble_tests(battery_id: int) -> list:
 	return test_ids
 
 
-def make_battery(test_ids: list, metric: dict) -> list:
+def load_tests(test_ids: list) -> list:
 	"""
-	Given a set of tests (by ID), collate them into a battery of such tests
+	This function reads the tests of a battery, ready to evaluate
 	:param test_ids: a list of primary keys for score tests
-	:param metric: the results of pairwise analysis of two records
+	:return tests: a (metric name, threshold, operator, weight) tuple per test,
+	with its threshold cast away from string and its operator callable
 	"""
-	battery = list()
+	tests = list()
 	with app.app_context():
-		for test_id in test_ids:
-			result = Test.query.filter_by(test_id=test_id).first()
+		query = select(Test).where(Test.test_id.in_(list(test_ids)))
+		for result in db.session.execute(query).scalars():
+			if result.metric not in METRIC_NAMES:
+				raise KeyError(f"test {result.test_id} has no metric {result.metric}")
 			# threshold is either bool or numeric, cast away from string
-			metric_name = result['metric']
-			metric_val = metric[metric_name]
-			threshold = result['threshold']
+			threshold = result.threshold
 			if threshold == 'True':
 				treated_threshold = True
 			elif threshold == 'False':
 				treated_threshold = False
 			else:
 				treated_threshold = float(threshold)
-			op = result['operator']
-			weight = result['weight']
-			result_tup = (metric_val, treated_threshold, op, weight)
-			battery.append(result_tup)
+			tests.append((result.metric, treated_threshold, ops[result.operator], result.weight))
+
+	return tests
+
+
+def battery_metrics(tests: list) -> set:
+	"""
+	:param tests: the output of load_tests
+	:return metric_names: the only metrics the battery needs computed
+	"""
+	return {metric_name for metric_name, _, _, _ in tests}
+
+
+def evaluate_tests(tests: list, metric) -> list:
+	"""
+	:param tests: the output of load_tests
+	:param metric: the results of pairwise analysis of two records, by metric
+	name; given a LazyMetrics, only the metrics the tests name are computed
+	:return battery: a (metric value, threshold, operator, weight) tuple per test
+	"""
+	return [
+		(metric[metric_name], threshold, op, weight)
+		for metric_name, threshold, op, weight in tests
+	]
+
 
-	return battery
+def make_battery(test_ids: list, metric) -> list:
+	"""
+	Given a set of tests (by ID), collate them into a battery of such tests
+	:param test_ids: a list of primary keys for score tests
+	:param metric: the results of pairwise analysis of two records
+	"""
+	return evaluate_tests(load_tests(test_ids), metric)
+
+
+def metric_cost(metric_name: str) -> int:
+	"""
+	:param metric_name: one of METRIC_NAMES
+	:return cost: 0 for the exact SSN and name_day tests, else METRIC_COSTS
+	"""
+	if metric_name in RECORD_METRICS:
+		return 0
+
+	return METRIC_COSTS[metric_name.split('.')[1]]
+
+
+def order_tests(tests: list) -> list:
+	"""
+	:param tests: the output of load_tests
+	:return tests: the tests cheapest first, and the heaviest first at equal
+	cost, as they decide a score soonest
+	"""
+	return sorted(tests, key=lambda test: (metric_cost(test[0]), -abs(test[3])))
+
+
+def active_tests() -> list:
+	"""
+	:return tests: the load_tests of the SCORE_BATTERY, in order_tests order,
+	read once per BATTERY_TTL in each process; none if no battery is configured
+	"""
+	battery_id = app.config["SCORE_BATTERY"]
+	if battery_id is None:
+		return list()
+	cached = BATTERY_CACHE.get(battery_id)
+	if cached is None or monotonic() - cached[0] > BATTERY_TTL:
+		cached = (monotonic(), order_tests(load_tests(assemble_tests(battery_id))))
+		BATTERY_CACHE[battery_id] = cached
+
+	return cached[1]
 
 
 def run_test(x, y, op):
@@ -140,7 +225,7 @@ def run_test(x, y, op):
 	return op(x, y)
 
 
-def run_threshold(score: float, threshold=0.5) -> bool:
+def run_threshold(score: float, threshold=SCORE_THRESHOLD) -> bool:
 	"""
 	This function compares a match score to the threshold only
 	:param score: the weighted result of pairwise metric evaluation
@@ -164,6 +249,37 @@ def run_battery(battery: list) -> tuple:
 	return score, run_threshold(score)
 
 
+def run_cascade(tests: list, metric, threshold=SCORE_THRESHOLD) -> tuple:
+	"""
+	This function runs a battery of tests in order, only until its outcome is decided
+	:param tests: the output of load_tests, best given in order_tests order
+	:param metric: the results of pairwise analysis of two records, by metric
+	name; given a LazyMetrics, the metrics of skipped tests are never computed
+	:param threshold: the value above which a score represents a match
+	:return score, match, skipped_count: the score of the tests run, whether
+	the pair matches, and the number of tests skipped
+	Each test left moves the score by at most its weight either way, so once the
+	worst reachable score is a match, or the best is not, the rest are skipped.
+	The outcome is always run_battery's; the score is on the same side of the
+	threshold as run_battery's, but not always equal to it.
+	"""
+	remaining = [0.0] * (len(tests) + 1)  # the weight of all tests from each on
+	for index in range(len(tests) - 1, -1, -1):
+		remaining[index] = remaining[index + 1] + abs(tests[index][3])
+	score = 0
+	for index, (metric_name, y, op, weight) in enumerate(tests):
+		if score - remaining[index] >= threshold + SCORE_TOLERANCE:
+			return score, True, len(tests) - index
+		if score + remaining[index] < threshold - SCORE_TOLERANCE:
+			return score, False, len(tests) - index
+		if run_test(metric[metric_name], y, op):
+			score += weight
+		else:
+			score -= weight
+
+	return score, run_threshold(score, threshold), 0
+
+
 def score_weighting(battery_id: int, metric: dict) -> tuple:
 	"""
 	This function wraps the entire score-weighting process.
@@ -32,6 +32,30 @@ class DemographicsGetValidator(PayloadValidator):
 
 class DemographicsPostValidator(PayloadValidator):
     demographics = datatypes.Array(required=True)
+    bulk = datatypes.Boolean(required=False)
+    initial_load = datatypes.Boolean(required=False)
+    touched_by = datatypes.String(required=True)
+
+
+class DemographicsStreamValidator(PayloadValidator):
+    user = datatypes.String(required=True)
+
+
+def is_digits(val, *args, **kwargs) -> bool:
+    # a missing value is left to the required check
+    return val is None or str(val).isdigit()
+
+
+class BatchProgressValidator(PayloadValidator):
+    # query string parameters arrive as text
+    user = datatypes.String(required=True)
+    batch_id = datatypes.Function(is_digits, required=True)
+    since = datatypes.Function(is_digits, required=False)
+    wait = datatypes.Function(is_digits, required=False)
+
+
+class NetworkBuildValidator(PayloadValidator):
+    batch_id = datatypes.Integer(required=True)
     touched_by = datatypes.String(required=True)
 
 
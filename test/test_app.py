@@ -1,7 +1,11 @@
 import json
 
 from services.web.project.app import app
-from services.web.project import timeit
+from services.web import project
+from services.web.project import timeit, version
+from services.web.project.auditor import Auditor
+from services.web.project.model import db
+from services.web.project.processor import update_status
 
 
 @timeit
@@ -10,3 +14,60 @@ def test_index_route(client):
     assert json.loads(response.data.decode()) == {'hello': 'world'}
     assert app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] is False
     assert response.status_code == 200
+
+
+@timeit
+def test_stream_route_requires_user(client):
+    response = client.post(
+        f"/api_{version}/demographic_stream",
+        data=b'{"given_name": "WALTER"}\n'
+    )
+    assert json.loads(response.data.decode())["status"] == 405
+
+
+@timeit
+def test_progress_route(client):
+    with app.app_context():
+        db.create_all()
+        with Auditor("test_progress_route", version, "demographic") as auditor:
+            proc_ids = [auditor.stamp(row, None) for row in range(1, 4)]
+        update_status(auditor.batch_id, proc_ids[0], "POSTED")
+        update_status(auditor.batch_id, proc_ids[1], "SKIPPED")
+    route = f"/api_{version}/batch_progress?user=test&batch_id={auditor.batch_id}"
+    progress = json.loads(client.get(route).data.decode())["response"]
+    assert progress["batch_status"] not in project.PROGRESS_FINAL
+    assert progress["pending_count"] == 1
+    assert progress["done_count"] == 1
+    assert progress["skipped_count"] == 1
+    assert progress["error_count"] == 0
+    assert progress["eta_seconds"] is not None
+    # a long-poll returns at once when the batch has moved past since
+    progress = json.loads(client.get(f"{route}&since=1&wait=5").data.decode())
+    assert progress["response"]["settled_count"] == 2
+    update_status(auditor.batch_id, proc_ids[2], "ERROR")
+    response = client.get(route, headers={"Accept": "text/event-stream"})
+    assert response.mimetype == "text/event-stream"
+    events = response.data.decode().strip().split("\n\n")
+    assert len(events) == 1
+    progress = json.loads(events[0][len("data: "):])
+    assert progress["batch_status"] == "COMPUTED"
+    assert progress["error_count"] == 1
+
+
+@timeit
+def test_progress_events_deadline(monkeypatch):
+    with app.app_context():
+        db.create_all()
+        with Auditor("test_progress_events_deadline", version, "demographic") as auditor:
+            auditor.stamp(1, None)
+    monkeypatch.setattr(project, "PROGRESS_STREAM", 0)
+    monkeypatch.setattr(project, "PROGRESS_INTERVAL", 0)
+    events = list(project.progress_events(auditor.batch_id))
+    assert json.loads(events[0][len("data: "):])["batch_status"] == "PENDING"
+    assert events[-1] == "event: timeout\ndata: null\n\n"
+
+
+@timeit
+def test_progress_route_requires_batch_id(client):
+    response = client.get(f"/api_{version}/batch_progress?user=test&batch_id=abc")
+    assert json.loads(response.data.decode())["status"] == 405
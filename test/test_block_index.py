@@ -0,0 +1,55 @@
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.block_index import BlockIndex
+from services.web.project.blocking import blocking_keys, drop_blocks, index_blocks, resize_blocks
+from services.web.project.data_utils import demographics_record
+from services.web.project.model import db, Demographic
+
+
+@timeit
+def test_block_index_apply():
+    block_index = BlockIndex(True)
+    assert block_index.candidates(["family_year:S5301980"], 8675700) is None
+    block_index.ready = True
+    block_index.apply({8675700: ["a", "b"], 8675701: ["b"]}, True)
+    block_index.apply({8675701: ["b"]}, True)
+    assert block_index.candidates(["a", "b", "c"], 8675700) == {8675701}
+    assert list(block_index.blocks["b"]) == [8675700, 8675701]
+    block_index.apply({8675701: ["b"]}, False)
+    assert block_index.candidates(["b"], 8675700) == set()
+    block_index.apply({8675700: ["a", "b"]}, False)
+    assert block_index.blocks == {}
+    block_index.apply({8675700: ["a"]}, True)
+    block_index.reset()
+    assert block_index.candidates(["a"], 8675701) is None
+
+
+@timeit
+def test_block_index_load():
+    with app.app_context():
+        db.create_all()
+        key = "test_block_index_load"
+        records = [demographics_record(f"{key}_{i}") for i in range(3)]
+        for i, record in enumerate(records):
+            record["given_name"] = records[0]["given_name"]
+            record["postal_code"] = records[0]["postal_code"]
+            record["record_id"] = 8675700 + i
+            record["is_active"] = i < 2
+            db.session.add(Demographic(**record))
+        index_blocks(records)
+        db.session.commit()
+        block_keys = blocking_keys(records[0])
+        block_index = BlockIndex(True)
+        block_index.load()
+        assert block_index.candidates(block_keys, 8675700) == {8675701}
+        resize_blocks([8675702], True)
+        Demographic.query.filter(Demographic.record_id == 8675702).\
+            update({Demographic.is_active: True})
+        db.session.commit()
+        block_index.publish([8675702], True)
+        assert block_index.candidates(block_keys, 8675700) == {8675701, 8675702}
+        block_index.publish([8675701], False)
+        assert block_index.candidates(block_keys, 8675700) == {8675702}
+        drop_blocks([8675700, 8675701, 8675702])
+        Demographic.query.filter(Demographic.record_id >= 8675700).delete()
+        db.session.commit()
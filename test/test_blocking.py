@@ -0,0 +1,181 @@
+import datetime
+
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.blocking import (
+    block_candidates,
+    block_sizes,
+    blocked_pairs,
+    blocking_keys,
+    drop_blocks,
+    index_blocks,
+    prune_blocks,
+    resize_blocks,
+)
+from services.web.project import blocking
+from services.web.project.data_utils import demographics_record
+from services.web.project.model import db, Blocking, Demographic
+
+
+@timeit
+def test_blocking_keys():
+    record = {
+        "record_id": 8675600,
+        "given_name": "Jonathan",
+        "family_name": "Smith",
+        "gender": "m",
+        "name_day": datetime.datetime(1980, 4, 2),
+        "postal_code": "02139",
+        "social_security_number": "123-45-6789",
+    }
+    assert blocking_keys(record) == [
+        "family_year:S5301980",
+        "family_year:S5301980/J",
+        "given_postal:JON021",
+        "given_postal:JON021/1980",
+        "ssn_month:678904",
+        "ssn_month:678904/1980",
+        "name_day_gender:19800402M",
+        "name_day_gender:19800402M/021",
+    ]
+    record["name_day"] = None
+    assert blocking_keys(record) == ["given_postal:JON021"]
+
+
+@timeit
+def test_block_candidates():
+    with app.app_context():
+        db.create_all()
+        key = "test_block_candidates"
+        records = [demographics_record(f"{key}_{i}") for i in range(4)]
+        records[1]["given_name"] = records[0]["given_name"]
+        records[1]["postal_code"] = records[0]["postal_code"]
+        records[2]["family_name"] = records[0]["family_name"]
+        records[2]["name_day"] = records[0]["name_day"]
+        records[3]["given_name"] = records[0]["given_name"]
+        records[3]["postal_code"] = records[0]["postal_code"]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675600 + i
+            record["is_active"] = i < 3
+            db.session.add(Demographic(**record))
+        index_blocks(records)
+        db.session.commit()
+        candidates = block_candidates(db.session.get(Demographic, 8675600))
+        assert sorted(row.record_id for row in candidates) == [8675601, 8675602]
+        drop_blocks([8675601, 8675602, 8675603])
+        db.session.commit()
+        assert block_candidates(db.session.get(Demographic, 8675600)) == []
+        drop_blocks([8675600])
+        Demographic.query.filter(Demographic.record_id >= 8675600).delete()
+        db.session.commit()
+        assert Blocking.query.filter(Blocking.record_id >= 8675600).count() == 0
+
+
+@timeit
+def test_prune_blocks():
+    with app.app_context():
+        db.create_all()
+        key = "test_prune_blocks"
+        records = [demographics_record(f"{key}_{i}") for i in range(4)]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675610 + i
+            record["postal_code"] = records[0]["postal_code"]
+            record["given_name"] = records[0]["given_name"]
+            record["name_day"] = records[0]["name_day"]
+            record["gender"] = records[0]["gender"]
+            record["social_security_number"] = f"123-45-{6780 + i}"
+            record["is_active"] = True
+        records[1]["postal_code"] = records[0]["postal_code"][:3] + "0"
+        for record in records:
+            db.session.add(Demographic(**record))
+        index_blocks(records)
+        db.session.commit()
+        size_limit = blocking.BLOCK_SIZE_LIMIT
+        blocking.BLOCK_SIZE_LIMIT = 2
+        try:
+            report = {"block_count": 0, "split_count": 0, "skipped_count": 0, "pruned_count": 0}
+            block_keys = prune_blocks(records[0], report)
+        finally:
+            blocking.BLOCK_SIZE_LIMIT = size_limit
+        # every generated family name has the same Soundex, so only the
+        # ssn_month blocks are small enough to keep
+        assert block_keys == [f"ssn_month:6780{records[0]['name_day'].month:02d}"]
+        assert report["skipped_count"] == 3
+        assert report["pruned_count"] == 12
+        assert report["block_count"] == len(block_keys)
+        drop_blocks([record["record_id"] for record in records])
+        Demographic.query.filter(Demographic.record_id >= 8675610).delete()
+        db.session.commit()
+
+
+@timeit
+def test_block_sizes():
+    with app.app_context():
+        db.create_all()
+        key = "test_block_sizes"
+        records = [demographics_record(f"{key}_{i}") for i in range(3)]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675630 + i
+            record["given_name"] = "WALTER"
+            record["postal_code"] = "87111"
+            record["is_active"] = i == 0
+            db.session.add(Demographic(**record))
+        index_blocks(records)
+        db.session.commit()
+        block_key = "given_postal:WAL871"
+        sizes = [block_sizes([block_key])]
+        for record_ids, is_active in (([8675631, 8675632], True), ([8675631], True), ([8675630], False)):
+            resize_blocks(record_ids, is_active)
+            Demographic.query.filter(Demographic.record_id.in_(record_ids)).\
+                update({Demographic.is_active: is_active})
+            db.session.commit()
+            sizes.append(block_sizes([block_key]))
+        drop_blocks([8675630, 8675631, 8675632])
+        db.session.commit()
+        sizes.append(block_sizes([block_key]))
+        Demographic.query.filter(Demographic.record_id >= 8675630).delete()
+        db.session.commit()
+    # an activation of an active record, or a deactivation of an inactive one, is not counted twice
+    assert sizes == [{block_key: 1}, {block_key: 3}, {block_key: 3}, {block_key: 2}, {}]
+
+
+@timeit
+def test_blocked_pairs():
+    with app.app_context():
+        db.create_all()
+        key = "test_blocked_pairs"
+        records = [demographics_record(f"{key}_{i}") for i in range(4)]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675620 + i
+            record["is_active"] = i in (1, 2)
+            record["name_day"] = datetime.datetime(1950 + i, 1 + i, 1 + i)
+            record["social_security_number"] = f"123-45-{6780 + i}"
+            record["given_name"] = "WALTER" if i != 2 else "ZELDA"
+            record["postal_code"] = "02139" if i != 2 else "90210"
+        records[2]["family_name"] = records[0]["family_name"]
+        records[2]["name_day"] = records[0]["name_day"]
+        for record in records:
+            db.session.add(Demographic(**record))
+        index_blocks(records)
+        db.session.commit()
+        loaded_record_ids = [8675620, 8675623]
+        pairs = blocked_pairs(loaded_record_ids)
+        size_limit = blocking.BLOCK_SIZE_LIMIT
+        blocking.BLOCK_SIZE_LIMIT = 2
+        try:
+            pruned_pairs = blocked_pairs(loaded_record_ids)
+        finally:
+            blocking.BLOCK_SIZE_LIMIT = size_limit
+        drop_blocks([record["record_id"] for record in records])
+        Demographic.query.filter(Demographic.record_id >= 8675620).delete()
+        db.session.commit()
+    # 8675622 shares only 8675620's birth year and generated family name Soundex
+    assert sorted(pairs) == [
+        (8675620, 8675621),
+        (8675620, 8675622),
+        (8675620, 8675623),
+        (8675623, 8675621),
+    ]
+    # the given_postal block of three is left out, and its splits by birth year
+    # hold one record each
+    assert sorted(pruned_pairs) == [(8675620, 8675622)]
@@ -0,0 +1,43 @@
+from hashlib import sha256
+
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.data_utils import demographics_record
+from services.web.project.dedupe import BloomFilter, DuplicateFilter
+from services.web.project.model import db, Demographic
+
+
+def hex_digest(i: int) -> str:
+    return sha256(str(i).encode()).hexdigest()
+
+
+@timeit
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(hex_digest(i))
+    assert len(bloom) == 1000
+    assert all(hex_digest(i) in bloom for i in range(1000))
+    false_positives = sum(hex_digest(i) in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+@timeit
+def test_duplicate_filter():
+    with app.app_context():
+        db.create_all()
+        key = "test_duplicate_filter"
+        records = [demographics_record(key) for _ in range(3)]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675400 + i
+            db.session.add(Demographic(**record))
+        db.session.commit()
+        duplicate_filter = DuplicateFilter(capacity=1000)
+        stored = [record["uq_hash"] for record in records]
+        new = [hex_digest(i) for i in range(5)]
+        assert duplicate_filter.duplicates(stored + new) == set(stored)
+        # a hash the filter holds but the table does not is never a duplicate
+        duplicate_filter.add(new[:1])
+        assert duplicate_filter.duplicates(new) == set()
+        Demographic.query.filter(Demographic.record_id >= 8675400).delete()
+        db.session.commit()
@@ -1,13 +1,27 @@
+from sqlalchemy.dialects import postgresql
+
 from services.web.project import timeit
 from services.web.project.app import app
 from services.web.project.data_utils import demographics_record
 from services.web.project.engine import (
+    batch_fine_matching,
+    candidate_pairs,
     compute_all_matches,
+    compute_pair_matches,
+    fine_match_pairs,
+    neighborhood_coarse_matching,
+    neighborhood_pairs,
     coarse_matching,
     fine_matching,
     parse_result,
+    PARALLEL_MIN,
+    payload_record,
+    record_payload,
+    trigram_coarse_matching,
+    trigram_query,
 )
-from services.web.project.model import db
+from services.web.project.features import record_features
+from services.web.project.model import db, Demographic
 
 @timeit
 def test_compute_all_matches():
@@ -44,6 +58,8 @@ def test_fine_matching():
     input_fixture_1 = demographics_record(f'{key}_1')
     input_fixture_2 = demographics_record(f'{key}_2')
     expected_result = {
+        'record_a_id': None,
+        'record_b_id': None,
         'address_matching': None,
         'match': None,
         'exec_time': None,
@@ -69,3 +85,113 @@ def test_parse_result():
     expected_result = False
     actual_result = parse_result(input_fixture)
     assert expected_result == actual_result
+
+
+@timeit
+def test_candidate_pairs():
+    with app.app_context():
+        db.create_all()
+        key = "test_candidate_pairs"
+        records = [demographics_record(f"{key}_{i}") for i in range(4)]
+        records[1]["postal_code"] = records[0]["postal_code"]
+        records[2]["family_name"] = records[0]["family_name"]
+        records[3]["postal_code"] = records[0]["postal_code"]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675300 + i
+            record["is_active"] = i == 3
+            db.session.add(Demographic(**record))
+        db.session.commit()
+        loaded_record_ids = [8675300, 8675301, 8675302]
+        pairs = candidate_pairs(loaded_record_ids)
+        assert sorted(pairs) == [
+            (8675300, 8675301),
+            (8675300, 8675302),
+            (8675300, 8675303),
+            (8675301, 8675303)
+        ]
+        computed_matches, _ = compute_pair_matches(pairs)
+        assert [match["record_b_id"] for match in computed_matches] == \
+            [pair[1] for pair in pairs]
+        Demographic.query.filter(Demographic.record_id >= 8675300).delete()
+        db.session.commit()
+
+
+@timeit
+def test_fine_match_pairs_parallel():
+    key = "test_fine_match_pairs_parallel"
+    records = [demographics_record(f"{key}_{i}") for i in range(4)]
+    records[2]["family_name"] = records[0]["family_name"]
+    records[2]["postal_code"] = records[0]["postal_code"]
+    records[2].update(record_features(records[2]))
+    records = [payload_record(record_payload(Demographic(**record))) for record in records]
+    record_pairs = [
+        (records[i % 2], records[2 + i % 2]) for i in range(PARALLEL_MIN)
+    ]
+    serial_matches = fine_match_pairs(record_pairs, parallel=False)
+    parallel_matches = fine_match_pairs(record_pairs, parallel=True)
+    assert parallel_matches == serial_matches
+    assert any(match["match"] for match in parallel_matches)
+
+
+@timeit
+def test_batch_fine_matching():
+    key = "test_batch_fine_matching"
+    record_a = demographics_record(f"{key}_a")
+    records_b = [demographics_record(f"{key}_{i}") for i in range(20)]
+    records_b[0] = dict(record_a, record_id=None)
+    records_b[1] = dict(record_a, family_name=f"{record_a['family_name']} JR", address_2="")
+    records_b[1].update(record_features(records_b[1]))
+    batch_matches = batch_fine_matching(record_a, records_b)
+    for batch_match, record_b in zip(batch_matches, records_b):
+        fine_match = fine_matching(record_a, record_b)
+        del batch_match["exec_time"], fine_match["exec_time"]
+        assert batch_match == fine_match
+    assert batch_matches[0]["match"]
+
+
+@timeit
+def test_neighborhood_pairs():
+    with app.app_context():
+        db.create_all()
+        key = "test_neighborhood_pairs"
+        records = [demographics_record(f"{key}_{i}") for i in range(5)]
+        for i, record in enumerate(records):
+            record["record_id"] = 8675800 + i
+            record["is_active"] = i < 2
+            record["composite_name"] = f"zzzz{i}"
+            record["composite_name_day_postal_code"] = f"zzzz{4 - i}" if i != 2 else None
+            db.session.add(Demographic(**record))
+        db.session.commit()
+        loaded_record_ids = [8675802, 8675803, 8675804]
+        pairs = neighborhood_pairs(loaded_record_ids, window=2)
+        # by composite_name: 8675800, 01, 02, 03, 04; by the other key, with 02
+        # left out: 8675804, 03, 01, 00; pairs of two active records are not new
+        assert [pair for pair in pairs if min(pair) >= 8675800] == [
+            (8675802, 8675801),
+            (8675802, 8675803),
+            (8675803, 8675801),
+            (8675803, 8675804),
+        ]
+        all_pairs = neighborhood_pairs(window=2)
+        # a full re-match pairs only the active records: 8675800 and 8675801
+        assert (8675800, 8675801) in all_pairs
+        assert not any(8675802 in pair or 8675803 in pair for pair in all_pairs)
+        neighbors = neighborhood_coarse_matching(db.session.get(Demographic, 8675800))
+        assert 8675801 in [row.record_id for row in neighbors]
+        Demographic.query.filter(Demographic.record_id >= 8675800).delete()
+        db.session.commit()
+
+
+@timeit
+def test_trigram_coarse_matching():
+    with app.app_context():
+        db.create_all()
+        record = Demographic(**demographics_record("test_trigram_coarse_matching"))
+        record.address_1 = None
+        sql = str(trigram_query(record).compile(dialect=postgresql.dialect()))
+        assert "lower(demographic.family_name) %% " in sql
+        assert "similarity(lower(demographic.given_name)" in sql
+        assert "demographic.postal_code = " in sql
+        report = dict()
+        assert trigram_coarse_matching(record, report=report) == []
+        assert report["candidate_count"] == 0
@@ -0,0 +1,131 @@
+from sqlalchemy import select, update
+
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.data_utils import demographics_record, record_columns
+from services.web.project.engine import fine_matching
+from services.web.project.features import (
+    column_features,
+    feature,
+    FEATURE_COLUMNS,
+    FEATURE_FIELDS,
+    field_features,
+    rebuild_features,
+    record_features,
+)
+from services.web.project.matching import family_name_check, given_name_check
+from services.web.project.model import db, Demographic
+from services.web.project.record_view import MATCH_COLUMNS, RecordView
+
+
+@timeit
+def test_record_features():
+    features = record_features({
+        "given_name": "Mary-Ann",
+        "middle_name": None,
+        "family_name": "WHITE, SR.",
+        "address_1": "308 Negra Arroyo Lane",
+        "address_2": "",
+        "postal_code": "87111"
+    })
+    assert tuple(features) == FEATURE_COLUMNS
+    assert features["given_name_alpha"] == "MaryAnn"
+    assert features["middle_name_metaphone"] is None
+    assert features["family_name_alpha"] == "WHITESR"
+    assert features["family_name_junior"] == "WHITESR"
+    assert features["family_name_senior"] == "WHITE"
+    assert features["family_name_soundex"] == "W326"
+    assert features["address_2_metaphone"] == ""
+
+
+@timeit
+def test_column_features():
+    records = [demographics_record(f"test_column_features_{i % 3}") for i in range(6)]
+    records[0]["given_name"] = None
+    columns = record_columns(records, list(FEATURE_FIELDS))
+    features = column_features(columns)
+    for index, record in enumerate(records):
+        assert {column: values[index] for column, values in features.items()} == \
+            record_features(record)
+
+
+@timeit
+def test_feature():
+    assert feature("O'Neil", "alpha") == "ONeil"
+    assert feature("O'Neil", "alpha", {"alpha": "stored"}) == "stored"
+    assert feature("O'Neil", "alpha", {"alpha": None}) == "ONeil"
+
+
+@timeit
+def test_checks_read_stored_features():
+    a, b = "WHITE, SR.", "WHITE JR"
+    record_a = dict(record_features({"family_name": a}), family_name=a)
+    record_b = dict(record_features({"family_name": b}), family_name=b)
+    stored = family_name_check(
+        a, b,
+        features_a=field_features(record_a, "family_name"),
+        features_b=field_features(record_b, "family_name")
+    )
+    assert stored == family_name_check(a, b)
+    assert given_name_check(
+        "JON", "J.O.N.",
+        features_a={"alpha": "STORED"},
+        features_b={"alpha": "STORED"}
+    )[1]["sub_result"] == "STORED"
+
+
+@timeit
+def test_rebuild_features():
+    with app.app_context():
+        db.create_all()
+        key = "test_rebuild_features"
+        record = demographics_record(key)
+        record["record_id"] = 8676000
+        db.session.add(Demographic(**record))
+        db.session.commit()
+        db.session.execute(
+            update(Demographic).
+            where(Demographic.record_id == 8676000).
+            values({column: None for column in FEATURE_COLUMNS})
+        )
+        db.session.commit()
+        assert rebuild_features() >= 1
+        stored = db.session.execute(
+            select(*[getattr(Demographic, column) for column in FEATURE_COLUMNS]).
+            where(Demographic.record_id == 8676000)
+        ).one()
+        assert dict(stored._mapping) == record_features(record)
+
+
+@timeit
+def test_written_fields_refresh_features():
+    with app.app_context():
+        db.create_all()
+        key = "test_written_fields_refresh_features"
+        records = [demographics_record(f"{key}_{i}") for i in range(2)]
+        for i, record in enumerate(records):
+            record.update(record_features(record))
+            record["record_id"] = 8676010 + i
+        # the features written with a record are its metadata's, kept as inserted
+        records[1]["family_name_junior"] = "STALE"
+        db.session.add_all([Demographic(**record) for record in records])
+        db.session.commit()
+        record_b = db.session.get(Demographic, 8676011)
+        assert record_b.family_name_junior == "STALE"
+        record_b.gender = "u"
+        db.session.commit()
+        assert record_b.family_name_junior == "STALE"
+        record_b.family_name = f"{records[0]['family_name']} JR"
+        db.session.commit()
+        record_a, record_b = [
+            RecordView(*row) for row in db.session.execute(
+                select(*MATCH_COLUMNS).
+                where(Demographic.record_id.in_([8676010, 8676011])).
+                order_by(Demographic.record_id)
+            )
+        ]
+        fine_match = fine_matching(record_a, record_b)
+        Demographic.query.filter(Demographic.record_id.in_([8676010, 8676011])).delete()
+        db.session.commit()
+    assert record_b.family_name_junior == records[0]["family_name_junior"]
+    assert fine_match["name_matching"]["metrics"]["family_name"]["junior_detected"]
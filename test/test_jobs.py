@@ -0,0 +1,99 @@
+from datetime import datetime
+
+from services.web.project import post, timeit, version
+from services.web.project.app import app
+from services.web.project.auditor import Auditor
+from services.web.project.coupler import COUPLER
+from services.web.project.jobs import claim_job, enqueue_job, JOB_ATTEMPTS, JobWorker
+from services.web.project.model import db, Batch, Job
+
+
+def queue_batch(key: str) -> int:
+    with app.app_context():
+        db.create_all()
+        db.session.query(Job).delete()
+        db.session.commit()
+        with Auditor(key, version, "match_affirm") as auditor:
+            enqueue_job(auditor, "match_affirm", {"user": key})
+
+    return auditor.batch_id
+
+
+def job_state(batch_id: int) -> tuple:
+    with app.app_context():
+        job_record = db.session.get(Job, batch_id)
+        batch_status = db.session.get(Batch, batch_id).batch_status
+
+        return job_record.job_status, job_record.attempts, job_record.run_after_ts, batch_status
+
+
+@timeit
+def test_job_worker(monkeypatch):
+    payloads = list()
+
+    def processor(payload, auditor):
+        auditor.stamp(1, None)
+        payloads.append(payload)
+
+    monkeypatch.setitem(COUPLER["match_affirm"], "processor", processor)
+    batch_id = queue_batch("test_job_worker")
+    assert job_state(batch_id)[0] == "QUEUED"
+    assert job_state(batch_id)[3] == "QUEUED"
+    worker = JobWorker(worker_id="test_job_worker")
+    assert worker.run_once()
+    assert not worker.run_once()
+    assert payloads == [{"user": "test_job_worker"}]
+    job_status, attempts, _, batch_status = job_state(batch_id)
+    assert (job_status, attempts, batch_status) == ("DONE", 1, "PENDING")
+
+
+@timeit
+def test_job_retry(monkeypatch):
+    def processor(payload, auditor):
+        raise ValueError("processor failed")
+
+    monkeypatch.setitem(COUPLER["match_affirm"], "processor", processor)
+    batch_id = queue_batch("test_job_retry")
+    worker = JobWorker(worker_id="test_job_retry")
+    assert worker.run_once()
+    job_status, attempts, run_after_ts, batch_status = job_state(batch_id)
+    assert (job_status, attempts, batch_status) == ("QUEUED", 1, "QUEUED")
+    assert run_after_ts > datetime.now()
+    assert claim_job("test_job_retry") is None
+    for attempt in range(2, JOB_ATTEMPTS + 1):
+        with app.app_context():
+            db.session.query(Job).update({Job.run_after_ts: datetime.now()})
+            db.session.commit()
+        assert worker.run_once()
+    job_status, attempts, _, batch_status = job_state(batch_id)
+    assert (job_status, attempts, batch_status) == ("FAILED", JOB_ATTEMPTS, "FAILED")
+
+
+@timeit
+def test_job_not_retried(monkeypatch):
+    def processor(payload, auditor):
+        auditor.stamp(1, None)
+        raise ValueError("processor failed")
+
+    monkeypatch.setitem(COUPLER["match_affirm"], "processor", processor)
+    batch_id = queue_batch("test_job_not_retried")
+    worker = JobWorker(worker_id="test_job_not_retried")
+    assert worker.run_once()
+    assert not worker.run_once()
+    job_status, attempts, _, batch_status = job_state(batch_id)
+    assert (job_status, attempts, batch_status) == ("FAILED", 1, "FAILED")
+
+
+@timeit
+def test_enqueue_failure(monkeypatch):
+    monkeypatch.setitem(app.config, "JOB_QUEUE", True)
+    with app.app_context():
+        db.create_all()
+        db.session.query(Job).delete()
+        db.session.commit()
+        # a payload which cannot be stored fails the commit of job and batch alike
+        response = post({"user": "test_enqueue_failure", "record": object()}, "match_affirm")
+        batch_status = db.session.get(Batch, response["batch_key"]).batch_status
+        job_count = db.session.query(Job).count()
+    assert response["status"] == 503
+    assert (batch_status, job_count) == ("FAILED", 0)
@@ -0,0 +1,121 @@
+import gzip
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from services.web.project import timeit, version
+from services.web.project.app import app
+from services.web.project.auditor import Auditor
+from services.web.project.data_utils import demographics_record
+from services.web.project.loader import (
+    Checkpoint,
+    infer_format,
+    read_records,
+    recover_activations
+)
+from services.web.project.model import db, Demographic, Process
+
+
+@timeit
+@pytest.mark.parametrize("path, expected", [
+    ("demographics.csv", "csv"),
+    ("demographics.CSV.gz", "csv"),
+    ("demographics.ndjson", "ndjson"),
+    ("demographics.jsonl.gz", "ndjson"),
+    ("demographics.parquet", "parquet"),
+])
+def test_infer_format(path, expected):
+    assert infer_format(path) == expected
+
+
+@timeit
+def test_infer_format_unknown():
+    with pytest.raises(ValueError):
+        infer_format("demographics.xlsx")
+
+
+@timeit
+def test_read_records_csv(tmp_path):
+    path = tmp_path / "demographics.csv"
+    path.write_text(
+        "given_name,family_name,postal_code\n"
+        "WALTER,WHITE,87111\n"
+        "JESSE,PINKMAN,\n"
+    )
+    records = read_records(str(path))
+    assert next(records) == {
+        "given_name": "WALTER",
+        "family_name": "WHITE",
+        "postal_code": "87111"
+    }
+    assert next(records)["postal_code"] is None
+    assert list(records) == []
+
+
+@timeit
+def test_read_records_ndjson_gz(tmp_path):
+    path = tmp_path / "demographics.ndjson.gz"
+    with gzip.open(path, "wt") as file:
+        file.write('{"given_name": "WALTER"}\n\n{"given_name": "SKYLER"}\n')
+    records = list(read_records(str(path)))
+    assert records == [{"given_name": "WALTER"}, {"given_name": "SKYLER"}]
+
+
+@timeit
+def test_read_records_parquet(tmp_path):
+    path = tmp_path / "demographics.parquet"
+    pq.write_table(
+        pa.Table.from_pylist([{"given_name": "WALTER"}, {"given_name": "SKYLER"}]),
+        str(path)
+    )
+    records = list(read_records(str(path), batch_size=1))
+    assert records == [{"given_name": "WALTER"}, {"given_name": "SKYLER"}]
+
+
+@timeit
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / "demographics.csv.checkpoint")
+    checkpoint = Checkpoint(path, 100)
+    assert checkpoint.batch_id is None
+    checkpoint.batch_id = 867
+    checkpoint.complete(0)
+    checkpoint.complete(2)
+    resumed = Checkpoint(path, 100)
+    assert resumed.batch_id == 867
+    assert resumed.completed == {0, 2}
+    with open(path) as file:
+        assert json.load(file)["completed"] == [0, 2]
+    with pytest.raises(ValueError):
+        Checkpoint(path, 50)
+
+
+@timeit
+def test_recover_activations():
+    key = "test_recover_activations"
+    with app.app_context():
+        db.create_all()
+        with Auditor(key, version, "demographic") as auditor:
+            proc_ids = [auditor.stamp(row, None) for row in range(1, 3)]
+        for i, proc_id in enumerate(proc_ids):
+            record = demographics_record(f"{key}_{i}")
+            record["record_id"] = 8676200 + i
+            record["is_active"] = False
+            db.session.add(Demographic(**record))
+            # the first was posted by the crashed load; the second never was
+            db.session.query(Process).filter(Process.proc_id == proc_id).update({
+                Process.proc_record_id: 8676200 + i,
+                Process.proc_status: "POSTED" if i == 0 else "PENDING"
+            })
+        db.session.commit()
+        recovered_count = recover_activations(auditor.batch_id, key, version)
+        again_count = recover_activations(auditor.batch_id, key, version)
+        is_active = [
+            db.session.get(Demographic, record_id).is_active
+            for record_id in (8676200, 8676201)
+        ]
+        Demographic.query.filter(Demographic.record_id >= 8676200).delete()
+        db.session.commit()
+    assert recovered_count == 1
+    assert again_count == 0
+    assert is_active == [True, False]
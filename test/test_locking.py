@@ -0,0 +1,113 @@
+import threading
+
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.locking import component_ids, GraphLock, lock_key
+from services.web.project.model import db, EnterpriseGroup
+
+
+@timeit
+def test_lock_key():
+    assert lock_key("component", 8675500) == lock_key("component", 8675500)
+    assert lock_key("component", 8675500) != lock_key("blocking", 8675500)
+    assert -2 ** 63 <= lock_key("component", 8675500) < 2 ** 63
+
+
+@timeit
+def test_component_ids():
+    with app.app_context():
+        db.create_all()
+        for etl_id, record_id in enumerate((8675500, 8675501)):
+            db.session.add(EnterpriseGroup(
+                etl_id=8675500 + etl_id,
+                enterprise_id=8675500,
+                record_id=record_id
+            ))
+        db.session.commit()
+        assert component_ids([8675501, 8675502]) == {8675500, 8675502}
+        EnterpriseGroup.query.filter(EnterpriseGroup.etl_id >= 8675500).delete()
+        db.session.commit()
+
+
+@timeit
+def test_graph_lock():
+    held = threading.Event()
+    finish = threading.Event()
+    events = list()
+
+    def lock(record_id, name):
+        with app.app_context(), GraphLock() as graph_lock:
+            graph_lock.lock_components(lambda: [record_id])
+            events.append(f"{name} locked")
+            if name == "first":
+                held.set()
+                finish.wait(5)
+            events.append(f"{name} released")
+
+    with app.app_context():
+        db.create_all()
+    first = threading.Thread(target=lock, args=(8675510, "first"))
+    first.start()
+    held.wait(5)
+    # a disjoint graph is locked while the first is held
+    disjoint = threading.Thread(target=lock, args=(8675511, "disjoint"))
+    disjoint.start()
+    disjoint.join(5)
+    # an overlapping graph waits for the first
+    overlapping = threading.Thread(target=lock, args=(8675510, "overlapping"))
+    overlapping.start()
+    overlapping.join(0.2)
+    assert overlapping.is_alive()
+    finish.set()
+    first.join(5)
+    overlapping.join(5)
+    assert events == [
+        "first locked",
+        "disjoint locked",
+        "disjoint released",
+        "first released",
+        "overlapping locked",
+        "overlapping released",
+    ]
+
+
+@timeit
+def test_graph_lock_exclusive():
+    held = threading.Event()
+    finish = threading.Event()
+    events = list()
+
+    def lock(name, exclusive=False):
+        with app.app_context(), GraphLock(exclusive=exclusive):
+            events.append(f"{name} locked")
+            if name == "shared":
+                held.set()
+                finish.wait(5)
+            events.append(f"{name} released")
+
+    with app.app_context():
+        db.create_all()
+    shared = threading.Thread(target=lock, args=("shared",))
+    shared.start()
+    held.wait(5)
+    # the whole network waits for the change in progress
+    exclusive = threading.Thread(target=lock, args=("exclusive", True))
+    exclusive.start()
+    exclusive.join(0.2)
+    assert exclusive.is_alive()
+    # and a new change, even to a disjoint graph, waits behind it
+    later = threading.Thread(target=lock, args=("later",))
+    later.start()
+    later.join(0.2)
+    assert later.is_alive()
+    finish.set()
+    for thread in (shared, exclusive, later):
+        thread.join(5)
+    assert events == [
+        "shared locked",
+        "shared released",
+        "exclusive locked",
+        "exclusive released",
+        "later locked",
+        "later released",
+    ]
@@ -0,0 +1,62 @@
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.blocking import blocking_keys, drop_blocks, index_blocks
+from services.web.project.data_utils import demographics_record
+from services.web.project.engine import lsh_coarse_matching
+from services.web.project.lsh import LSH_BANDS, LSH_PREFIX, lsh_keys, qgrams
+from services.web.project.model import db, Blocking, Demographic
+
+
+@timeit
+def test_qgrams():
+    record = {"given_name": "Al", "family_name": None, "address_1": "1 A-St"}
+    assert qgrams(record) == {
+        "given_name:^al",
+        "given_name:al$",
+        "address_1:^1a",
+        "address_1:1as",
+        "address_1:ast",
+        "address_1:st$",
+    }
+
+
+@timeit
+def test_lsh_keys():
+    record = {"given_name": "Jonathan", "family_name": "Smith", "address_1": "123 Main Street"}
+    typo = {"given_name": "Jonathon", "family_name": "Smyth", "address_1": "123 Main St"}
+    other = {"given_name": "Maria", "family_name": "Gonzalez", "address_1": "9 Elm Avenue"}
+    assert len(lsh_keys(record)) == LSH_BANDS
+    assert lsh_keys(record) == lsh_keys(dict(record))
+    assert set(lsh_keys(record)) & set(lsh_keys(typo))
+    assert not set(lsh_keys(record)) & set(lsh_keys(other))
+    assert lsh_keys({"given_name": None}) == []
+
+
+@timeit
+def test_lsh_coarse_matching():
+    with app.app_context():
+        db.create_all()
+        key = "test_lsh_coarse_matching"
+        records = [demographics_record(f"{key}_{i}") for i in range(3)]
+        names = [
+            ("Jonathan", "Smith", "123 Main Street"),
+            ("Jonathon", "Smyth", "123 Main St"),
+            ("Maria", "Gonzalez", "9 Elm Avenue"),
+        ]
+        for i, (record, (given_name, family_name, address_1)) in enumerate(zip(records, names)):
+            record.update(given_name=given_name, family_name=family_name, address_1=address_1)
+            record["record_id"] = 8675900 + i
+            record["is_active"] = True
+            db.session.add(Demographic(**record))
+        assert index_blocks(records[:1]) == len(blocking_keys(records[0]))
+        assert Blocking.query.filter(Blocking.block_key.startswith(LSH_PREFIX)).count() == 0
+        drop_blocks([8675900])
+        index_blocks(records, lsh=True)
+        db.session.commit()
+        report = dict()
+        candidates = lsh_coarse_matching(db.session.get(Demographic, 8675900), report=report)
+        assert [row.record_id for row in candidates] == [8675901]
+        assert report == {"block_count": LSH_BANDS, "candidate_count": 1}
+        drop_blocks([8675900, 8675901, 8675902])
+        Demographic.query.filter(Demographic.record_id >= 8675900).delete()
+        db.session.commit()
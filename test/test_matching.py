@@ -3,6 +3,10 @@ import pytest
 from services.web.project import timeit
 from services.web.project.data_utils import random_datetime
 from services.web.project.matching import (
+    batch_string_metrics,
+    LazyMetrics,
+    METRIC_NAMES,
+    pair_string_metrics,
     pairwise_string_metrics,
     string_replacer,
     string_slicer,
@@ -38,6 +42,22 @@ def test_pairwise_string_metrics(test_input, expected):
     assert pairwise_string_metrics(*test_input) == expected
 
 
+@timeit
+@pytest.mark.parametrize("a, candidates", [
+    ("Jon", ["Jon", "Not Jon", "John", "", "jon "]),
+    ("", ["", "Jon"]),
+    ("308 Negra Arroyo Lane", ["308 Negra Arroyo Ln", "9 Negra Arroyo Lane", "308"]),
+])
+def test_batch_string_metrics(a, candidates):
+    """
+    :param a: the query string
+    :param candidates: the strings it is scored against in one batch
+    """
+    metrics = batch_string_metrics(a, candidates)
+    for index, b in enumerate(candidates):
+        assert pair_string_metrics(metrics, index, a, b) == pairwise_string_metrics(a, b)
+
+
 @timeit
 @pytest.mark.parametrize("test_input, expected", [
     (("JR.", "JR", ".", ""), "JR"),
@@ -358,3 +378,15 @@ def test_wrap_name_check():
 
     assert wrap_name_check(record_a, record_b) == expected_result_1
     assert wrap_name_check(record_c, record_b) == expected_result_2
+
+
+@timeit
+def test_lazy_metrics():
+    metrics = LazyMetrics(record_a, record_c)
+    assert metrics["family_name.jaro_winkler"] == \
+        pairwise_string_metrics("WHITE, SR.", "WHITE")["jaro_winkler"]
+    assert metrics["given_name.equal"]
+    assert set(metrics.computed) == {"family_name.jaro_winkler", "given_name.equal"}
+    assert "family_name.metaphone" in METRIC_NAMES
+    with pytest.raises(KeyError):
+        metrics["family_name.shoe_size"]
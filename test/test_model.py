@@ -1,9 +1,14 @@
+from sqlalchemy.dialects import postgresql
+
 from .conftest import (
     THE_CONSTANT_ID,
     CONST_BATCH_ID,
     CONST_PROC_ID,
     transaction_key_for_tests
 )
+from services.web.project import version
+from services.web.project.app import app
+from services.web.project.model import db, etl_id_seq_setval, ETLIDSource, KeyAllocator
 
 
 def test_delete(mock_delete):
@@ -78,3 +83,25 @@ def test_enterprise_group(mock_enterprise_group):
 def test_enterprise_match(mock_enterprise_match):
     my_enterprise_match = mock_enterprise_match
     assert my_enterprise_match.etl_id == THE_CONSTANT_ID
+
+
+def test_key_allocator():
+    with app.app_context():
+        db.create_all()
+        allocator = KeyAllocator(block_size=5)
+        user = "test_key_allocator"
+        etl_ids = allocator.take(user, version, 7)
+        assert len(set(etl_ids)) == 7
+        assert etl_ids == list(range(etl_ids[0], etl_ids[0] + 7))
+        assert allocator(user, version) == etl_ids[-1] + 1
+        blocks = ETLIDSource.query.filter_by(user=user).all()
+        assert len(blocks) == 2
+        assert all(block.block_size == 5 for block in blocks)
+        assert allocator(f"{user}_other", version) == etl_ids[0] + 10
+
+
+def test_etl_id_seq_setval():
+    sql = str(etl_id_seq_setval().compile(dialect=postgresql.dialect()))
+    assert "setval(" in sql
+    assert "max(etl_id_source.etl_id + coalesce(etl_id_source.block_size" in sql
+    assert "greatest(" in sql and "nextval('etl_id_seq')" in sql
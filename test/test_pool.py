@@ -0,0 +1,63 @@
+import json
+import threading
+
+from services.web.project import timeit, version
+from services.web.project.pool import POST_POOL, WorkerPool
+
+
+@timeit
+def test_worker_pool():
+    pool = WorkerPool(workers=1, queue_size=1)
+    started = threading.Event()
+    finish = threading.Event()
+
+    def processor(payload, auditor):
+        started.set()
+        finish.wait(5)
+
+    assert pool.admit()
+    pool.submit(processor, {}, None)
+    started.wait(5)
+    assert pool.admit()
+    pool.submit(processor, {}, None)
+    assert not pool.admit()
+    metrics = pool.metrics()
+    assert metrics["running_count"] == 1
+    assert metrics["queue_depth"] == 1
+    assert metrics["utilization"] == 1
+    assert metrics["rejected_count"] == 1
+    finish.set()
+    pool.executor.shutdown(wait=True)
+    metrics = pool.metrics()
+    assert metrics["completed_count"] == 2
+    assert metrics["queue_depth"] == 0
+    assert pool.admit()
+    pool.release()
+
+
+@timeit
+def test_worker_pool_failure():
+    pool = WorkerPool(workers=1, queue_size=0)
+
+    def processor(payload, auditor):
+        raise ValueError("processor failed")
+
+    assert pool.admit()
+    pool.submit(processor, {}, None)
+    pool.executor.shutdown(wait=True)
+    assert pool.metrics()["failed_count"] == 1
+    assert pool.admit()
+
+
+@timeit
+def test_busy_response(client, monkeypatch):
+    monkeypatch.setattr(POST_POOL, "admit", lambda: False)
+    response = client.post(
+        f"/api_{version}/match_affirm",
+        json={"record_id_low": 1, "record_id_high": 2, "touched_by": "test", "user": "test"}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert json.loads(response.data.decode())["response"] == {"batch_key": None, "status": 503}
+    response = client.get(f"/api_{version}/worker_pool")
+    assert json.loads(response.data.decode())["response"]["workers"] == POST_POOL.workers
@@ -19,8 +19,29 @@ from .conftest import (
     mock_enterprise_match,
     mock_etl_id_source
 )
-from services.web.project import timeit
-from services.web.project.processor import MODEL_MAP
+from datetime import datetime
+from services.web.project import engine, timeit, version
+from services.web.project.app import app
+from services.web.project.auditor import Auditor
+from services.web.project.data_utils import (
+    apply_batch_metadata,
+    apply_record_metadata,
+    chunked,
+    demographics_record,
+    iter_ndjson
+)
+from services.web.project.features import record_features
+from services.web.project.processor import (
+    MODEL_MAP,
+    activate_demographic,
+    drop_duplicates,
+    mint_transaction_keys,
+    parse_name_day,
+    stage_demographic,
+    stage_metadata,
+    update_status
+)
+from services.web.project.model import db, Batch, Demographic, DemographicActivation, Process
 
 
 @timeit
@@ -75,3 +96,189 @@ def test_transact_and_query_records(payload, table_name):
     for row in query.all():
         response.append(row.to_dict())
     assert len(response) == 2
+
+
+@timeit
+@pytest.mark.parametrize("name_day_input, expected", [
+    ("19700101", datetime(1970, 1, 1)),
+    (datetime(1970, 1, 1), datetime(1970, 1, 1)),
+    (None, None),
+])
+def test_parse_name_day(name_day_input, expected):
+    assert parse_name_day(name_day_input) == expected
+
+
+@timeit
+def test_stage_demographic():
+    record = {
+        "given_name": "WALTER",
+        "middle_name": "HARTWELL",
+        "family_name": "WHITE",
+        "address_1": "308 Negra Arroyo Lane",
+        "name_day": "19580907",
+        "foreign_record_id": "ABC123"
+    }
+    staged_record = stage_demographic(record, THE_CONSTANT_ID, "1_2")
+    assert staged_record["record_id"] == THE_CONSTANT_ID
+    assert staged_record["transaction_key"] == "1_2"
+    assert staged_record["middle_name"] == "HARTWELL"
+    assert staged_record["name_day"] == datetime(1958, 9, 7)
+    assert staged_record["postal_code"] is None
+    assert "foreign_record_id" not in staged_record
+
+
+@timeit
+def test_chunked():
+    chunks = list(chunked(range(7), 3))
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked([], 3)) == []
+
+
+@timeit
+def test_iter_ndjson():
+    lines = [
+        b'{"given_name": "WALTER"}\n',
+        b'\n',
+        b'{"given_name": \n',
+        b'["not", "a", "record"]\n',
+        '{"given_name": "SKYLER"}',
+    ]
+    records = list(iter_ndjson(lines))
+    assert records == [
+        {"given_name": "WALTER"},
+        None,
+        None,
+        {"given_name": "SKYLER"}
+    ]
+
+
+@timeit
+def test_apply_batch_metadata():
+    complete = [demographics_record("test_apply_batch_metadata") for _ in range(3)]
+    complete[0]["given_name"] = "JEAN-LUC PICARD"
+    records = [demographics_record("test_apply_batch_metadata") for _ in range(5)]
+    records[1]["family_name"] = None
+    records[2]["postal_code"] = None
+    records[3]["system_key"] = None
+    records[4]["given_name"] = "JEAN-LUC PICARD"
+    for chunk in (complete, records):
+        expected = [apply_record_metadata(dict(record), "testuser")[0] for record in chunk]
+        actual, ts = apply_batch_metadata([dict(record) for record in chunk], "testuser")
+        for expected_record, actual_record in zip(expected, actual):
+            assert actual_record["touched_ts"] == ts
+            del expected_record["touched_ts"], actual_record["touched_ts"]
+            assert actual_record == expected_record
+
+
+@timeit
+def test_stage_metadata():
+    records = [demographics_record("test_stage_metadata") for _ in range(3)]
+    records[1]["name_day"] = None
+    staged_rows = [(row, None, dict(record)) for row, record in enumerate(records)]
+    staged_rows.append((3, None, None))
+    staged_rows = stage_metadata(staged_rows, "testuser")
+    assert [staged_record is None for _, _, staged_record in staged_rows] == \
+        [False, True, False, True]
+    assert staged_rows[2][2]["uq_hash"] == records[2]["uq_hash"]
+
+
+@timeit
+def test_batch_pending_count():
+    def batch_state(batch_id):
+        return tuple(db.session.query(Batch.batch_status, Batch.pending_count).\
+            filter(Batch.batch_id == batch_id).one())
+
+    with app.app_context():
+        db.create_all()
+        with Auditor("test_batch_pending_count", version, "demographic") as auditor:
+            proc_ids = [auditor.stamp(row, None) for row in range(1, 3)]
+            update_status(auditor.batch_id, proc_ids[0], "POSTED")
+            update_status(auditor.batch_id, proc_ids[0], "ACTIVATED")
+            started = batch_state(auditor.batch_id)
+        submitted = batch_state(auditor.batch_id)
+        update_status(auditor.batch_id, proc_ids[1], "POSTED")
+        computed = batch_state(auditor.batch_id)
+    assert started == ("STARTING", 1)
+    assert submitted == ("PENDING", 1)
+    assert computed == ("COMPUTED", 0)
+
+
+@timeit
+def test_mint_transaction_keys():
+    with app.app_context():
+        db.create_all()
+        with Auditor("test_mint_transaction_keys", version, "demographic") as auditor:
+            stamps = mint_transaction_keys(auditor, [(1, "a"), (2, None), (3, "c")])
+            no_stamps = mint_transaction_keys(auditor, [])
+        proc_records = db.session.query(Process).\
+            filter(Process.batch_id == auditor.batch_id).\
+            order_by(Process.row).all()
+        pending_count = db.session.get(Batch, auditor.batch_id).pending_count
+    assert [proc_id for proc_id, _ in stamps] == \
+        [proc_record.proc_id for proc_record in proc_records]
+    assert [transaction_key for _, transaction_key in stamps] == \
+        [f"{auditor.batch_id}_{proc_id}" for proc_id, _ in stamps]
+    assert [proc_record.foreign_record_id for proc_record in proc_records] == \
+        ["a", None, "c"]
+    assert {proc_record.proc_status for proc_record in proc_records} == {"PENDING"}
+    assert pending_count == 3
+    assert no_stamps == []
+
+
+@timeit
+def test_drop_duplicates():
+    records = [demographics_record("test_drop_duplicates") for _ in range(2)]
+    records[0]["record_id"] = 8676200
+    records[0]["foreign_record_id"] = "stored"
+    staged_rows = [(row, record, dict(record)) for row, record in enumerate(records, start=1)]
+    metrics = {"record_count": 0, "skipped_count": 0}
+    with app.app_context():
+        db.create_all()
+        db.session.add(Demographic(**{
+            name: value for name, value in records[0].items() if name != "foreign_record_id"
+        }))
+        db.session.commit()
+        with Auditor("test_drop_duplicates", version, "demographic") as auditor:
+            kept_rows = drop_duplicates(staged_rows, metrics, auditor)
+        proc_records = db.session.query(Process.row, Process.proc_status, Process.foreign_record_id).\
+            filter(Process.batch_id == auditor.batch_id).all()
+        skipped_count = db.session.get(Batch, auditor.batch_id).skipped_count
+        Demographic.query.filter(Demographic.record_id == 8676200).delete()
+        db.session.commit()
+    assert [row for row, _, _ in kept_rows] == [2]
+    assert metrics == {"record_count": 1, "skipped_count": 1}
+    assert [tuple(proc_record) for proc_record in proc_records] == [(1, "SKIPPED", "stored")]
+    assert skipped_count == 1
+
+
+@timeit
+@pytest.mark.parametrize("mode", ["sorted_neighborhood", "lsh", "trigram"])
+def test_activate_demographic(monkeypatch, mode):
+    monkeypatch.setattr(engine, "MODE", mode)
+    key = f"test_activate_demographic_{mode}"
+    record_id = 8676100 + 10 * list(engine.MODES).index(mode)
+    records = [demographics_record(f"{key}_{i}") for i in range(2)]
+    for name in ("given_name", "family_name", "name_day", "postal_code",
+                 "social_security_number", "composite_name", "composite_name_day_postal_code"):
+        records[1][name] = records[0][name]
+    with app.app_context():
+        db.create_all()
+        for i, record in enumerate(records):
+            record["record_id"] = record_id + i
+            record["is_active"] = i == 1
+            record.update(record_features(record))
+            db.session.add(Demographic(**record))
+        db.session.commit()
+        with Auditor(key, version, "demographic") as auditor:
+            auditor.stamp(1, None)
+            activate_demographic({"record_id": record_id}, auditor)
+        candidate_count = db.session.query(DemographicActivation.candidate_count).\
+            filter(DemographicActivation.record_id == record_id).scalar()
+        if mode == "sorted_neighborhood":
+            matches, _ = engine.compute_all_matches(db.session.get(Demographic, record_id))
+            assert [(match["record_b_id"], match["match"]) for match in matches] == \
+                [(record_id + 1, True)]
+        Demographic.query.\
+            filter(Demographic.record_id.in_([record_id, record_id + 1])).delete()
+        db.session.commit()
+    assert candidate_count == (1 if mode == "sorted_neighborhood" else 0)
@@ -0,0 +1,151 @@
+import pytest
+import random
+
+from services.web.project import timeit
+from services.web.project.app import app
+from services.web.project.data_utils import demographics_record
+from services.web.project import engine
+from services.web.project.engine import battery_fine_matching, fine_match_pairs, PARALLEL_MIN
+from services.web.project.model import db
+from services.web.project.score_weighting import (
+    active_tests,
+    assemble_tests,
+    battery_metrics,
+    BATTERY_CACHE,
+    create_battery,
+    create_test,
+    load_tests,
+    make_battery,
+    ops,
+    order_tests,
+    run_battery,
+    run_cascade,
+)
+
+
+def make_tests() -> list:
+    test_packets = [
+        {"metric": "family_name.equal", "threshold": "True", "operator": "eq", "weight": 0.5},
+        {"metric": "given_name.jaro_winkler", "threshold": "0.9", "operator": "ge", "weight": 0.3},
+        {"metric": "name_day.equal", "threshold": "True", "operator": "eq", "weight": 0.2},
+    ]
+    with app.app_context():
+        db.create_all()
+    return [
+        create_test(dict(packet, user="testuser", version="test"))
+        for packet in test_packets
+    ]
+
+
+@timeit
+def test_load_tests():
+    test_ids = make_tests()
+    battery_id = create_battery({"user": "testuser", "version": "test", "test_ids": test_ids})
+    assert sorted(assemble_tests(battery_id)) == sorted(test_ids)
+    tests = load_tests(test_ids)
+    assert ("family_name.equal", True, ops["eq"], 0.5) in tests
+    assert ("given_name.jaro_winkler", 0.9, ops["ge"], 0.3) in tests
+    assert battery_metrics(tests) == {
+        "family_name.equal", "given_name.jaro_winkler", "name_day.equal"
+    }
+
+
+@timeit
+def test_run_battery():
+    test_ids = make_tests()
+    metric = {"family_name.equal": True, "given_name.jaro_winkler": 0.8, "name_day.equal": True}
+    score, match = run_battery(make_battery(test_ids, metric))
+    assert round(score, 8) == 0.4
+    assert not match
+
+
+@timeit
+def test_battery_fine_matching():
+    test_ids = make_tests()
+    battery_id = create_battery({"user": "testuser", "version": "test", "test_ids": test_ids})
+    app.config["SCORE_BATTERY"] = battery_id
+    BATTERY_CACHE.clear()
+    try:
+        assert len(active_tests()) == 3
+        record_a = demographics_record("test_battery_fine_matching")
+        record_b = dict(record_a, record_id=None)
+        fine_match = battery_fine_matching(record_a, record_b)
+        other_match = battery_fine_matching(
+            record_a, demographics_record("test_battery_fine_matching_other")
+        )
+    finally:
+        app.config["SCORE_BATTERY"] = None
+    assert fine_match["match"]
+    assert round(fine_match["score"], 8) == 1.0
+    assert set(fine_match["metrics"]) == {
+        "family_name.equal", "given_name.jaro_winkler", "name_day.equal"
+    }
+    assert fine_match["skipped_tests"] == 0
+    assert not other_match["match"]
+    assert other_match["skipped_tests"] == 1
+    assert set(other_match["metrics"]) == {"family_name.equal", "name_day.equal"}
+    assert active_tests() == []
+    with pytest.raises(ValueError):
+        battery_fine_matching(record_a, record_b)
+
+
+@timeit
+def test_battery_fine_match_pairs_parallel(monkeypatch):
+    test_ids = make_tests()
+    battery_id = create_battery({"user": "testuser", "version": "test", "test_ids": test_ids})
+    monkeypatch.setitem(app.config, "SCORE_BATTERY", battery_id)
+    monkeypatch.setattr(engine, "MODE", "battery")
+    BATTERY_CACHE.clear()
+    record_a = demographics_record("test_battery_fine_match_pairs_parallel")
+    records_b = [
+        dict(record_a, record_id=None),
+        demographics_record("test_battery_fine_match_pairs_parallel_other")
+    ]
+    record_pairs = [(record_a, records_b[i % 2]) for i in range(PARALLEL_MIN)]
+    serial_matches = fine_match_pairs(record_pairs, parallel=False)
+    # the spawned workers see an empty database, so they must score with the
+    # tests sent to them
+    parallel_matches = fine_match_pairs(record_pairs, parallel=True)
+    for match in serial_matches + parallel_matches:
+        del match["exec_time"]
+    assert parallel_matches == serial_matches
+    assert [match["match"] for match in parallel_matches[:2]] == [True, False]
+
+
+@timeit
+def test_order_tests():
+    tests = [
+        ("given_name.damerau_levenshtein_distance", 2.0, ops["le"], 0.5),
+        ("family_name.equal", True, ops["eq"], 0.2),
+        ("social_security_number.equal", True, ops["eq"], 0.1),
+        ("family_name.jaro_winkler", 0.9, ops["ge"], 0.4),
+        ("given_name.equal", True, ops["eq"], 0.3),
+    ]
+    assert [test[0] for test in order_tests(tests)] == [
+        "social_security_number.equal",
+        "given_name.equal",
+        "family_name.equal",
+        "family_name.jaro_winkler",
+        "given_name.damerau_levenshtein_distance",
+    ]
+
+
+@timeit
+def test_run_cascade():
+    generator = random.Random(8675309)
+    for _ in range(500):
+        tests = [
+            (f"metric_{i}", 0.5, ops["ge"], generator.choice([0.1, 0.2, 0.25, 0.5, -0.3]))
+            for i in range(generator.randint(0, 8))
+        ]
+        metric = {f"metric_{i}": generator.random() for i in range(len(tests))}
+        score, match = run_battery(make_battery_of(tests, metric))
+        cascade_score, cascade_match, skipped_count = run_cascade(tests, metric)
+        assert cascade_match == match
+        assert (cascade_score >= 0.5) == (score >= 0.5)
+        if skipped_count == 0:
+            assert cascade_score == score
+
+
+def make_battery_of(tests: list, metric: dict) -> list:
+    return [(metric[name], y, op, weight) for name, y, op, weight in tests]